@@ -0,0 +1,38 @@
+import argparse
+import sys
+from pathlib import Path
+
+from cc3d_standin.benchmark import run_benchmarks, compare_to_baseline, save_results, load_results, MODELS
+
+parser = argparse.ArgumentParser(description="Times ConstraintsSteppable.start, SecretionUptakeSteppable.step and "
+                                             "PhenotypeSteppable.step of the example translations at increasing cell "
+                                             "counts in the headless CC3D stand-in, and fails if they are slower than "
+                                             "the baseline.")
+parser.add_argument("-m", "--models", type=str, nargs="+", default=None,
+                    help=f"(optional) models to time, names ({', '.join(MODELS.keys())}) or paths. Default all the "
+                         f"example translations")
+parser.add_argument("-c", "--cells", type=int, nargs="+", default=[100, 1000, 4000],
+                    help="(optional) cell counts. Default 100 1000 4000")
+parser.add_argument("-n", "--mcs", type=int, default=5, help="(optional) number of MCS timed. Default 5")
+parser.add_argument("-r", "--repeats", type=int, default=5, help="(optional) repeats, the best is kept. Default 5")
+parser.add_argument("-b", "--baseline", type=str, default=str(Path(__file__).parent.joinpath("benchmarks",
+                                                                                              "baseline.json")),
+                    help="(optional) baseline file. Default benchmarks/baseline.json")
+parser.add_argument("-t", "--threshold", type=float, default=0.3,
+                    help="(optional) relative slowdown counted as a regression. Default 0.3")
+parser.add_argument("--save", action="store_true", help="(optional) save the results as the new baseline")
+args = parser.parse_args()
+
+results = run_benchmarks(args.models, args.cells, mcs=args.mcs, repeats=args.repeats)
+if args.save:
+    Path(args.baseline).parent.mkdir(parents=True, exist_ok=True)
+    save_results(results, args.baseline)
+    print(f"Saved the baseline to {args.baseline}")
+elif not Path(args.baseline).exists():
+    print(f"No baseline at {args.baseline}, run with --save to create it")
+else:
+    regressions = compare_to_baseline(results, load_results(args.baseline), threshold=args.threshold)
+    if regressions:
+        print("______________\nREGRESSIONS:\n" + "\n".join(regressions))
+        sys.exit(1)
+    print("______________\nNo regressions")
@@ -0,0 +1,27 @@
+import argparse
+
+from cpm_pilot import calibrate
+
+parser = argparse.ArgumentParser(description="Calibrates the Potts temperature and the volume lambda of a converted "
+                                             "CompuCell3D simulation with short pilot runs of a minimal cellular Potts "
+                                             "model.")
+parser.add_argument("input", type=str, help="Path to the converted CC3DML file (Simulation/<name>.xml)")
+parser.add_argument("-f", "--fluctuation", type=float, default=None,
+                    help="(optional) target standard deviation of the relative cell volume fluctuations")
+parser.add_argument("-d", "--diffusivity", type=float, default=None,
+                    help="(optional) target cell diffusion coefficient in pixels^2/MCS")
+parser.add_argument("-t", "--temperatures", type=float, nargs="+", default=[2, 5, 10, 20, 50],
+                    help="(optional) temperatures to try")
+parser.add_argument("-l", "--lambdas", type=float, nargs="+", default=[1, 4, 16, 64],
+                    help="(optional) volume lambdas (of the full resolution lattice) to try")
+parser.add_argument("-m", "--mcs", type=int, default=200, help="(optional) number of MCS of each pilot run")
+parser.add_argument("--downsample", type=int, default=1, help="(optional) down-sampling factor of the pilot lattice")
+parser.add_argument("--maxside", type=int, default=200,
+                    help="(optional) largest number of pixels per side of the pilot lattice")
+parser.add_argument("--seed", type=int, default=0, help="(optional) random seed")
+args = parser.parse_args()
+best, _ = calibrate(args.input, args.temperatures, args.lambdas, target_fluctuation=args.fluctuation,
+                    target_diffusivity=args.diffusivity, mcs=args.mcs, downsample=args.downsample,
+                    max_side=args.maxside, seed=args.seed)
+print(f"______________\nBest: <Temperature>{best['temperature']}</Temperature>, "
+      f"cell.lambdaVolume = {best['lambda_volume']}")
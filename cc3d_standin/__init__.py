@@ -0,0 +1,2 @@
+from .simulation import Simulation, install, load_simulation
+from .steppables import SteppableBasePy, MitosisSteppableBase
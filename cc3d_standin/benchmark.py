@@ -0,0 +1,178 @@
+import gc
+import json
+import warnings
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from cc3d_standin.simulation import load_simulation
+
+_examples = Path(__file__).parent.parent.joinpath("example-translations")
+
+MODELS = {"biorobots": _examples.joinpath("biorobots", "biorobots_flat"),
+          "biorobots_mod": _examples.joinpath("biorobots", "biorobots_flat_mod"),
+          "cell_cycle": _examples.joinpath("cell_cycle", "cell_cycle"),
+          "cell_cycle_mod": _examples.joinpath("cell_cycle", "cell_cycle_mod")}
+
+# {steppable: method} timed
+STEPPABLES = {"ConstraintsSteppable": "start", "SecretionUptakeSteppable": "step", "PhenotypeSteppable": "step"}
+
+
+def reference_time(repeats=20):
+    """
+    Time of a fixed Python and NumPy workload, used to compare timings measured on different machines
+    """
+    best = np.inf
+    values = np.arange(1000, dtype=float)
+    for _ in range(repeats):
+        start = perf_counter()
+        total = 0.0
+        for i in range(20000):
+            total += values[i % 1000] * 0.5
+        for _ in range(2000):
+            total += float(values[::3].sum())
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def benchmark_model(path, n_cells, mcs=5, repeats=5, seed=0):
+    """
+    Times the steppables of STEPPABLES of a converted model in the stand-in, with `n_cells` cells on a grid.
+
+    Each measurement loads the model again (so start runs on a fresh simulation), times the start of every steppable
+    and then `mcs` MCS. The best of `repeats` measurements is kept.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The model's .cc3d file or folder
+    n_cells : int
+        Number of cells placed before the steppables start
+    mcs : int, optional
+        Number of MCS timed. Default 5
+    repeats : int, optional
+        Number of measurements. Default 5
+    seed : int, optional
+        Random seed. Default 0
+
+    Returns
+    -------
+    dict
+        {"<steppable>.<method>": seconds per call} of the timed steppables the model has
+    """
+    best = {}
+    for _ in range(repeats):
+        # the translated models print as they run
+        gc.collect()
+        with redirect_stdout(StringIO()):
+            times = _measure(path, n_cells, mcs, seed)
+        for name, method in STEPPABLES.items():
+            key = f"{name}.{method}"
+            if key in times.keys():
+                best[key] = min(best.get(key, np.inf), times[key])
+    return best
+
+
+def _measure(path, n_cells, mcs, seed):
+    simulation = load_simulation(path, seed=seed, initialize=False)
+    simulation.seed_cells(n_cells)
+    times = {}
+    for steppable in simulation.steppables:
+        start = perf_counter()
+        steppable.start()
+        times[f"{type(steppable).__name__}.start"] = perf_counter() - start
+    # index the cells' pixels outside of the timings, CC3D tracks them as the lattice changes
+    for cell in simulation.inventory:
+        simulation.inventory.pixels(cell)
+        break
+    for _ in range(mcs):
+        simulation.step()
+    for name, (calls, seconds) in simulation.timings.items():
+        times[f"{name}.step"] = seconds / max(calls, 1)
+    simulation.finish()
+    return times
+
+
+def run_benchmarks(models=None, cell_counts=(100, 1000, 4000), mcs=5, repeats=5, seed=0):
+    """
+    Runs benchmark_model for every model and cell count
+
+    Returns
+    -------
+    dict
+        {"reference": reference_time(), "phenocellpy": phenocellpy_installed(), "results": {model: {cell count:
+        timings}}}
+    """
+    phenocellpy = phenocellpy_installed()
+    if not phenocellpy:
+        warnings.warn("WARNING: PhenoCellPy isn't installed, the phenotype parts of the steppables are skipped and "
+                      "not timed")
+    # measured first, a large heap left by the models slows it down
+    reference = reference_time()
+    models = MODELS if models is None else {name: MODELS.get(name, name) for name in models}
+    results = {}
+    for model, path in models.items():
+        results[model] = {}
+        for n_cells in cell_counts:
+            results[model][str(n_cells)] = benchmark_model(path, n_cells, mcs=mcs, repeats=repeats, seed=seed)
+            timings = ", ".join(f"{key}={1e3 * value:.4g} ms" for key, value in results[model][str(n_cells)].items())
+            print(f"{model}, {n_cells} cells: {timings}")
+    return {"reference": reference, "phenocellpy": phenocellpy, "results": results}
+
+
+def compare_to_baseline(current, baseline, threshold=0.3, noise_floor=0.05, resolution=1e-5):
+    """
+    Compares benchmark results to a baseline. Baseline timings are scaled by the ratio of the reference times of the
+    two machines. A timing regresses if it is more than `threshold` (relative) slower and the slowdown is larger than
+    the noise, `noise_floor` times the measured time but at least `resolution` seconds.
+
+    PhenotypeSteppable.step only runs the phenotype models when PhenoCellPy is installed, so it is not compared (with a
+    warning) if one of the results was measured with PhenoCellPy and the other without. Results saved without the
+    "phenocellpy" entry were measured without it.
+
+    Returns
+    -------
+    list
+        One message per regression
+    """
+    scale = current["reference"] / baseline["reference"]
+    skip = set()
+    if current.get("phenocellpy", False) != baseline.get("phenocellpy", False):
+        skip.add("PhenotypeSteppable.step")
+        with_phenocellpy = "benchmark" if current.get("phenocellpy", False) else "baseline"
+        warnings.warn(f"WARNING: PhenotypeSteppable.step isn't compared, only the {with_phenocellpy} was measured with "
+                      f"PhenoCellPy")
+    regressions = []
+    for model, counts in baseline["results"].items():
+        for n_cells, timings in counts.items():
+            measured = current["results"].get(model, {}).get(n_cells, {})
+            for key, expected in timings.items():
+                if key not in measured.keys() or key in skip:
+                    continue
+                expected *= scale
+                noise = max(noise_floor * measured[key], resolution)
+                if measured[key] > expected * (1 + threshold) and measured[key] - expected > noise:
+                    regressions.append(f"{model}, {n_cells} cells, {key}: {1e3 * measured[key]:.4g} ms, baseline "
+                                       f"{1e3 * expected:.4g} ms (+{100 * (measured[key] / expected - 1):.0f}%)")
+    return regressions
+
+
+def phenocellpy_installed():
+    try:
+        import PhenoCellPy
+    except ImportError:
+        return False
+    return True
+
+
+def save_results(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    with open(path, "r") as f:
+        return json.load(f)
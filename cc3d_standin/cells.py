@@ -0,0 +1,205 @@
+from copy import deepcopy
+
+import numpy as np
+
+
+class Pixel:
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+class PixelTracker:
+    def __init__(self, x, y, z):
+        self.pixel = Pixel(x, y, z)
+
+
+class Cell:
+    """
+    Stand-in for CC3D's CellG. The volume is kept up to date by the cell field, the center of mass and surface are
+    computed from the cell's pixels when read.
+    """
+
+    def __init__(self, inventory, cell_id, cell_type):
+        self._inventory = inventory
+        self.id = cell_id
+        self.clusterId = cell_id
+        self.type = cell_type
+        self.volume = 0
+        self.targetVolume = 0.0
+        self.lambdaVolume = 0.0
+        self.targetSurface = 0.0
+        self.lambdaSurface = 0.0
+        self.lambdaVecX = 0.0
+        self.lambdaVecY = 0.0
+        self.lambdaVecZ = 0.0
+        self.dict = {}
+
+    def _center_of_mass(self, axis):
+        pixels = self._inventory.pixels(self)
+        if not pixels.size:
+            return 0.0
+        return float(np.mean(np.unravel_index(pixels, self._inventory.lattice.shape)[axis]))
+
+    @property
+    def xCOM(self):
+        return self._center_of_mass(0)
+
+    @property
+    def yCOM(self):
+        return self._center_of_mass(1)
+
+    @property
+    def zCOM(self):
+        return self._center_of_mass(2)
+
+    @property
+    def surface(self):
+        return sum(count for _, count in self._inventory.neighbor_data(self))
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return f"Cell(id={self.id}, type={self.type}, volume={self.volume})"
+
+
+class CellInventory:
+    """
+    The cells and the lattice of cell IDs (0 is the medium).
+
+    The pixels of every cell are indexed at once (one sort of the lattice) the first time they are needed after the
+    lattice changed, so loops over the cells don't scan the lattice once per cell.
+
+    Parameters
+    ----------
+    dims : tuple
+        Lattice dimensions (x, y, z)
+    """
+
+    def __init__(self, dims):
+        self.lattice = np.zeros(dims, dtype=np.int64)
+        self.cells = {}
+        self._next_id = 1
+        self._pixels = None
+        self._offsets = [(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0)]
+        if dims[2] > 1:
+            self._offsets += [(0, 0, 1), (0, 0, -1)]
+
+    def __iter__(self):
+        return iter(list(self.cells.values()))
+
+    def __len__(self):
+        return len(self.cells)
+
+    def new_cell(self, cell_type):
+        cell = Cell(self, self._next_id, cell_type)
+        self.cells[cell.id] = cell
+        self._next_id += 1
+        return cell
+
+    def delete_cell(self, cell):
+        pixels = self.pixels(cell)
+        self.lattice.reshape(-1)[pixels] = 0
+        cell.volume = 0
+        self.cells.pop(cell.id, None)
+        self._pixels = None
+
+    def get(self, cell_id):
+        return self.cells.get(int(cell_id)) if cell_id else None
+
+    def by_type(self, types):
+        return [cell for cell in self.cells.values() if cell.type in types]
+
+    def assign(self, key, cell):
+        """
+        Sets lattice[key] to `cell` (None for the medium), updating the volumes
+        """
+        region = self.lattice[key]
+        new_id = 0 if cell is None else cell.id
+        old_ids, counts = np.unique(region, return_counts=True)
+        for old_id, count in zip(old_ids, counts):
+            if old_id and old_id in self.cells.keys():
+                self.cells[old_id].volume -= int(count)
+        if cell is not None:
+            cell.volume += int(np.size(region))
+        self.lattice[key] = new_id
+        self._pixels = None
+
+    def pixels(self, cell):
+        """
+        Returns the flat lattice indices of the pixels of `cell`
+        """
+        if self._pixels is None:
+            flat = self.lattice.reshape(-1)
+            order = np.argsort(flat, kind="stable")
+            bounds = np.concatenate(([0], np.cumsum(np.bincount(flat, minlength=self._next_id))))
+            self._pixels = (order, bounds)
+        order, bounds = self._pixels
+        if cell.id + 1 >= len(bounds):
+            return np.zeros(0, dtype=np.int64)
+        return order[bounds[cell.id]:bounds[cell.id + 1]]
+
+    def neighbor_data(self, cell):
+        """
+        Returns [(neighbor or None for the medium, number of shared pixel faces)], first order neighbors
+        """
+        coordinates = np.unravel_index(self.pixels(cell), self.lattice.shape)
+        neighbors = []
+        for offset in self._offsets:
+            shifted = [c + o for c, o in zip(coordinates, offset)]
+            inside = np.ones(len(shifted[0]), dtype=bool)
+            for axis, c in enumerate(shifted):
+                inside &= (c >= 0) & (c < self.lattice.shape[axis])
+            neighbors.append(self.lattice[tuple(c[inside] for c in shifted)])
+        neighbors = np.concatenate(neighbors)
+        ids, counts = np.unique(neighbors[neighbors != cell.id], return_counts=True)
+        return [(self.get(i), int(count)) for i, count in zip(ids, counts)]
+
+    def clone_attributes(self, source, target, no_clone_keys=()):
+        for attribute in ("type", "targetVolume", "lambdaVolume", "targetSurface", "lambdaSurface", "lambdaVecX",
+                          "lambdaVecY", "lambdaVecZ"):
+            setattr(target, attribute, getattr(source, attribute))
+        target.dict = {key: deepcopy(value) for key, value in source.dict.items() if key not in no_clone_keys}
+
+
+class CellField:
+    """
+    Stand-in for CC3D's cell field: cell_field[x, y, z] returns the cell (None for the medium), cell_field[slices] =
+    cell paints a box
+    """
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+
+    def __getitem__(self, key):
+        return self.inventory.get(self.inventory.lattice[key])
+
+    def __setitem__(self, key, cell):
+        self.inventory.assign(key, cell)
+
+
+class CellList:
+    def __init__(self, inventory, types=None):
+        self.inventory = inventory
+        self.types = types
+
+    def __iter__(self):
+        if self.types is None:
+            return iter(self.inventory)
+        return iter(self.inventory.by_type(self.types))
+
+    def __len__(self):
+        if self.types is None:
+            return len(self.inventory)
+        return len(self.inventory.by_type(self.types))
+
+
+class CellNeighborDataList(list):
+    def neighbor_count_by_type(self):
+        counts = {}
+        for neighbor, _ in self:
+            neighbor_type = 0 if neighbor is None else neighbor.type
+            counts[neighbor_type] = counts.get(neighbor_type, 0) + 1
+        return counts
@@ -0,0 +1,284 @@
+import csv
+import multiprocessing
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import xmltodict as x2d
+
+from cc3d_standin.simulation import load_simulation
+from conversions.physicell_output import read_cc3d_units, pixels_to_volume, stream_cc3d_output, summary_statistics
+
+# long format, the metrics (cell types, fields) differ between models
+COLUMNS = ["model", "replicate", "seed", "attempt", "mcs", "metric", "value"]
+
+
+def replicate_seeds(n_replicates, seed=0):
+    """
+    Independent seeds for `n_replicates` runs, spawned from `seed`. Replicate i gets the same seed in every model of
+    a sweep, so the variants are compared on common random numbers.
+    """
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n_replicates)]
+
+
+def _find_cc3d(path):
+    path = Path(path)
+    return next(path.glob("*.cc3d")) if path.is_dir() else path
+
+
+def _cc3dml(cc3d_file):
+    with open(cc3d_file, "r") as f:
+        return cc3d_file.parent.joinpath(x2d.parse(f.read())["Simulation"]["XMLScript"]["#text"])
+
+
+def standin_snapshot(simulation, pixel_to_space, is_2D):
+    """
+    Cell positions, types and volumes of a stand-in simulation in PhysiCell units, like
+    conversions.physicell_output.read_cc3d_pif, computed from the lattice in one pass
+    """
+    lattice = simulation.inventory.lattice
+    ids = lattice.ravel()
+    counts = np.bincount(ids)
+    cell_ids = np.nonzero(counts)[0]
+    cell_ids = cell_ids[cell_ids > 0]
+    positions = np.zeros((len(cell_ids), 3))
+    for axis, size in enumerate(lattice.shape):
+        shape = [1, 1, 1]
+        shape[axis] = size
+        coordinate = np.broadcast_to(np.arange(size).reshape(shape) + 0.5, lattice.shape).ravel()
+        positions[:, axis] = np.bincount(ids, weights=coordinate, minlength=len(counts))[cell_ids] / counts[cell_ids]
+    positions /= pixel_to_space
+    if is_2D:
+        positions[:, 2] = 0
+    types = np.array([simulation.types[simulation.inventory.get(int(i)).type] for i in cell_ids])
+    return {"positions": positions, "types": types,
+            "volumes": pixels_to_volume(counts[cell_ids], pixel_to_space, is_2D), "substrates": {}}
+
+
+def _pin(cpu):
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+
+
+def _pin_worker(cpus, slots):
+    # each worker process takes the next slot once, so concurrent runs never share a CPU (if there are enough)
+    with slots.get_lock():
+        slot = slots.value
+        slots.value += 1
+    _pin(cpus[slot % len(cpus)])
+
+
+def _replicate_environment(environment, output_dir):
+    # replicates never restart from a checkpoint (it would replace their seed) and never share a checkpoint folder
+    environment = dict(environment, PC2CC3D_RESTART="0")
+    environment.pop("PC2CC3D_SEGMENT_MCS", None)
+    if output_dir is None:
+        environment.pop("PC2CC3D_CHECKPOINT_DIR", None)
+    else:
+        environment["PC2CC3D_CHECKPOINT_DIR"] = str(Path(output_dir).resolve().joinpath("checkpoints"))
+    return environment
+
+
+def seed_model(cc3d_file, seed, directory):
+    """
+    Copies the model of `cc3d_file` (its folder, without the checkpoints of earlier runs) to `directory` with `seed` as
+    the <RandomSeed> of its CC3DML, and returns the copy's .cc3d file
+    """
+    cc3d_file = Path(cc3d_file)
+    directory = Path(directory)
+    if directory.exists():
+        shutil.rmtree(directory)
+    shutil.copytree(cc3d_file.parent, directory, ignore=shutil.ignore_patterns("checkpoints"))
+    cc3dml = _cc3dml(directory.joinpath(cc3d_file.name))
+    with open(cc3dml, "r") as f:
+        xml = f.read()
+    # edited as text, parsing and writing the CC3DML back would drop its comments
+    seed_str = f"<RandomSeed>{seed}</RandomSeed>"
+    if re.search(r"<RandomSeed>.*?</RandomSeed>", xml) is not None:
+        xml = re.sub(r"(<!--\s*)?<RandomSeed>.*?</RandomSeed>(\s*-->)?", seed_str, xml, count=1)
+    else:
+        xml = xml.replace("</Potts>", f"   {seed_str}\n</Potts>", 1)
+    with open(cc3dml, "w") as f:
+        f.write(xml)
+    return directory.joinpath(cc3d_file.name)
+
+
+def run_replicate(path, replicate, seed, mcs=None, sample_every=None, n_cells=None, output_dir=None, cpu=None,
+                  command=None):
+    """
+    Runs one replicate of a converted model and returns its summary metrics (see
+    conversions.physicell_output.summary_statistics) as [(mcs, {metric: value})].
+
+    Without `command` the model runs in the stand-in, sampled every `sample_every` MCS and at the end. With `command`
+    (e.g. "runScript -i {cc3d} -o {output}") CompuCell3D runs a copy of the model (<output_dir>_model, see seed_model)
+    in a subprocess, with the seed as the CC3DML's <RandomSeed> and in the PC2CC3D_SEED environment variable, and the
+    metrics are read from its PIF dumps. Replicates never restart from a checkpoint, the checkpoints of models
+    converted with --checkpoint go to <output_dir>/checkpoints (not saved without `output_dir`).
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The model's .cc3d file or folder
+    replicate : int
+        Index of the replicate
+    seed : int
+        Random seed of the run
+    mcs : int, optional
+        Number of MCS of stand-in runs. Default the CC3DML's Steps
+    sample_every : int, optional
+        Sampling interval of stand-in runs. Default only at the end
+    n_cells : int, optional
+        Replace the initial cells of stand-in runs with this many cells. Default None
+    output_dir : str or pathlib.Path, optional
+        Output folder of the run. Required with `command`
+    cpu : int, optional
+        CPU to pin the run to. Default no pinning
+    command : str, optional
+        Command running CompuCell3D, with {cc3d} and {output} placeholders. Default None, run in the stand-in
+    """
+    _pin(cpu)
+    cc3d_file = _find_cc3d(path)
+    pixel_to_space, time_per_mcs, is_2D = read_cc3d_units(_cc3dml(cc3d_file))
+    if output_dir is not None:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+    start = perf_counter()
+
+    if command is not None:
+        seeded = seed_model(cc3d_file, seed, Path(output_dir).parent.joinpath(f"{Path(output_dir).name}_model"))
+        env = dict(_replicate_environment(os.environ, output_dir), PC2CC3D_SEED=str(seed))
+        arguments = shlex.split(command.format(cc3d=seeded.resolve(), output=Path(output_dir).resolve()))
+        subprocess.run(arguments, env=env, check=True, stdout=subprocess.DEVNULL)
+        samples = []
+        for snapshot in stream_cc3d_output(output_dir, pixel_to_space, time_per_mcs, is_2D=is_2D, substrates=False):
+            samples.append((int(round(snapshot["time"] / time_per_mcs)), summary_statistics(snapshot)))
+        if samples:
+            samples[-1][1]["wall time"] = perf_counter() - start
+        return samples
+
+    samples = []
+
+    def sample(simulation):
+        snapshot = standin_snapshot(simulation, pixel_to_space, is_2D)
+        snapshot["time"] = max(simulation.mcs, 0) * time_per_mcs
+        samples.append((max(simulation.mcs, 0), summary_statistics(snapshot)))
+
+    # the stand-in runs in this process, its steppables read the environment of the process
+    environment = _replicate_environment(os.environ, output_dir)
+    for key in set(os.environ.keys()) - set(environment.keys()):
+        del os.environ[key]
+    os.environ.update(environment)
+    # the translated models print as they run
+    with redirect_stdout(StringIO()):
+        simulation = load_simulation(cc3d_file, output_dir=None if output_dir is None else str(output_dir),
+                                     seed=seed, initialize=n_cells is None)
+        if n_cells is not None:
+            simulation.seed_cells(n_cells)
+        simulation.start()
+        for _ in range(simulation.steps if mcs is None else mcs):
+            simulation.step()
+            if simulation.stopped:
+                break
+            if sample_every and simulation.mcs % sample_every == 0:
+                sample(simulation)
+        simulation.finish()
+    if not samples or samples[-1][0] != simulation.mcs:
+        sample(simulation)
+    samples[-1][1]["wall time"] = perf_counter() - start
+    return samples
+
+
+def _run(task):
+    # exceptions are returned, not raised, so the traceback of a failed run reaches the parent intact
+    try:
+        return run_replicate(**task), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def run_ensemble(models, n_replicates, output, seed=0, workers=None, cpus=None, max_retries=2, **kwargs):
+    """
+    Runs `n_replicates` replicates of every model in a process pool and streams their summary metrics to one csv
+    (COLUMNS, one row per metric) as the runs finish. Failed runs are retried up to `max_retries` times with the same
+    seed.
+
+    Parameters
+    ----------
+    models : dict or list
+        {name: .cc3d file or folder}, or a list of them (e.g. the variants of a sweep) named after their folders
+    n_replicates : int
+        Number of replicates per model
+    output : str or pathlib.Path
+        The aggregated csv
+    seed : int, optional
+        Seed the replicate seeds are spawned from (see replicate_seeds). Default 0
+    workers : int, optional
+        Number of processes. Default the number of CPUs available
+    cpus : list, optional
+        CPUs to pin the runs to, one per worker process (round robin if there are more workers than CPUs). Default the
+        CPUs available to this process
+    max_retries : int, optional
+        Number of retries of a failed run. Default 2
+    **kwargs
+        Passed to run_replicate (mcs, sample_every, n_cells, command). An `output_dir` is the root folder of the
+        runs' outputs, <output_dir>/<model>/replicate_<i> (and the seeded copies of the models run by `command`,
+        <output_dir>/<model>/replicate_<i>_model)
+
+    Returns
+    -------
+    list
+        (model, replicate, traceback) of the runs that failed every attempt
+    """
+    if not isinstance(models, dict):
+        models = {Path(path).name if Path(path).is_dir() else Path(path).parent.name: path for path in models}
+    if cpus is None and hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    if workers is None:
+        workers = len(cpus) if cpus else os.cpu_count()
+    output_root = kwargs.pop("output_dir", None)
+    if kwargs.get("command") is not None and output_root is None:
+        raise ValueError("CompuCell3D runs need an output folder for their PIF dumps")
+
+    seeds = replicate_seeds(n_replicates, seed)
+    tasks = {}
+    for name, path in models.items():
+        for replicate, replicate_seed in enumerate(seeds):
+            output_dir = None if output_root is None else Path(output_root).joinpath(name, f"replicate_{replicate}")
+            tasks[(name, replicate)] = dict(path=path, replicate=replicate, seed=replicate_seed, output_dir=output_dir,
+                                            **kwargs)
+
+    failed = []
+    pinning = dict(initializer=_pin_worker, initargs=(cpus, multiprocessing.Value("i", 0))) if cpus else {}
+    with open(output, "w", newline="") as f, ProcessPoolExecutor(max_workers=workers, **pinning) as pool:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        attempts = {key: 0 for key in tasks.keys()}
+        pending = {pool.submit(_run, task): key for key, task in tasks.items()}
+        while pending:
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                samples, error = future.result()
+                if error is not None:
+                    attempts[key] += 1
+                    if attempts[key] <= max_retries:
+                        print(f"{key[0]} replicate {key[1]} failed, retrying ({attempts[key]}/{max_retries})")
+                        pending[pool.submit(_run, tasks[key])] = key
+                    else:
+                        print(f"{key[0]} replicate {key[1]} failed:\n{error}")
+                        failed.append((key[0], key[1], error))
+                    continue
+                for mcs, metrics in samples:
+                    for metric, value in metrics.items():
+                        writer.writerow([key[0], key[1], tasks[key]["seed"], attempts[key], mcs, metric, value])
+                f.flush()
+                print(f"{key[0]} replicate {key[1]} done")
+    return failed
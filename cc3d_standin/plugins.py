@@ -0,0 +1,154 @@
+import numpy as np
+
+
+class ConcentrationField:
+    """
+    Stand-in for a CC3D concentration field, a NumPy array indexed like the lattice. Nothing diffuses it.
+    """
+
+    def __init__(self, name, dims):
+        self.name = name
+        self.array = np.zeros(dims)
+
+    def __getitem__(self, key):
+        return self.array[key]
+
+    def __setitem__(self, key, value):
+        self.array[key] = value
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+
+class FieldSecretor:
+    """
+    Stand-in for CC3D's field secretor, with the per cell secretion and uptake the generated steppables use
+    """
+
+    def __init__(self, field, inventory):
+        self.field = field
+        self.inventory = inventory
+
+    def _values(self):
+        return self.field.array.reshape(-1)
+
+    def amountSeenByCell(self, cell):
+        return float(self._values()[self.inventory.pixels(cell)].sum())
+
+    def secreteInsideCell(self, cell, amount):
+        self._values()[self.inventory.pixels(cell)] += amount
+        return True
+
+    def uptakeInsideCell(self, cell, max_amount, relative_uptake):
+        values = self._values()
+        pixels = self.inventory.pixels(cell)
+        values[pixels] -= np.minimum(values[pixels] * relative_uptake, max_amount)
+        return True
+
+    def totalFieldIntegral(self):
+        return float(self.field.array.sum())
+
+
+class ChemotaxisData:
+    def __init__(self):
+        self.lambda_ = 0.0
+        self.saturation = 0.0
+        self.towards_types = ""
+
+    def setLambda(self, lam):
+        self.lambda_ = lam
+
+    def getLambda(self):
+        return self.lambda_
+
+    def setSaturationCoef(self, coefficient):
+        self.saturation = coefficient
+
+    def setSaturationLinearCoef(self, coefficient):
+        self.saturation = coefficient
+
+    def assignChemotactTowardsVectorTypes(self, types):
+        self.towards_types = types
+
+
+class ChemotaxisPlugin:
+    """
+    Stores the per cell chemotaxis data, nothing moves the cells
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def addChemotaxisData(self, cell, field_name):
+        data = ChemotaxisData()
+        self.data[(cell.id, field_name)] = data
+        return data
+
+    def getChemotaxisData(self, cell, field_name):
+        return self.data.get((cell.id, field_name))
+
+
+class FocalPointPlasticityLink:
+    def __init__(self, cell0, cell1, lambda_distance, target_distance, max_distance):
+        self.cell0 = cell0
+        self.cell1 = cell1
+        self.lambda_distance = lambda_distance
+        self.target_distance = target_distance
+        self.max_distance = max_distance
+
+    def getObj0(self):
+        return self.cell0
+
+    def getObj1(self):
+        return self.cell1
+
+    def getOtherCell(self, cell):
+        return self.cell1 if cell is self.cell0 else self.cell0
+
+    def getLambdaDistance(self):
+        return self.lambda_distance
+
+    def setLambdaDistance(self, lambda_distance):
+        self.lambda_distance = lambda_distance
+
+    def getTargetDistance(self):
+        return self.target_distance
+
+    def setTargetDistance(self, target_distance):
+        self.target_distance = target_distance
+
+    def getMaxDistance(self):
+        return self.max_distance
+
+    def setMaxDistance(self, max_distance):
+        self.max_distance = max_distance
+
+
+class FocalPointPlasticityPlugin:
+    """
+    Stores the FPP links (indexed by cell), nothing pulls the cells
+    """
+
+    def __init__(self):
+        self.links = []
+        self.by_cell = {}
+
+    def createFocalPointPlasticityLink(self, cell0, cell1, lambda_distance, target_distance, max_distance):
+        link = FocalPointPlasticityLink(cell0, cell1, lambda_distance, target_distance, max_distance)
+        self.links.append(link)
+        self.by_cell.setdefault(cell0.id, []).append(link)
+        self.by_cell.setdefault(cell1.id, []).append(link)
+        return link
+
+    def deleteFocalPointPlasticityLink(self, link):
+        self.links.remove(link)
+        for cell in (link.cell0, link.cell1):
+            self.by_cell[cell.id].remove(link)
+
+    def links_by_cell(self, cell):
+        return list(self.by_cell.get(cell.id, ()))
+
+    def remove_cell(self, cell):
+        for link in self.links_by_cell(cell):
+            self.deleteFocalPointPlasticityLink(link)
@@ -0,0 +1,364 @@
+import os
+import runpy
+import sys
+import types as module_types
+import warnings
+from collections import OrderedDict
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import xmltodict as x2d
+
+from cc3d_standin.cells import CellField, CellInventory
+from cc3d_standin.plugins import ChemotaxisPlugin, ConcentrationField, FocalPointPlasticityPlugin
+from cc3d_standin.steppables import MitosisSteppableBase, SteppableBasePy
+
+# simulation the stand-in CompuCellSetup registers steppables to
+_current = None
+
+
+def _as_list(item):
+    if item is None:
+        return []
+    if isinstance(item, list):
+        return item
+    return [item]
+
+
+class Dimensions:
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @property
+    def shape(self):
+        return self.x, self.y, self.z
+
+
+class Fields:
+    """
+    self.field of the steppables, one ConcentrationField attribute per diffusing field
+    """
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+class XMLElement:
+    """
+    Stand-in for the CC3DML element adapter get_xml_element returns: cdata and the attributes (as items)
+    """
+
+    def __init__(self, element):
+        self.element = element
+
+    @property
+    def cdata(self):
+        return self.element.get("#text", "")
+
+    @cdata.setter
+    def cdata(self, value):
+        self.element["#text"] = str(value)
+
+    def __getitem__(self, attribute):
+        return self.element[f"@{attribute}"]
+
+    def __setitem__(self, attribute, value):
+        self.element[f"@{attribute}"] = str(value)
+
+
+def _find_by_id(node, element_id):
+    if isinstance(node, dict):
+        if node.get("@id") == element_id:
+            return node
+        children = node.values()
+    elif isinstance(node, list):
+        children = node
+    else:
+        return None
+    for child in children:
+        found = _find_by_id(child, element_id)
+        if found is not None:
+            return found
+    return None
+
+
+class Simulation:
+    """
+    Headless stand-in for a CC3D simulation, to run and profile the Python steppables of a converted model without
+    CompuCell3D.
+
+    It reads the lattice, cell types, diffusing fields and the Uniform/PIF initializers from the CC3DML, and gives the
+    steppables the subset of CC3D's Python API the converter and the example translations use. The lattice only
+    changes through Python (cell_field assignments, divisions and deletions): there is no Potts algorithm, and the
+    fields only change through the secretors, nothing diffuses them. Timings are therefore those of the Python hot
+    paths, not of a full CC3D run.
+
+    Parameters
+    ----------
+    cc3dml : str or pathlib.Path
+        Path to the CC3DML file
+    output_dir : str, optional
+        Output folder given to the steppables (self.output_dir). Default None, no output
+    seed : int, optional
+        Seed of the stand-in's random number generator (cell division orientation)
+    initialize : bool, optional
+        Lay out the cells of the Uniform/PIF initializers. Default True
+    """
+
+    def __init__(self, cc3dml, output_dir=None, seed=None, initialize=True):
+        self.cc3dml = Path(cc3dml)
+        with open(self.cc3dml, "r") as f:
+            self.xml = x2d.parse(f.read(), force_list=("Plugin", "Steppable", "CellType", "DiffusionField",
+                                                       "Region"))["CompuCell3D"]
+        potts = self.xml["Potts"]
+        self.dim = Dimensions(*(int(potts["Dimensions"][f"@{axis}"]) for axis in ("x", "y", "z")))
+        self.steps = int(potts["Steps"]) if "Steps" in potts.keys() else 0
+
+        plugins = {p["@Name"]: p for p in _as_list(self.xml.get("Plugin")) if p is not None}
+        self.types = ["Medium"]
+        if "CellType" in plugins.keys():
+            cell_types = sorted(_as_list(plugins["CellType"].get("CellType")), key=lambda t: int(t["@TypeId"]))
+            self.types = [t["@TypeName"] for t in cell_types]
+
+        field_names = []
+        for steppable in _as_list(self.xml.get("Steppable")):
+            for field in _as_list(steppable.get("DiffusionField")):
+                if field is not None and "@Name" in field.keys():
+                    field_names.append(field["@Name"])
+        self.field = Fields({name: ConcentrationField(name, self.dim.shape) for name in field_names})
+
+        self.inventory = CellInventory(self.dim.shape)
+        self.cell_field = CellField(self.inventory)
+        self.chemotaxis = ChemotaxisPlugin()
+        self.fpp = FocalPointPlasticityPlugin()
+        self.shared_steppable_vars = {}
+        self.output_dir = output_dir
+        self.rng = np.random.default_rng(seed)
+        self.steppables = []
+        self.stopped = False
+        self.mcs = -1
+        # {steppable class name: [calls, seconds]} of the step calls
+        self.timings = {}
+
+        if initialize:
+            self.initialize()
+
+    def get_xml_element(self, element_id):
+        element = _find_by_id(self.xml, element_id)
+        if element is None:
+            raise KeyError(f"No CC3DML element with id={element_id}")
+        return XMLElement(element)
+
+    def initialize(self):
+        """
+        Lays out the cells of the UniformInitializer and PIFInitializer steppables of the CC3DML
+        """
+        for steppable in _as_list(self.xml.get("Steppable")):
+            if steppable["@Type"] == "UniformInitializer":
+                for region in _as_list(steppable.get("Region")):
+                    self.uniform_region(region)
+            elif steppable["@Type"] == "PIFInitializer":
+                self.read_pif(self.cc3dml.parent.parent.joinpath(steppable["PIFName"]))
+
+    def uniform_region(self, region):
+        low = [int(region["BoxMin"][f"@{axis}"]) for axis in ("x", "y", "z")]
+        high = [int(region["BoxMax"][f"@{axis}"]) for axis in ("x", "y", "z")]
+        width = int(region.get("Width", 1))
+        gap = int(region.get("Gap", 0))
+        type_names = [t.strip() for t in region["Types"].split(",")]
+        type_ids = [self.types.index(t) for t in type_names if t in self.types]
+        index = 0
+        for x in range(low[0], min(high[0], self.dim.x) - width + 1, width + gap):
+            for y in range(low[1], min(high[1], self.dim.y) - width + 1, width + gap):
+                for z in range(low[2], max(min(high[2], self.dim.z) - width + 1, low[2] + 1), width + gap):
+                    cell = self.inventory.new_cell(type_ids[self.rng.integers(len(type_ids))] if type_ids else 1)
+                    self.cell_field[x:x + width, y:y + width, z:min(z + width, self.dim.z)] = cell
+                    index += 1
+        return index
+
+    def read_pif(self, path):
+        if not Path(path).exists():
+            warnings.warn(f"WARNING: {path} not found, the simulation starts without its cells")
+            return
+        cells = {}
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 8 or not parts[0].isdigit():
+                    continue
+                cell_id, type_name = int(parts[0]), parts[1]
+                x0, x1, y0, y1, z0, z1 = (int(p) for p in parts[2:8])
+                if cell_id not in cells.keys():
+                    cells[cell_id] = self.inventory.new_cell(self.types.index(type_name))
+                self.cell_field[x0:x1 + 1, y0:y1 + 1, z0:z1 + 1] = cells[cell_id]
+
+    def seed_cells(self, n_cells, type_names=None, side=None):
+        """
+        Replaces the cells with `n_cells` square (cubic in 3D) cells on a regular grid centered in the lattice
+
+        Parameters
+        ----------
+        n_cells : int
+            Number of cells
+        type_names : list, optional
+            Cell types assigned in turn. Default all the types but the medium and the wall
+        side : int, optional
+            Cell side in pixels. Default the largest that fits
+
+        Returns
+        -------
+        int
+            Number of cells placed
+        """
+        for cell in list(self.inventory):
+            self.fpp.remove_cell(cell)
+            self.inventory.delete_cell(cell)
+        if type_names is None:
+            type_names = [t for t in self.types[1:] if t.upper() != "WALL"]
+        type_ids = [self.types.index(t) for t in type_names]
+        n_dims = 3 if self.dim.z > 1 else 2
+        per_side = int(np.ceil(n_cells ** (1 / n_dims)))
+        if side is None:
+            side = max(min(s for s in self.dim.shape[:n_dims]) // (per_side + 1), 1)
+        corners = [(s - per_side * side) // 2 for s in self.dim.shape[:n_dims]]
+        placed = 0
+        for index in np.ndindex(*(per_side,) * n_dims):
+            if placed == n_cells:
+                break
+            low = [max(c + i * side, 0) for c, i in zip(corners, index)]
+            key = tuple(slice(lo, lo + side) for lo in low)
+            if n_dims == 2:
+                key += (0,)
+            cell = self.inventory.new_cell(type_ids[placed % len(type_ids)])
+            self.cell_field[key] = cell
+            placed += 1
+        return placed
+
+    def register_steppable(self, steppable=None, frequency=None):
+        if frequency is not None:
+            steppable.frequency = frequency
+        steppable._attach(self)
+        self.steppables.append(steppable)
+
+    def start(self):
+        for steppable in self.steppables:
+            steppable.start()
+
+    def step(self, mcs=None):
+        """
+        Runs one MCS of the steppables (each according to its frequency)
+        """
+        self.mcs = self.mcs + 1 if mcs is None else mcs
+        for steppable in self.steppables:
+            if self.mcs % max(int(steppable.frequency), 1) == 0:
+                steppable.mcs = self.mcs
+                start = perf_counter()
+                steppable.step(self.mcs)
+                timing = self.timings.setdefault(type(steppable).__name__, [0, 0.0])
+                timing[0] += 1
+                timing[1] += perf_counter() - start
+
+    def finish(self):
+        for steppable in self.steppables:
+            if self.stopped:
+                steppable.on_stop()
+            else:
+                steppable.finish()
+
+    def run(self, steps=None):
+        """
+        Runs start, `steps` MCS (default the CC3DML's Steps) and finish
+        """
+        self.start()
+        for _ in range(self.steps if steps is None else steps):
+            self.step()
+            if self.stopped:
+                break
+        self.finish()
+
+
+def install():
+    """
+    Makes `cc3d`, `cc3d.CompuCellSetup`, `cc3d.core.PySteppables` and `cc3d.cpp.PlayerPython` importable as the
+    stand-in. This shadows a real CompuCell3D for the rest of the process.
+    """
+    compucell_setup = module_types.ModuleType("cc3d.CompuCellSetup")
+    compucell_setup.register_steppable = lambda steppable=None, frequency=None: \
+        _current.register_steppable(steppable, frequency)
+    compucell_setup.run = lambda *args, **kwargs: None
+
+    py_steppables = module_types.ModuleType("cc3d.core.PySteppables")
+    py_steppables.SteppableBasePy = SteppableBasePy
+    py_steppables.MitosisSteppableBase = MitosisSteppableBase
+    # CC3D's PySteppables doesn't define __all__, scripts get its imports from the star import too
+    py_steppables.OrderedDict = OrderedDict
+    py_steppables.__all__ = ["SteppableBasePy", "MitosisSteppableBase", "OrderedDict"]
+
+    player_python = module_types.ModuleType("cc3d.cpp.PlayerPython")
+    player_python.__all__ = []
+
+    cc3d = module_types.ModuleType("cc3d")
+    cc3d.CompuCellSetup = compucell_setup
+    core = module_types.ModuleType("cc3d.core")
+    core.PySteppables = py_steppables
+    cpp = module_types.ModuleType("cc3d.cpp")
+    cpp.PlayerPython = player_python
+    cc3d.core = core
+    cc3d.cpp = cpp
+    sys.modules.update({"cc3d": cc3d, "cc3d.CompuCellSetup": compucell_setup, "cc3d.core": core,
+                        "cc3d.core.PySteppables": py_steppables, "cc3d.cpp": cpp,
+                        "cc3d.cpp.PlayerPython": player_python})
+
+
+def load_simulation(path, output_dir=None, seed=None, initialize=True):
+    """
+    Loads a converted simulation in the stand-in: reads its CC3DML and runs its main Python script, which registers
+    the steppables. Run it with Simulation.run, or call start/step/finish.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The .cc3d file, or the folder containing it
+    output_dir : str, optional
+        Output folder given to the steppables. Default None
+    seed : int, optional
+        Random seed, also used for numpy's global generator the steppables use and as PC2CC3D_SEED, the seed of the
+        converted steppables' random streams
+    initialize : bool, optional
+        Lay out the cells of the CC3DML's initializers. Default True
+
+    Returns
+    -------
+    Simulation
+        The loaded simulation
+    """
+    global _current
+    path = Path(path)
+    if path.is_dir():
+        path = next(path.glob("*.cc3d"))
+    with open(path, "r") as f:
+        project = x2d.parse(f.read(), force_list=("Resource",))["Simulation"]
+    cc3dml = path.parent.joinpath(project["XMLScript"]["#text"])
+    main_py = path.parent.joinpath(project["PythonScript"]["#text"])
+
+    install()
+    if seed is not None:
+        np.random.seed(seed)
+        os.environ["PC2CC3D_SEED"] = str(seed)
+    _current = Simulation(cc3dml, output_dir=output_dir, seed=seed, initialize=initialize)
+
+    # the scripts import each other by name, forget modules of a previously loaded simulation
+    for script in main_py.parent.glob("*.py"):
+        sys.modules.pop(script.stem, None)
+    sys.path.insert(0, str(main_py.parent))
+    try:
+        runpy.run_path(str(main_py), run_name="__main__")
+    finally:
+        sys.path.remove(str(main_py.parent))
+    return _current
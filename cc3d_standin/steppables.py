@@ -0,0 +1,165 @@
+import numpy as np
+
+from cc3d_standin.cells import CellList, CellNeighborDataList, PixelTracker
+from cc3d_standin.plugins import FieldSecretor
+
+
+class SteppableBasePy:
+    """
+    Stand-in for cc3d.core.PySteppables.SteppableBasePy. The simulation attaches itself with `_attach` when the
+    steppable is registered.
+    """
+
+    def __init__(self, frequency=1):
+        self.frequency = frequency
+        self.mcs = -1
+        self._simulation = None
+
+    def _attach(self, simulation):
+        self._simulation = simulation
+        self.dim = simulation.dim
+        self.cell_field = simulation.cell_field
+        self.cell_list = CellList(simulation.inventory)
+        self.field = simulation.field
+        self.shared_steppable_vars = simulation.shared_steppable_vars
+        self.chemotaxisPlugin = simulation.chemotaxis
+        self.focalPointPlasticityPlugin = simulation.fpp
+        self.output_dir = simulation.output_dir
+        for type_id, type_name in enumerate(simulation.types):
+            setattr(self, type_name.upper(), type_id)
+
+    def start(self):
+        pass
+
+    def step(self, mcs):
+        pass
+
+    def finish(self):
+        pass
+
+    def on_stop(self):
+        pass
+
+    def stop_simulation(self):
+        self._simulation.stopped = True
+
+    def get_xml_element(self, tag):
+        return self._simulation.get_xml_element(tag)
+
+    def cell_list_by_type(self, *types):
+        return CellList(self._simulation.inventory, types)
+
+    def new_cell(self, cell_type=0):
+        return self._simulation.inventory.new_cell(cell_type)
+
+    def delete_cell(self, cell):
+        self._simulation.fpp.remove_cell(cell)
+        self._simulation.inventory.delete_cell(cell)
+
+    def fetch_cell_by_id(self, cell_id):
+        return self._simulation.inventory.get(cell_id)
+
+    def get_cell_pixel_list(self, cell):
+        coordinates = np.unravel_index(self._simulation.inventory.pixels(cell), self.dim.shape)
+        return [PixelTracker(int(x), int(y), int(z)) for x, y, z in zip(*coordinates)]
+
+    def get_field_secretor(self, field_name):
+        return FieldSecretor(getattr(self.field, field_name), self._simulation.inventory)
+
+    def get_cell_neighbor_data_list(self, cell):
+        return CellNeighborDataList(self._simulation.inventory.neighbor_data(cell))
+
+    def build_wall(self, cell_type):
+        border = np.ones(self.dim.shape, dtype=bool)
+        border[(slice(1, -1),) * (3 if self.dim.z > 1 else 2)] = False
+        wall = self.new_cell(cell_type)
+        self.cell_field[np.nonzero(border & (self._simulation.inventory.lattice == 0))] = wall
+        return wall
+
+    def new_fpp_link(self, initiator, initiated, lambda_distance, target_distance, max_distance):
+        return self.focalPointPlasticityPlugin.createFocalPointPlasticityLink(initiator, initiated, lambda_distance,
+                                                                             target_distance, max_distance)
+
+    def delete_fpp_link(self, link):
+        self.focalPointPlasticityPlugin.deleteFocalPointPlasticityLink(link)
+
+    def get_fpp_links(self):
+        return list(self.focalPointPlasticityPlugin.links)
+
+    def get_fpp_links_by_cell(self, cell):
+        return self.focalPointPlasticityPlugin.links_by_cell(cell)
+
+    def get_fpp_linked_cells(self, cell):
+        return [link.getOtherCell(cell) for link in self.focalPointPlasticityPlugin.links_by_cell(cell)]
+
+    def remove_all_cell_fpp_links(self, cell):
+        self.focalPointPlasticityPlugin.remove_cell(cell)
+
+    def track_cell_level_scalar_attribute(self, field_name, attribute_name, function=None, cell_type_list=None):
+        pass
+
+    def clone_attributes(self, source_cell, target_cell, no_clone_key_dict_list=()):
+        self._simulation.inventory.clone_attributes(source_cell, target_cell, no_clone_key_dict_list)
+
+
+class MitosisSteppableBase(SteppableBasePy):
+    """
+    Stand-in for cc3d.core.PySteppables.MitosisSteppableBase. A cell divides by giving the pixels on one side of a
+    plane through its center of mass to a new cell of the same type, then update_attributes is called with
+    parent_cell and child_cell set.
+    """
+
+    def __init__(self, frequency=1):
+        SteppableBasePy.__init__(self, frequency)
+        self.parent_cell = None
+        self.child_cell = None
+
+    def _coordinates(self, cell):
+        pixels = self._simulation.inventory.pixels(cell)
+        coordinates = np.stack(np.unravel_index(pixels, self.dim.shape), axis=1).astype(float)
+        return pixels, coordinates - coordinates.mean(axis=0)
+
+    def _divide(self, cell, normal):
+        pixels, coordinates = self._coordinates(cell)
+        child_side = coordinates @ np.asarray(normal, dtype=float) > 0
+        if not child_side.any() or child_side.all():
+            return False
+        child = self.new_cell(cell.type)
+        self.cell_field[np.unravel_index(pixels[child_side], self.dim.shape)] = child
+        self.parent_cell = cell
+        self.child_cell = child
+        self.update_attributes()
+        return True
+
+    def _axes(self, cell):
+        _, coordinates = self._coordinates(cell)
+        n_dims = 3 if self.dim.z > 1 else 2
+        if len(coordinates) < 2:
+            return np.eye(3)[:n_dims]
+        _, vectors = np.linalg.eigh(np.cov(coordinates[:, :n_dims].T))
+        # columns sorted by increasing variance: minor axis first, major axis last
+        axes = np.zeros((n_dims, 3))
+        axes[:, :n_dims] = vectors.T
+        return axes
+
+    def divide_cell_random_orientation(self, cell):
+        normal = self._simulation.rng.normal(size=3)
+        if self.dim.z == 1:
+            normal[2] = 0
+        return self._divide(cell, normal)
+
+    def divide_cell_orientation_vector_based(self, cell, nx, ny, nz):
+        return self._divide(cell, (nx, ny, nz))
+
+    def divide_cell_along_major_axis(self, cell):
+        # the division plane contains the major axis
+        return self._divide(cell, self._axes(cell)[0])
+
+    def divide_cell_along_minor_axis(self, cell):
+        return self._divide(cell, self._axes(cell)[-1])
+
+    def update_attributes(self):
+        pass
+
+    def clone_parent_2_child(self):
+        self.clone_attributes(self.parent_cell, self.child_cell)
@@ -1,6 +1,7 @@
+import os
 import warnings
-from itertools import combinations
-from math import ceil
+from itertools import combinations, product
+from math import ceil, cos, sin, pi, sqrt, log2
 
 from cc3d_xml_gen.get_physicell_data import get_dims, get_time, get_parallel, get_boundary_wall
 
@@ -33,8 +34,11 @@ _time_convs = {"millisecond": 1e-3 / 60,
                "minutes": 1,
                "min": 1}
 
+# cost of a steady state (fast Helmholtz) solve per pixel and per log2(lattice side), in forward Euler updates
+_steady_state_cost_factor = 5
 
-def make_potts(pcdims, ccdims, pctime, cctime):
+
+def make_potts(pcdims, ccdims, pctime, cctime, neighbor_order=1, seed=None):
     """
     Generate a Potts CC3D XML string with the given parameters.
 
@@ -48,6 +52,10 @@ def make_potts(pcdims, ccdims, pctime, cctime):
         Tuple with the time unit from PhysiCell
     cctime : tuple
         Tuple with the time parameters for CC3D
+    neighbor_order : int, optional
+        Neighbor order of the pixel copy attempts (see choose_neighbor_orders). Default 1
+    seed : int, optional
+        Seed of CC3D's pixel copy attempts (<RandomSeed>). Default None, CC3D draws a new seed every run
 
     Returns
     -------
@@ -55,6 +63,11 @@ def make_potts(pcdims, ccdims, pctime, cctime):
         Potts XML string with the given parameters.
 
     """
+    if seed is None:
+        seed_str = "   <!-- <RandomSeed>0</RandomSeed> -->\n"
+    else:
+        # the steppables' random streams are seeded with the same seed, see get_random_streams
+        seed_str = f"   <RandomSeed>{seed}</RandomSeed>\n"
     potts_str = f""" 
 <Potts>
    <!-- Basic properties of CPM (GGH) algorithm -->
@@ -69,30 +82,129 @@ def make_potts(pcdims, ccdims, pctime, cctime):
    <!-- them, so the translation script leaves its tunning as an exercise-->
    <!-- for the reader -->
    <Temperature>10.0</Temperature>
-   <!-- Same deal for neighbor order as for temperature-->
-   <NeighborOrder>1</NeighborOrder>
-   <!-- <Boundary_x>Periodic</Boundary_x> -->
+   <!-- Neighbor order chosen from the converted cell sizes, see the report in the Contact plugin -->
+   <NeighborOrder>{neighbor_order}</NeighborOrder>
+{seed_str}   <!-- <Boundary_x>Periodic</Boundary_x> -->
    <!-- <Boundary_y>Periodic</Boundary_y> -->
 </Potts>\n"""
 
     return potts_str
 
 
-def make_metadata(pcdict, out=100):
-    """Generates the metadata CC3D XML block"""
+def make_metadata(pcdict, out=100, n_processors=1, non_parallel=(), notes=()):
+    """
+    Generates the metadata CC3D XML block
+
+    `n_processors` and the `non_parallel` modules (e.g. "Potts") are usually chosen by choose_number_of_processors,
+    `notes` are written as comments.
+    """
     threads = get_parallel(pcdict)
 
+    non_parallel_str = "".join(f'  <NonParallelModule Name="{module}"/>\n' for module in non_parallel)
+    if not non_parallel:
+        non_parallel_str = '  <!-- <NonParallelModule Name="Potts"/> -->\n'
+    notes_str = "".join(f"  <!-- {note} -->\n" for note in notes)
+
     metadata = f'''
 <Metadata>
   <!-- Basic properties simulation -->
-  <NumberOfProcessors>{1}</NumberOfProcessors>
+  <!-- PhysiCell's omp_num_threads was {threads} -->
+{notes_str}  <NumberOfProcessors>{n_processors}</NumberOfProcessors>
   <DebugOutputFrequency>{out}</DebugOutputFrequency>
-  <!-- <NonParallelModule Name="Potts"/> -->
-</Metadata>\n'''
+{non_parallel_str}</Metadata>\n'''
 
     return metadata, threads
 
 
+def get_output_frequencies(save_intervals, cctime):
+    """
+    Converts PhysiCell's output intervals (see get_physicell_data.get_save_intervals) into MCS with the final
+    MCS/unit (cctime[2]), at least 1. Disabled outputs stay None.
+    """
+    return {output: None if interval is None else max(int(round(interval * cctime[2])), 1)
+            for output, interval in save_intervals.items()}
+
+
+def make_pif_dumper(frequency, name):
+    """
+    Returns the PIFDumper steppable XML, which writes the cell lattice every `frequency` MCS (PhysiCell's full_data
+    interval)
+    """
+    return f'''
+<Steppable Type="PIFDumper" Frequency="{frequency}">
+\t<!-- Cell lattice dumps, scheduled from PhysiCell's full_data save interval -->
+\t<PIFName>{name}</PIFName>
+\t<PIFFileExtension>piff</PIFFileExtension>
+</Steppable>\n'''
+
+
+def choose_number_of_processors(requested, ccdims, potts_order=1, contact_order=1, available=None,
+                                min_pixels_per_core=2500):
+    """
+    Chooses how many processors CC3D should use.
+
+    The `requested` number (PhysiCell's omp_num_threads or a user override) is capped by the `available` cores and by
+    the lattice: below `min_pixels_per_core` pixels per core the threading overhead of the solvers outweighs the gain.
+    CC3D's parallel Potts splits each core's part of the lattice into a checkerboard of 4 (2D) or 8 (3D) sub-blocks,
+    and a copy attempt with its contact neighbors must fit well inside a sub-block. If the lattice is too small for
+    that, Potts runs on one core (NonParallelModule) while the solvers keep the chosen number of processors.
+
+    Parameters:
+    ----------
+        requested : int
+            Number of processors asked for
+        ccdims : tuple
+            The converted CC3D space parameters
+        potts_order : int, optional
+            Neighbor order of the copy attempts. Default 1
+        contact_order : int, optional
+            Neighbor order of the Contact plugin. Default 1
+        available : int, optional
+            Number of cores of the machine. Defaults to os.cpu_count()
+        min_pixels_per_core : int, optional
+            Smallest number of pixels worth a core. Default 2500
+
+    Returns:
+    -------
+        n_processors : int
+            Number of processors
+        non_parallel : list
+            Modules that must run on one core
+        notes : list
+            Explanation of the caps applied
+    """
+    if available is None:
+        available = os.cpu_count() or 1
+    is_2D = ccdims[6]
+    sides = ccdims[0:2] if is_2D else ccdims[0:3]
+    pixels = ccdims[0] * ccdims[1] * ccdims[2]
+
+    notes = []
+    n_processors = max(int(requested), 1)
+    if n_processors > available:
+        notes.append(f"{n_processors} processors requested, capped to the {available} cores of the converting "
+                     f"machine")
+        n_processors = available
+    lattice_cap = max(pixels // min_pixels_per_core, 1)
+    if n_processors > lattice_cap:
+        notes.append(f"{n_processors} processors capped to {lattice_cap}, the lattice has {pixels} pixels (at least "
+                     f"{min_pixels_per_core} per processor are needed to gain from threading)")
+        n_processors = lattice_cap
+
+    non_parallel = []
+    reach = max(max(abs(c) for v in get_neighbor_offsets(order, is_2D) for c in v)
+                for order in (potts_order, contact_order))
+    min_side = 2 * (2 * reach + 1)
+    potts_cap = 1
+    for side in sides:
+        potts_cap *= side // min_side
+    potts_cap = max(potts_cap // (4 if is_2D else 8), 1)
+    if n_processors > potts_cap:
+        non_parallel.append("Potts")
+        notes.append(f"The lattice only fits {potts_cap} parallel Potts partition(s), Potts runs on one core")
+    return n_processors, non_parallel, notes
+
+
 def make_cell_type_plugin(pcdict):
     """
     Makes the cell type plugin for CC3D
@@ -180,7 +292,7 @@ def make_cc3d_file(name=None):
     return cc3d, xml_name, main_py_name, steppables_py_name
 
 
-def make_contact_plugin(celltypes):
+def make_contact_plugin(celltypes, neighbor_order=3, order_report=None):
     """
     Create a contact plugin configuration XML for CompuCell3D simulations.
 
@@ -194,12 +306,16 @@ def make_contact_plugin(celltypes):
     combinations. The list is then reversed, so that the self-interactions appear first.
 
     The function then creates the configuration XML as a string, with 10 as the placeholder energy. The NeighborOrder
-    parameter is set to 3.
+    parameter is set to `neighbor_order` (see choose_neighbor_orders).
 
     Parameters:
     ----------
         celltypes : list
             A list of strings representing the cell types in the simulation.
+        neighbor_order : int, optional
+            Neighbor order of the contact energy. Default 3
+        order_report : str, optional
+            Report of how the neighbor orders were chosen, added as a comment
 
     Returns:
     -------
@@ -235,10 +351,154 @@ def make_contact_plugin(celltypes):
     for t1, t2 in combs:
         ce += f'\t<Energy Type1="{t1}" Type2="{t2}">5.0</Energy>\n'
 
-    contact_plug += me + ce + "\t<NeighborOrder>3</NeighborOrder>\n</Plugin>"
+    report = ""
+    if order_report is not None:
+        report = "\t<!-- " + order_report.replace("\n", " -->\n\t<!-- ") + " -->\n"
+
+    contact_plug += me + ce + report + f"\t<NeighborOrder>{neighbor_order}</NeighborOrder>\n</Plugin>"
     return contact_plug
 
 
+def get_neighbor_offsets(order, is_2D):
+    """
+    Returns the lattice offsets of the neighbors of a pixel up to a CC3D neighbor order.
+
+    CC3D's neighbor order n includes every pixel whose distance is one of the n smallest distances on the lattice.
+    """
+    reach = int(ceil(sqrt(order))) + 1
+    dims = 2 if is_2D else 3
+    offsets = [v for v in product(range(-reach, reach + 1), repeat=dims) if any(v)]
+    distances = sorted(set(sum(c * c for c in v) for v in offsets))[:order]
+    return [v for v in offsets if sum(c * c for c in v) in distances]
+
+
+def _interface_normals(is_2D, samples=180):
+    """
+    Unit normals used to sample the orientation dependence of the interface energy.
+    """
+    if is_2D:
+        return [(cos(a), sin(a)) for a in (0.5 * pi * i / (samples - 1) for i in range(samples))]
+    # evenly spread directions (Fibonacci sphere) plus the lattice's axis, face and body diagonals
+    normals = [(1, 0, 0), (1 / sqrt(2), 1 / sqrt(2), 0), (1 / sqrt(3), 1 / sqrt(3), 1 / sqrt(3))]
+    golden = pi * (3 - sqrt(5))
+    for i in range(samples * 4):
+        z = 1 - 2 * (i + 0.5) / (samples * 4)
+        r = sqrt(1 - z * z)
+        normals.append((r * cos(golden * i), r * sin(golden * i), z))
+    return normals
+
+
+def get_lattice_anisotropy(order, is_2D):
+    """
+    Relative anisotropy of the contact energy of a flat interface for a neighbor order.
+
+    The energy per unit area of an interface with normal n is proportional to the number of neighbor pairs crossing
+    it, sum(|v.n|) over the neighbor offsets v. The anisotropy is (max - min)/mean of that energy over all
+    orientations, 0 would be a perfectly isotropic lattice.
+    """
+    offsets = get_neighbor_offsets(order, is_2D)
+    energies = [sum(abs(sum(c * nc for c, nc in zip(v, n))) for v in offsets) for n in _interface_normals(is_2D)]
+    return (max(energies) - min(energies)) / (sum(energies) / len(energies))
+
+
+def choose_neighbor_orders(constraints, is_2D, anisotropy_tolerance=0.15, max_order=6):
+    """
+    Chooses the Potts and Contact neighbor orders from the converted cell volumes.
+
+    Every neighbor in the Contact plugin is visited at each pixel copy attempt, so the cost of the simulation grows with
+    the number of neighbors. Higher orders are only worth it if they make the interfaces less anisotropic, and their
+    neighborhood must be small compared to the cells (otherwise a pixel interacts with most of its own cell). The
+    Contact order is the cheapest order whose anisotropy is under `anisotropy_tolerance` and whose neighborhood radius
+    is at most half the radius of the smallest cell. The Potts order (the copy attempt neighborhood) only needs to be
+    loosely isotropic, so the cheapest order with twice the tolerance (and not above the Contact order) is used.
+
+    Parameters:
+    ----------
+        constraints : dict
+            Converted cell constraints (after reconvert_cell_volume_constraints)
+        is_2D : bool
+            Whether the simulation is 2D
+        anisotropy_tolerance : float, optional
+            Largest acceptable relative anisotropy of the contact energy. Default 0.15
+        max_order : int, optional
+            Largest neighbor order considered. Default 6
+
+    Returns:
+    -------
+        potts_order : int
+            Neighbor order for <Potts>
+        contact_order : int
+            Neighbor order for the Contact plugin
+        report : str
+            Description of the choice and of its expected cost
+    """
+    volumes = [c['volume']["volume (pixels)"] for c in constraints.values()
+               if c['volume']["volume (pixels)"] is not None]
+    smallest = min(volumes) if volumes else 1
+    if is_2D:
+        cell_radius = sqrt(smallest / pi)
+    else:
+        cell_radius = (3 * smallest / (4 * pi)) ** (1 / 3)
+
+    orders = {}
+    for order in range(1, max_order + 1):
+        offsets = get_neighbor_offsets(order, is_2D)
+        radius = sqrt(max(sum(c * c for c in v) for v in offsets))
+        if order > 1 and radius > cell_radius / 2:
+            break
+        orders[order] = (len(offsets), get_lattice_anisotropy(order, is_2D))
+
+    def cheapest(tolerance, highest):
+        candidates = [o for o in orders.keys() if o <= highest]
+        good = [o for o in candidates if orders[o][1] <= tolerance]
+        if good:
+            return min(good, key=lambda o: orders[o][0])
+        return min(candidates, key=lambda o: orders[o][1])
+
+    contact_order = cheapest(anisotropy_tolerance, max_order)
+    potts_order = cheapest(2 * anisotropy_tolerance, contact_order)
+
+    legacy = len(get_neighbor_offsets(3, is_2D))
+    n_contact = orders[contact_order][0]
+    report = f"Neighbor orders chosen for a smallest cell of {smallest} pixels (radius {cell_radius:.1f}):\n" \
+             f"Potts NeighborOrder {potts_order} ({orders[potts_order][0]} neighbors, anisotropy " \
+             f"{orders[potts_order][1]:.3f})\n" \
+             f"Contact NeighborOrder {contact_order} ({n_contact} neighbors, anisotropy " \
+             f"{orders[contact_order][1]:.3f}, tolerance {anisotropy_tolerance})\n" \
+             f"Expected contact energy cost per copy attempt: {n_contact / legacy:.2f}x that of NeighborOrder 3"
+    if orders[contact_order][1] > anisotropy_tolerance:
+        report += f"\nWARNING: the cells are too small for an order meeting the tolerance, the least anisotropic " \
+                  f"allowed order was used"
+    return potts_order, contact_order, report
+
+
+def make_initial_condition(item):
+    """
+    Generates the initial condition tags of a diffusing field.
+
+    If the field has a pre-computed concentration file (item["concentration_file"], e.g. a converted PhysiCell initial
+    condition or a pre-computed steady state) it is used, otherwise the initial condition expression is used.
+
+    Parameters
+    ----------
+    item : dict
+        Dictionary of the diffusing element (see make_diffusion_FE)
+
+    Returns
+    -------
+    str
+        The initial condition XML string
+    """
+    if "concentration_file" in item.keys() and item["concentration_file"] is not None:
+        return f'\t\t\t\t<!-- <InitialConcentrationExpression>{item["initial_condition"]}<' \
+               f'/InitialConcentrationExpression> -->' \
+               f'\n\t\t\t\t<ConcentrationFileName>{item["concentration_file"]}</ConcentrationFileName>'
+    return f'\t\t\t\t <InitialConcentrationExpression>{item["initial_condition"]}<' \
+           f'/InitialConcentrationExpression>' \
+           '\n\t\t\t\t<!-- <ConcentrationFileName>INITIAL CONCENTRATION FIELD - typically a file with ' \
+           'path Simulation/NAME_OF_THE_FILE.txt</ConcentrationFileName> -->'
+
+
 def make_diffusion_FE(diffusing_elements, celltypes, flag_2d):
     """
     Converts a dictionary of diffusion properties into a CC3D DiffusionSolverFE XML configuration string. T
@@ -290,9 +550,19 @@ def make_diffusion_FE(diffusing_elements, celltypes, flag_2d):
         og_D = f'\t\t\t\t<Original_diffusion_constant D="{item["D_w_units"]}" units= "{item["D_og_unit"]}"/>\n'
         # conv = f'\t\t\t\t<CC3D_to_original units="(pixel^2/MCS)/(item["D_og_unit"])">{item["D_conv_factor"]}' \
         #        '</CC3D_to_original>'
-        D_str = f'\t\t\t\t<GlobalDiffusionConstant>{item["D"]}</GlobalDiffusionConstant>\n'
+        # fast fields are sub-stepped: the constants are per solver step and the solver runs `substeps` times per MCS
+        substeps = item["substeps"] if "substeps" in item.keys() else 1
+        D = item["D"] / substeps
+        gamma = item["gamma"] / substeps
+        D_str = f'\t\t\t\t<GlobalDiffusionConstant>{D}</GlobalDiffusionConstant>\n'
         og_g = f'\t\t\t\t<Original_decay_constant gamma="{item["gamma_w_units"]}" units= "{item["gamma_og_unit"]}"/>\n'
-        g_str = f'\t\t\t\t<GlobalDecayConstant>{item["gamma"]}</GlobalDecayConstant>\n'
+        g_str = f'\t\t\t\t<GlobalDecayConstant>{gamma}</GlobalDecayConstant>\n'
+        if substeps > 1:
+            g_str += f'\t\t\t\t<!-- This field is too fast for one forward Euler step per MCS -->\n' \
+                     f'\t\t\t\t<!-- ({item["D"]} pixel^2/MCS). Instead of shortening the MCS for the whole -->\n' \
+                     f'\t\t\t\t<!-- simulation, it is solved {substeps} times per MCS with D and gamma divided -->\n' \
+                     f'\t\t\t\t<!-- by {substeps}. -->\n' \
+                     f'\t\t\t\t<ExtraTimesPerMCS>{substeps - 1}</ExtraTimesPerMCS>\n'
 
         init_cond_warn = '\t\t\t\t<!-- CC3D allows for diffusing fields initial conditions, if one was detected it ' \
                          'will -->\n' \
@@ -301,21 +571,18 @@ def make_diffusion_FE(diffusing_elements, celltypes, flag_2d):
                          '\t\t\t\t<!-- your diffusing field at the start of the simulation this may be the reason.' \
                          ' -->\n' \
                          '\t\t\t\t<!-- CC3D also allows the diffusing field initial condition to be set by a file. ' \
-                         'Conversion of a -->\n' \
-                         '\t\t\t\t<!-- PhysiCell diffusing field initial condition file into a CC3D compliant one is ' \
-                         'left as -->\n' \
-                         '\t\t\t\t<!-- an exercise to the reader. -->\n'
+                         'If the -->\n' \
+                         '\t\t\t\t<!-- PhysiCell model enables an initial condition file it is converted into a ' \
+                         'CC3D compliant -->\n' \
+                         '\t\t\t\t<!-- one and used here. -->\n'
 
-        init_cond = f'\t\t\t\t <InitialConcentrationExpression>{item["initial_condition"]}<' \
-                    f'/InitialConcentrationExpression>' \
-                    '\n\t\t\t\t<!-- <ConcentrationFileName>INITIAL CONCENTRATION FIELD - typically a file with ' \
-                    'path Simulation/NAME_OF_THE_FILE.txt</ConcentrationFileName> -->'
+        init_cond = make_initial_condition(item)
 
         het_warning = "\n\t\t\t\t<!-- CC3D allows the definition of D and gamma on a cell type basis: -->\n"
         cells_str = ""
         for t in celltypes:
-            cells_str += f'\t\t\t\t<!--<DiffusionCoefficient CellType="{t}">{item["D"]}</DiffusionCoefficient>-->\n'
-            cells_str += f'\t\t\t\t<!--<DecayCoefficient CellType="{t}">{item["gamma"]}</DecayCoefficient>-->\n'
+            cells_str += f'\t\t\t\t<!--<DiffusionCoefficient CellType="{t}">{D}</DiffusionCoefficient>-->\n'
+            cells_str += f'\t\t\t\t<!--<DecayCoefficient CellType="{t}">{gamma}</DecayCoefficient>-->\n'
         close_diff_data = "\t\t\t</DiffusionData>\n"
 
         # boundary conditions
@@ -376,7 +643,7 @@ def make_diffusion_FE(diffusing_elements, celltypes, flag_2d):
     return full_str
 
 
-def make_diffusion_steady(diffusing_elements, flag_2d):
+def make_diffusion_steady(diffusing_elements, flag_2d, frequency=1):
     """
     Creates a steady-state diffusion solver configuration for CC3D simulations based on the given diffusing elements.
 
@@ -401,23 +668,26 @@ def make_diffusion_steady(diffusing_elements, flag_2d):
     flag_2d : bool
         A boolean indicating whether to use 2D or 3D solver.
 
+    frequency : int, optional
+        The solver is called once every `frequency` MCS. Default 1
+
     Returns
     -------
     str
         A string containing the configuration for the steady-state diffusion solver in CC3D simulations.
     """
-    if flag_2d:
-        header = f'\n\n\t<Steppable Type="SteadyStateDiffusionSolver2D">\n\t\t<!-- The conversion uses ' \
-                 f'DiffusionSolverFE and' \
-                 f' SteadyStateDiffusionSolver ' \
-                 f'by default. You may ' \
-                 f'wish to use another diffusion solver-->\n'
-    else:
-        header = f'\n\n\t<Steppable Type="SteadyStateDiffusionSolver">\n\t\t<!-- The conversion uses ' \
-                 f'DiffusionSolverFE and' \
-                 f' SteadyStateDiffusionSolver ' \
-                 f'by default. You may ' \
-                 f'wish to use another diffusion solver-->\n'
+    solver = "SteadyStateDiffusionSolver2D" if flag_2d else "SteadyStateDiffusionSolver"
+    frequency_attr = f' Frequency="{frequency}"' if frequency > 1 else ""
+    header = f'\n\n\t<Steppable Type="{solver}"{frequency_attr}>\n\t\t<!-- The conversion uses ' \
+             f'DiffusionSolverFE and' \
+             f' SteadyStateDiffusionSolver ' \
+             f'by default. You may ' \
+             f'wish to use another diffusion solver-->\n' \
+             f'\t\t<!-- The solver of each field was chosen from its relaxation time and cost, see the ' \
+             f'conversion report -->\n'
+    if frequency > 1:
+        header += f'\t\t<!-- These fields relax much faster than their sources change, they are solved every ' \
+                  f'{frequency} MCS -->\n'
 
     full_str = header
 
@@ -442,15 +712,12 @@ def make_diffusion_steady(diffusing_elements, flag_2d):
                          '\t\t\t\t<!-- your diffusing field at the start of the simulation this may be the reason.' \
                          ' -->\n' \
                          '\t\t\t\t<!-- CC3D also allows the diffusing field initial condition to be set by a file. ' \
-                         'Conversion of a -->\n' \
-                         '\t\t\t\t<!-- PhysiCell diffusing field initial condition file into a CC3D compliant one is ' \
-                         'left as -->\n' \
-                         '\t\t\t\t<!-- an exercise to the reader. -->\n'
+                         'If the -->\n' \
+                         '\t\t\t\t<!-- PhysiCell model enables an initial condition file it is converted into a ' \
+                         'CC3D compliant -->\n' \
+                         '\t\t\t\t<!-- one and used here. -->\n'
 
-        init_cond = f'\t\t\t\t <InitialConcentrationExpression>{item["initial_condition"]}<' \
-                    f'/InitialConcentrationExpression>' \
-                    '\n\t\t\t\t<!-- <ConcentrationFileName>INITIAL CONCENTRATION FIELD - typically a file with ' \
-                    'path Simulation/NAME_OF_THE_FILE.txt</ConcentrationFileName> -->'
+        init_cond = make_initial_condition(item)
 
         close_diff_data = "\t\t\t</DiffusionData>\n"
 
@@ -536,6 +803,8 @@ def make_diffusion_plug(diffusing_elements, celltypes, flag_2d):
         Each key in the dictionary represents a diffusing element and its value is a dictionary with the following keys:
         - use_steady_state : bool
             Whether or not to use steady-state diffusion solver for this element.
+        - steady_frequency : int, optional
+            Number of MCS between two steady-state solver calls. Fields sharing it share a solver instance.
         - concentration_units : str
             The concentration units of this element.
         - D_w_units : float
@@ -573,10 +842,16 @@ def make_diffusion_plug(diffusing_elements, celltypes, flag_2d):
         FE_solver = make_diffusion_FE(diffusing_elements, celltypes, flag_2d)
     else:
         FE_solver = ""
+    steady_state_solver = ""
     if use_steady:
-        steady_state_solver = make_diffusion_steady(diffusing_elements, flag_2d)
-    else:
-        steady_state_solver = ""
+        # one solver instance per call frequency
+        frequencies = {}
+        for key, item in diffusing_elements.items():
+            if item["use_steady_state"]:
+                frequency = item["steady_frequency"] if "steady_frequency" in item.keys() else 1
+                frequencies.setdefault(frequency, {})[key] = item
+        for frequency, elements in sorted(frequencies.items()):
+            steady_state_solver += make_diffusion_steady(elements, flag_2d, frequency=frequency)
 
     return FE_solver + steady_state_solver
 
@@ -590,14 +865,84 @@ def get_chemotatic_fields(taxis_dict):
     return list(set(taxis_fields))
 
 
-def make_chemotaxis(taxis_dict):
+def split_coarse_fields(d_elements, coarse_fields, taxis_fields=()):
+    """
+    Splits the diffusing elements into the fields solved on the CC3D lattice and the fields solved in Python on a coarse
+    grid (see pc2cc3d_runtime.CoarseDiffusion).
+
+    Parameters
+    ----------
+    d_elements : dict
+        Converted diffusing elements
+    coarse_fields : list
+        Names of the fields to solve on the coarse grid, an empty list selects every field
+    taxis_fields : list, optional
+        Chemotactic fields. They stay on the lattice, the Chemotaxis plugin reads them pixel by pixel
+
+    Returns
+    -------
+    tuple
+        (lattice elements, coarse elements)
+    """
+    # the CC3D field names have underscores instead of spaces
+    field_names = {key.replace(" ", "_"): key for key in d_elements.keys()}
+    if not coarse_fields:
+        coarse_fields = list(field_names.keys())
+    coarse_fields = [name.replace(" ", "_") for name in coarse_fields]
+    for name in coarse_fields:
+        if name not in field_names.keys():
+            warnings.warn(f"WARNING: {name} is not a diffusing field, it can not be solved on the coarse grid")
+    lattice_elements = {}
+    coarse_elements = {}
+    for name, key in field_names.items():
+        if name in coarse_fields and name in taxis_fields:
+            warnings.warn(f"WARNING: {name} is chemotactic, it is solved on the lattice")
+            lattice_elements[key] = d_elements[key]
+        elif name in coarse_fields:
+            coarse_elements[key] = d_elements[key]
+        else:
+            lattice_elements[key] = d_elements[key]
+    return lattice_elements, coarse_elements
+
+
+def make_chemotaxis(taxis_dict, dynamic_types=()):
+    """
+    Generates the Chemotaxis plugin.
+
+    Chemotaxis of each cell type is declared at the type level with <ChemotaxisByType>, so CC3D applies it to every
+    cell of the type (including newly divided ones) without any Python. Types in `dynamic_types` change their
+    chemotaxis during the simulation in the original model (custom code), their chemotaxis is left to per-cell Python
+    calls and only their fields are declared here.
+
+    Parameters
+    ----------
+    taxis_dict : dict
+        Chemotaxis data, see get_physicell_data.get_chemotaxis
+    dynamic_types : iterable, optional
+        Cell types whose chemotaxis is set per cell in Python
+
+    Returns
+    -------
+    str
+        The Chemotaxis plugin XML string
+    """
     if not bool(taxis_dict):
         return ""
     else:
         taxis_fields = get_chemotatic_fields(taxis_dict)
         plug = '<Plugin Name="Chemotaxis">\n'
+        plug += '\t<!-- Lambda is the PhysiCell chemotaxis direction*100, PhysiCell has no equivalent parameter -->\n' \
+                '\t<!-- you have to adjust it -->\n'
         for name in taxis_fields:
-            plug += f'<ChemicalField Name="{name}"/>\n'
+            by_type = ""
+            for ctype, taxis_data in taxis_dict.items():
+                if ctype in dynamic_types or name not in taxis_data.keys():
+                    continue
+                by_type += f'\t\t<ChemotaxisByType Type="{ctype}" Lambda="{taxis_data[name] * 100}"/>\n'
+            if by_type:
+                plug += f'\t<ChemicalField Name="{name}">\n' + by_type + '\t</ChemicalField>\n'
+            else:
+                plug += f'\t<ChemicalField Name="{name}"/>\n'
         plug += '</Plugin>'
         return plug
 
@@ -609,8 +954,38 @@ def make_secretion(secretion_dict):
         return ""
 
 
-def make_volume():
-    return '\n<Plugin Name="Volume"/>\n'
+def make_volume(constraints=None, lambda_volume=16):
+    """
+    Generates the Volume plugin.
+
+    Without `constraints` the plugin is empty and the volume constraint is set per cell (cell.targetVolume and
+    cell.lambdaVolume) in Python. With them, each cell type gets its <VolumeEnergyParameters>, applied by CC3D to every
+    cell of the type, including newly divided ones. CC3D uses one or the other: with type parameters, per-cell
+    targetVolume changes are ignored.
+
+    Parameters
+    ----------
+    constraints : dict, optional
+        Converted cell constraints
+    lambda_volume : float, optional
+        Volume lambda of every type. Default 16
+
+    Returns
+    -------
+    str
+        The Volume plugin XML string
+    """
+    if constraints is None:
+        return '\n<Plugin Name="Volume"/>\n'
+    plug = '\n<Plugin Name="Volume">\n'
+    plug += '\t<!-- NOTE: PC does not have an equivalent to LambdaVolume, you have to adjust it -->\n'
+    for ctype, const in constraints.items():
+        if ctype.upper() == "WALL" or const['volume']["volume (pixels)"] is None:
+            continue
+        plug += f'\t<VolumeEnergyParameters CellType="{ctype}" ' \
+                f'TargetVolume="{round(const["volume"]["volume (pixels)"])}" LambdaVolume="{lambda_volume}"/>\n'
+    plug += '</Plugin>\n'
+    return plug
 
 
 def make_cell_loop(cell_type):
@@ -656,6 +1031,8 @@ def reconvert_cc3d_dims(ccdims, ratio, is_2D):
         number_pixels = [ratio * ccdims[0], ratio * ccdims[1], ratio * ccdims[2]]
     else:
         number_pixels = [ratio * ccdims[0], ratio * ccdims[1], 1]
+    # non-integer ratios (e.g. coarse variants) must still give a whole number of pixels
+    number_pixels = [max(int(round(n)), 1) for n in number_pixels]
 
     old_pixel_unit_ratio = ccdims[4]
 
@@ -663,7 +1040,7 @@ def reconvert_cc3d_dims(ccdims, ratio, is_2D):
     new_pixel_unit_ratio = ratio * old_pixel_unit_ratio
 
     new_string = ccdims[3].replace(str(old_pixel_unit_ratio), str(new_pixel_unit_ratio))
-    new_ccdims = (number_pixels[0], number_pixels[1], number_pixels[2], new_string, new_pixel_unit_ratio, ccdims[-1],
+    new_ccdims = (number_pixels[0], number_pixels[1], number_pixels[2], new_string, new_pixel_unit_ratio, ccdims[5],
                   is_2D)
     return new_ccdims
 
@@ -743,6 +1120,112 @@ def reconvert_spatial_parameters_with_minimum_cell_volume(constraints, ccdims, p
     return ccdims, constraints
 
 
+def coarsen_spatial_parameters(ccdims, constraints, factor, minimum_volume):
+    """
+    Makes the pixels `factor` times larger (in every direction) to create a coarse variant of a conversion.
+
+    The lattice is scaled with reconvert_cc3d_dims and the cell volumes with reconvert_cell_volume_constraints, by
+    1/factor and 1/factor^dimensions respectively, so the coarse variant keeps the same physical domain and cells. The
+    minimum cell volume is lowered by the same amount, but never below 1 pixel.
+
+    Parameters:
+    -----------
+        ccdims : tuple
+            tuple of the previously converted cc3d space parameters
+        constraints : dict
+            The previously converted dictionary of cell constraints
+        factor : float
+            How many times larger the coarse pixels are
+        minimum_volume : int
+            The minimum cell volume of the full resolution conversion
+
+    Returns:
+    --------
+        ccdims : tuple
+            the coarse cc3d space parameters
+        constraints : dict
+            the coarse cell constraints
+        minimum_volume : float
+            the coarse minimum cell volume
+    """
+    is_2D = ccdims[6]
+    volume_ratio = factor ** -(2 if is_2D else 3)
+    minimum_volume = max(minimum_volume * volume_ratio, 1)
+    ccdims = reconvert_cc3d_dims(ccdims, 1 / factor, is_2D)
+    constraints = reconvert_cell_volume_constraints(constraints, volume_ratio, minimum_volume)
+    for ctype, const in constraints.items():
+        if const['volume']["volume (pixels)"] < minimum_volume:
+            warnings.warn(f"WARNING: {ctype} cells would be smaller than {minimum_volume} pixel(s) in the coarse "
+                          f"variant, using {minimum_volume}")
+            const['volume']["volume (pixels)"] = minimum_volume
+    return ccdims, constraints, minimum_volume
+
+
+def slice_to_2D(ccdims, constraints):
+    """
+    Turns a 3D conversion into a 2D slice through the middle of the domain.
+
+    Each cell becomes its cross-section through the center: a sphere of volume V is sliced into a disk of area
+    pi*(3V/(4pi))^(2/3).
+
+    Parameters:
+    -----------
+        ccdims : tuple
+            tuple of the previously converted cc3d space parameters
+        constraints : dict
+            The previously converted dictionary of cell constraints
+
+    Returns:
+    --------
+        ccdims : tuple
+            the 2D cc3d space parameters
+        constraints : dict
+            the 2D cell constraints
+    """
+    if ccdims[6]:
+        return ccdims, constraints
+    for ctype, const in constraints.items():
+        volume = const['volume']["volume (pixels)"]
+        if volume is not None:
+            const['volume']["volume (pixels)"] = pi * (3 * volume / (4 * pi)) ** (2 / 3)
+    return (ccdims[0], ccdims[1], 1, ccdims[3], ccdims[4], ccdims[5], True), constraints
+
+
+def estimate_cost(ccdims, cctime, d_elements, contact_order):
+    """
+    Rough cost estimate of a converted simulation, in lattice-site updates over the whole run.
+
+    The Potts cost is one copy attempt per pixel per MCS, each visiting the contact neighbors. The diffusion cost of
+    each field is given by get_solver_cost.
+
+    Parameters:
+    -----------
+        ccdims : tuple
+            tuple of the converted cc3d space parameters
+        cctime : tuple
+            tuple of the converted cc3d time parameters
+        d_elements : dict
+            a dictionary of diffusion elements
+        contact_order : int
+            neighbor order of the Contact plugin
+
+    Returns:
+    --------
+        potts : float
+            estimated Potts cost
+        diffusion : float
+            estimated diffusion cost
+    """
+    is_2D = ccdims[6]
+    pixels = ccdims[0] * ccdims[1] * ccdims[2]
+    potts = pixels * cctime[0] * len(get_neighbor_offsets(contact_order, is_2D))
+    diffusion = 0
+    for key, item in d_elements.items():
+        frequency = item["steady_frequency"] if "steady_frequency" in item.keys() else 1
+        diffusion += cctime[0] * get_solver_cost(item, ccdims, frequency=frequency)
+    return potts, diffusion
+
+
 def decrease_domain(ccdims, max_volume=150 ** 3):
     """
     Decrease the size of a 3D domain if its volume exceeds a maximum value.
@@ -812,6 +1295,280 @@ def decrease_domain(ccdims, max_volume=150 ** 3):
     return new_dims, True
 
 
+def get_diffusion_length(d_elements):
+    """
+    Returns the largest diffusion length, sqrt(D/gamma), of the diffusing fields in PhysiCell units.
+
+    Fields without decay have an infinite diffusion length.
+
+    Parameters:
+    -----------
+        d_elements : dict
+            a dictionary of diffusion elements.
+
+    Returns:
+    --------
+        float
+            the largest diffusion length, 0 if there are no diffusing fields
+    """
+    lengths = [0]
+    for key, value in d_elements.items():
+        if value["gamma_w_units"] > 0:
+            lengths.append((value["D_w_units"] / value["gamma_w_units"]) ** (1 / 2))
+        else:
+            lengths.append(float("inf"))
+    return max(lengths)
+
+
+def get_largest_cell_radius(constraints, ratio, is_2D):
+    """
+    Radius (PhysiCell units) of the disk (2D) or sphere (3D) with the converted volume of the largest cell type
+    """
+    volumes = [const['volume']["volume (pixels)"] for const in constraints.values()
+               if const['volume']["volume (pixels)"] is not None]
+    if not volumes:
+        return 0
+    if is_2D:
+        return sqrt(max(volumes) / pi) / ratio
+    return (3 * max(volumes) / (4 * pi)) ** (1 / 3) / ratio
+
+
+def crop_domain(ccdims, pcdims, positions, margin, cell_radius=0):
+    """
+    Crops the simulation domain to the bounding box of the initial cells plus a margin.
+
+    Instead of shrinking every side proportionally (see decrease_domain) the domain is cropped to where the tissue
+    actually is, plus `margin` around it so the diffusing fields have room. The positions are the cell centers, the
+    bounding box is also grown by `cell_radius` so the cells at its edges fit. The crop never extends past the original
+    PhysiCell domain. The returned origin is the position (in PhysiCell units) of the corner of the new lattice, every
+    PhysiCell position must be translated by it.
+
+    Parameters:
+    -----------
+        ccdims : tuple
+            tuple of the previously converted cc3d space parameters
+        pcdims : tuple
+            tuple of the PhysiCell space parameters, ((xmin, xmax), (ymin, ymax), (zmin, zmax), units)
+        positions : numpy.ndarray
+            (number of cells, 3) array of the initial cell positions in PhysiCell units
+        margin : float
+            space (in PhysiCell units) added around the cells' bounding box
+        cell_radius : float, optional
+            largest cell radius (PhysiCell units, see get_largest_cell_radius), added to the margin. Default 0
+
+    Returns:
+    --------
+        new_dims : tuple
+            the cropped cc3d space parameters
+        origin : tuple
+            position (in PhysiCell units) of the lattice corner
+    """
+    is_2D = ccdims[6]
+    ratio = ccdims[4]
+    margin = margin + cell_radius
+    new_dims = [ccdims[0], ccdims[1], ccdims[2]]
+    origin = []
+    for axis in range(3):
+        amin, amax = pcdims[axis]
+        amin = 0 if amin is None else amin
+        amax = amin + ccdims[axis] / ratio if amax is None else amax
+        if is_2D and axis == 2:
+            origin.append(amin)
+            continue
+        low = positions[:, axis].min() - margin
+        high = positions[:, axis].max() + margin
+        low = max(low, amin)
+        high = min(high, amax)
+        origin.append(low)
+        new_dims[axis] = max(min(ceil((high - low) * ratio), ccdims[axis]), 1)
+
+    new_dims.extend([ccdims[3], ccdims[4], ccdims[5], ccdims[6]])
+    print(f"Cropping the simulation domain to the initial cells plus a {margin:.4g} margin.\nOld dimensions:"
+          f"{tuple(ccdims[0:3])}\nNew dimensions:{tuple(new_dims[0:3])} "
+          f"({100 * new_dims[0] * new_dims[1] * new_dims[2] / (ccdims[0] * ccdims[1] * ccdims[2]):.1f}% of the "
+          f"volume)")
+    return tuple(new_dims), tuple(origin)
+
+
+def get_fe_substeps(item, is_2D):
+    """
+    Number of forward Euler steps per MCS a DiffusionSolverFE field needs to be stable and positive: each step must
+    keep 2*dimensions*D + gamma (unit pixel) at or below 1.
+    """
+    return max(ceil(2 * (2 if is_2D else 3) * item["D"] + item["gamma"]), 1)
+
+
+def substep_diffusion(d_elements, is_2D):
+    """
+    Per field stability analysis of the DiffusionSolverFE fields.
+
+    Unlike reconvert_time_parameter, which shortens the MCS (and multiplies the number of steps of the whole
+    simulation) until the fastest field is slow enough, each field gets the number of solver steps per MCS it needs to
+    be stable (see get_fe_substeps). The MCS keeps following the mechanics time step, only the fast fields pay for their
+    speed. make_diffusion_FE writes the sub-steps as ExtraTimesPerMCS with the per step D and gamma.
+
+    Parameters:
+    -----------
+        d_elements : dict
+            a dictionary of diffusion elements
+        is_2D : bool
+            whether the simulation is 2D
+
+    Returns:
+    --------
+        dict
+            the diffusion elements with their "substeps" key set
+    """
+    for key, item in d_elements.items():
+        if item["use_steady_state"]:
+            continue
+        item["substeps"] = get_fe_substeps(item, is_2D)
+        if item["substeps"] > 1:
+            print(f"{key}: D={item['D']:.4g} pixel^2/MCS, gamma={item['gamma']:.4g} 1/MCS, solved "
+                  f"{item['substeps']} times per MCS")
+        else:
+            print(f"{key}: D={item['D']:.4g} pixel^2/MCS, gamma={item['gamma']:.4g} 1/MCS, stable with one step "
+                  f"per MCS")
+    return d_elements
+
+
+def get_relaxation_time(item, ccdims):
+    """
+    Time (MCS) the slowest mode of a field takes to relax towards its steady state.
+
+    With zero flux boundaries the uniform mode only relaxes through decay (rate gamma), with constant value boundaries
+    the slowest mode also diffuses out of the lattice (rate D*sum(pi^2/L^2) over the axes). Infinite if the field has
+    no steady state.
+    """
+    rate = item["gamma"]
+    if item['dirichlet'].upper() != "FALSE":
+        sides = ccdims[0:2] if ccdims[6] else ccdims[0:3]
+        rate += item["D"] * sum(pi ** 2 / side ** 2 for side in sides)
+    return 1 / rate if rate > 0 else float("inf")
+
+
+def get_turnover_rate(field_name, secretion_dict):
+    """
+    Fastest rate (1/MCS) at which a cell type secretes into or takes up `field_name` (see
+    conversions.secretion.convert_secretion_uptake_data). 0 if no cell type interacts with the field.
+    """
+    rate = 0
+    if not secretion_dict:
+        return rate
+    for ctype, fields in secretion_dict.items():
+        if field_name not in fields.keys():
+            continue
+        data = fields[field_name]
+        rate = max(rate, data['secretion_rate_MCS'] + data['uptake_rate_MCS'])
+    return rate
+
+
+def get_solver_cost(item, ccdims, solver=None, frequency=1):
+    """
+    Cost (lattice-site updates per MCS) of solving a field with `solver` ("FE" or "steady", defaults to the solver the
+    field uses).
+
+    A DiffusionSolverFE field costs one update per pixel per sub-step (see get_fe_substeps). CC3D's steady state
+    solvers are fast Helmholtz (FFT) solvers, costing about _steady_state_cost_factor*log2(longest side) updates per
+    pixel per call, and are called once every `frequency` MCS.
+    """
+    is_2D = ccdims[6]
+    pixels = ccdims[0] * ccdims[1] * ccdims[2]
+    if solver is None:
+        solver = "steady" if item["use_steady_state"] else "FE"
+    if solver == "steady":
+        return _steady_state_cost_factor * pixels * max(log2(max(ccdims[0:3])), 1) / frequency
+    return pixels * get_fe_substeps(item, is_2D)
+
+
+def choose_diffusion_solvers(d_elements, ccdims, secretion_dict=None, tolerance=0.1, max_steady_frequency=1,
+                             legacy_threshold=1000):
+    """
+    Chooses the diffusion solver of each field from a cost and accuracy model.
+
+    A steady state solver is only accurate if the field relaxes (see get_relaxation_time) within a small fraction
+    (`tolerance`) of an MCS, the time step at which its sources (the cells) move, otherwise the transient the FE solver
+    resolves is lost. Among
+    the accurate solvers the cheapest (see get_solver_cost) is used. A steady state field can be solved every k MCS,
+    k being at most `max_steady_frequency` and small enough that the fastest secretion or uptake of the field (see
+    get_turnover_rate) changes the sources by no more than `tolerance` between calls. The fields are grouped by solver
+    (and call frequency) by make_diffusion_plug, so each group is a single solver instance.
+
+    The report compares the chosen solvers with the fixed rule of get_microenvironment (steady state above
+    `legacy_threshold` pixel^2/MCS, FE otherwise).
+
+    Parameters:
+    -----------
+        d_elements : dict
+            a dictionary of diffusion elements
+        ccdims : tuple
+            tuple of the converted cc3d space parameters
+        secretion_dict : dict, optional
+            converted secretion data (see conversions.secretion.convert_secretion_uptake_data)
+        tolerance : float, optional
+            largest acceptable relaxation time (in MCS) and relative source change between two steady state solver
+            calls. Default 0.1
+        max_steady_frequency : int, optional
+            largest number of MCS between two steady state solver calls. Default 1 (every MCS)
+        legacy_threshold : float, optional
+            diffusion constant above which the fixed rule used the steady state solver. Default 1000
+
+    Returns:
+    --------
+        d_elements : dict
+            the diffusion elements with their "use_steady_state" and "steady_frequency" keys set
+        report : str
+            description of the choice and of its predicted speedup
+    """
+    is_2D = ccdims[6]
+    longest = max(ccdims[0:2] if is_2D else ccdims[0:3])
+    report = "Diffusion solvers chosen per field:"
+    legacy_cost = 0
+    legacy_inaccurate = []
+    cost = 0
+    for key, item in d_elements.items():
+        name = key.replace(" ", "_")
+        relaxation = get_relaxation_time(item, ccdims)
+        turnover = get_turnover_rate(name, secretion_dict)
+        frequency = max_steady_frequency
+        if turnover > 0:
+            frequency = min(frequency, int(tolerance / turnover))
+        frequency = max(int(frequency), 1)
+
+        fe_cost = get_solver_cost(item, ccdims, "FE")
+        steady_cost = get_solver_cost(item, ccdims, "steady", frequency)
+        use_steady = relaxation <= tolerance and steady_cost < fe_cost
+
+        item["use_steady_state"] = use_steady
+        item["steady_frequency"] = frequency if use_steady else 1
+        this_cost = steady_cost if use_steady else fe_cost
+        cost += this_cost
+        if item["D"] > legacy_threshold:
+            legacy_cost += get_solver_cost(item, ccdims, "steady")
+            if relaxation > tolerance:
+                legacy_inaccurate.append(key)
+        else:
+            legacy_cost += fe_cost
+
+        length = sqrt(2 * (2 if is_2D else 3) * item["D"])
+        report += f"\n{key}: diffusion length {length:.3g} pixels/MCS (lattice {longest}), relaxation time " \
+                  f"{relaxation:.3g} MCS, turnover {turnover:.3g} 1/MCS -> "
+        if use_steady:
+            report += f"SteadyStateDiffusionSolver every {frequency} MCS"
+        else:
+            report += f"DiffusionSolverFE, {get_fe_substeps(item, is_2D)} step(s) per MCS"
+        report += f" ({this_cost:.3g} updates/MCS)"
+        if not use_steady and get_fe_substeps(item, is_2D) > 100:
+            report += f"\n\tNOTE: {key} needs many FE steps per MCS and changes too slowly for a steady state " \
+                      f"solver, consider running it with DiffusionSolverFE_OpenCL on a GPU"
+    if cost > 0:
+        report += f"\nPredicted diffusion speedup over the fixed D>{legacy_threshold} rule: {legacy_cost / cost:.3g}x"
+    if legacy_inaccurate:
+        report += f"\n\t(the fixed rule solved {legacy_inaccurate} with a steady state solver, although they relax " \
+                  f"slower than {tolerance} MCS)"
+    return d_elements, report
+
+
 def get_diffusion_constants(d_elements):
     Ds = []
     for key, value in d_elements.items():
@@ -887,9 +1644,10 @@ def reconvert_time_parameter(d_elements, cctime, max_D=50):
 
         new_gammas.append(d_elements[key]["gamma"])
 
+    # cctime[2] is in MCS/unit, a smaller D per MCS means more MCS per unit of time
     new_cctime = [min(int(cctime[0] / reduction_proportion), 10 ** 9),
-                  f'1 MCS = {cctime[2] * reduction_proportion} {cctime[1].split(" ")[-1]}',
-                  cctime[2] * reduction_proportion,
+                  f'1 MCS = {reduction_proportion / cctime[2]} {cctime[1].split(" ")[-1]}',
+                  cctime[2] / reduction_proportion,
                   cctime[3]]
     return d_elements, new_cctime
 
@@ -1,4 +1,5 @@
 import warnings
+from pathlib import Path
 
 # defines conversion factors to meter
 _space_convs = {"micron": 1e-6,
@@ -150,7 +151,7 @@ def get_time(pcdict, time_convs=_time_convs):
     # [cc3ddt] = MCS/unit
     # [cc3ddt] * unit = MCS
 
-    cc3dtimeunitstr = f"1 MCS = {cc3ddt} {time_unit}"
+    cc3dtimeunitstr = f"1 MCS = {1 / cc3ddt} {time_unit}"
 
     # timeconvfact = 1/cc3ddt
     pctime, cctime = (mt, time_unit, mechdt), (steps, cc3dtimeunitstr, cc3ddt, autoconvert_time)
@@ -158,11 +159,170 @@ def get_time(pcdict, time_convs=_time_convs):
     return pctime, cctime
 
 
+def get_clock_frequencies(pcdict, cctime):
+    """
+    Converts PhysiCell's clocks into CC3D steppable frequencies.
+
+    PhysiCell updates mechanics, diffusion (and secretion) and phenotypes on separate clocks (`dt_mechanics`,
+    `dt_diffusion`, `dt_phenotype`, in the same time unit as max_time). Each clock becomes the number of MCS between two
+    updates, at least 1.
+
+    :param pcdict: Dictionary created from parsing PhysiCell XML
+    :param cctime: The converted CC3D time parameters (MCS/unit in cctime[2])
+    :return frequencies: dict, {"mechanics": MCS, "diffusion": MCS, "phenotype": MCS}
+    """
+    defaults = {"mechanics": 0.1, "diffusion": 0.01, "phenotype": 6}
+    frequencies = {}
+    for clock, default in defaults.items():
+        key = f"dt_{clock}"
+        dt = float(pcdict['overall'][key]['#text']) if key in pcdict['overall'].keys() and \
+            '#text' in pcdict['overall'][key].keys() else default
+        frequencies[clock] = max(int(round(dt * cctime[2])), 1)
+    return frequencies
+
+
+def get_save_intervals(pcdict, time_unit, time_convs=_time_convs):
+    """
+    Gets PhysiCell's output schedule from <save>.
+
+    :param pcdict: Dictionary created from parsing PhysiCell XML
+    :param time_unit: PhysiCell's time unit, the intervals are converted into it if they use another known unit
+    :param time_convs: Dictionary of predefined time units
+    :return intervals: dict, {"full_data": interval, "SVG": interval}, None for disabled (or missing) outputs
+    """
+    intervals = {"full_data": None, "SVG": None}
+    if 'save' not in pcdict.keys() or pcdict['save'] is None:
+        return intervals
+    for output in intervals.keys():
+        if output not in pcdict['save'].keys() or pcdict['save'][output] is None:
+            continue
+        data = pcdict['save'][output]
+        if 'enable' in data.keys() and str(data['enable']).upper() != "TRUE":
+            continue
+        if 'interval' not in data.keys():
+            continue
+        interval = data['interval']
+        if isinstance(interval, dict):
+            unit = interval['@units'] if '@units' in interval.keys() else time_unit
+            interval = float(interval['#text'])
+        else:
+            unit = time_unit
+            interval = float(interval)
+        if unit != time_unit:
+            if unit in time_convs.keys() and time_unit in time_convs.keys():
+                interval *= time_convs[unit] / time_convs[time_unit]
+            else:
+                warnings.warn(f"WARNING: unknown time unit {unit} in <save><{output}>, using it as {time_unit}")
+        intervals[output] = interval
+    return intervals
+
+
 def get_parallel(pcdict):
     return int(pcdict['parallel']['omp_num_threads']) if 'parallel' in pcdict.keys() and \
                                                          'omp_num_threads' in pcdict['parallel'].keys() else 1
 
 
+def get_microenvironment_mesh(pcdict):
+    """
+    Gets the geometry of PhysiCell's (BioFVM) microenvironment mesh.
+
+    :param pcdict: Dictionary created from parsing PhysiCell XML
+    :return origin, spacing, shape: three tuples, (xmin, ymin, zmin) of the domain, (dx, dy, dz) of the voxels, and the
+        number of voxels in each direction
+    """
+    domain = pcdict['domain']
+    is_2D = domain['use_2D'].upper() == 'TRUE'
+    origin = []
+    spacing = []
+    shape = []
+    for axis in ("x", "y", "z"):
+        amin = float(domain[f'{axis}_min']) if f"{axis}_min" in domain.keys() else 0
+        amax = float(domain[f'{axis}_max']) if f"{axis}_max" in domain.keys() else 1
+        d = float(domain[f'd{axis}']) if f"d{axis}" in domain.keys() else 1
+        origin.append(amin)
+        spacing.append(d)
+        shape.append(1 if axis == "z" and is_2D else max(round((amax - amin) / d), 1))
+    return tuple(origin), tuple(spacing), tuple(shape)
+
+
+def get_initial_substrate_file(pcdict):
+    """
+    Looks for an initial condition file for the diffusing fields
+    (`<microenvironment_setup><options><initial_condition type=... enabled=...>`)
+
+    :param pcdict: Dictionary created from parsing PhysiCell XML
+    :return file_type, filename: type of the file ("matlab" or "csv") and its path as written in the PhysiCell XML.
+        (None, None) if there is no enabled initial condition file
+    """
+    if 'microenvironment_setup' not in pcdict.keys() or 'options' not in pcdict['microenvironment_setup'].keys():
+        return None, None
+    options = pcdict['microenvironment_setup']['options']
+    if options is None or 'initial_condition' not in options.keys():
+        return None, None
+    initial = options['initial_condition']
+    if '@enabled' not in initial.keys() or initial['@enabled'].upper() != "TRUE" or 'filename' not in initial.keys():
+        return None, None
+    file_type = initial['@type'].lower() if '@type' in initial.keys() else "matlab"
+    return file_type, initial['filename']
+
+
+def get_cell_positions_file(pcdict):
+    """
+    Looks for an initial cell positions file (`<initial_conditions><cell_positions type="csv" enabled=...>`)
+
+    :param pcdict: Dictionary created from parsing PhysiCell XML
+    :return: path of the file as written in the PhysiCell XML (folder/filename), None if there is no enabled cell
+        positions file
+    """
+    if 'initial_conditions' not in pcdict.keys() or pcdict['initial_conditions'] is None or \
+            'cell_positions' not in pcdict['initial_conditions'].keys():
+        return None
+    positions = pcdict['initial_conditions']['cell_positions']
+    if '@enabled' not in positions.keys() or positions['@enabled'].upper() != "TRUE" or \
+            'filename' not in positions.keys():
+        return None
+    folder = positions['folder'] if 'folder' in positions.keys() and positions['folder'] is not None else "."
+    return str(Path(folder).joinpath(positions['filename']))
+
+
+def get_cell_type_ids(pcdict):
+    """
+    Maps PhysiCell's cell type IDs to the (CC3D compliant) cell type names
+
+    :param pcdict: Dictionary created from parsing PhysiCell XML
+    :return: dictionary {ID (str): cell type name}
+    """
+    if 'cell_definitions' not in pcdict.keys():
+        return {"0": "CELL"}
+    ids = {}
+    for idx, child in enumerate(pcdict['cell_definitions']['cell_definition']):
+        ctype_id = child['@ID'] if '@ID' in child.keys() else str(idx)
+        ids[ctype_id] = child['@name'].replace(" ", "_")
+    return ids
+
+
+def resolve_physicell_path(path, xml_dir):
+    """
+    Finds a file referenced in a PhysiCell XML.
+
+    Paths in PhysiCell configuration files are relative to the folder the simulation runs from, usually the parent of
+    the folder holding the XML (e.g. `./config/cells.csv`). This function looks there, in the folder of the XML, and in
+    the current directory.
+
+    :param path: path as written in the PhysiCell XML
+    :param xml_dir: pathlib.Path, folder of the PhysiCell XML
+    :return: pathlib.Path of the file, None if it was not found
+    """
+    path = Path(path)
+    if path.is_absolute():
+        return path if path.exists() else None
+    for base in (xml_dir.parent, xml_dir, Path.cwd()):
+        candidate = base.joinpath(path)
+        if candidate.exists():
+            return candidate
+    return None
+
+
 def get_boundary_wall(pcdict):
     """
     Looks for the existance of a wall around the PhysiCell simulation and returns a flag saying if it does or not
@@ -800,6 +960,31 @@ def get_chemotaxis(pcdict):
     return taxis_data
 
 
+def get_dynamic_chemotaxis_types(pcdict):
+    """
+    Finds the cell types whose chemotaxis is controlled by custom code in the PhysiCell model.
+
+    A type with motility enabled but its chemotaxis disabled in the XML (e.g. biorobots' worker cells, whose custom code
+    switches between the cargo and director signals) only chemotaxes when the custom code turns it on.
+
+    :param pcdict: Dictionary created from parsing PhysiCell XML
+    :return: list of cell type names
+    """
+    dynamic = []
+    if 'cell_definitions' not in pcdict.keys():
+        return dynamic
+    for child in pcdict['cell_definitions']['cell_definition']:
+        if 'phenotype' not in child.keys() or 'motility' not in child['phenotype'].keys():
+            continue
+        options = child['phenotype']['motility']['options']
+        if options['enabled'].upper() == "FALSE" or 'chemotaxis' not in options.keys():
+            continue
+        taxis = options['chemotaxis']
+        if 'enabled' in taxis.keys() and taxis['enabled'].upper() == "FALSE":
+            dynamic.append(child['@name'].replace(" ", "_"))
+    return dynamic
+
+
 def get_secretion_uptake(pcdict):
     """
     Extracts secretion data from the input pcdict (PhysiCell XML parsed into a dictionary) and returns the extracted
@@ -941,7 +1126,8 @@ def get_microenvironment(pcdict, space_factor, space_unit, time_factor, time_uni
             A dictionary of known time unit conversions. Default is _time_convs.
         steady_state_threshold : float, optional
             The steady state threshold value above which the translator will set the diffusion solver  for that chemical
-            to be the steady state solver. Default is 1000.
+            to be the steady state solver. Default is 1000. The converter re-chooses the solvers from their cost and
+            accuracy with gen.choose_diffusion_solvers unless asked for this fixed rule.
 
     Returns:
         dict: A dictionary containing the diffusion and decay coefficients, initial condition, and boundary
@@ -0,0 +1,34 @@
+import argparse
+import csv
+from pathlib import Path
+
+from conversions.physicell_output import compare_outputs, read_cc3d_units
+
+parser = argparse.ArgumentParser(description="Compares summary statistics (cell counts and volumes per type, center "
+                                             "and spread of the cells, substrate ranges) of a PhysiCell run and of "
+                                             "its converted CompuCell3D run, streaming both outputs one snapshot at a "
+                                             "time.")
+parser.add_argument("physicell", type=str, help="PhysiCell output folder (outputXXXXXXXX.xml and .mat files)")
+parser.add_argument("cc3d", type=str, help="CompuCell3D output folder (PIF dumps and field_snapshots)")
+parser.add_argument("cc3dml", type=str, help="CC3DML file of the converted simulation, for the unit conversions")
+parser.add_argument("-o", "--output", type=str, default="comparison.csv",
+                    help="(optional) output csv. Default comparison.csv")
+parser.add_argument("--nosubstrates", action="store_true", help="(optional) don't read the substrates")
+args = parser.parse_args()
+
+pixel_to_space, time_per_mcs, is_2D = read_cc3d_units(args.cc3dml)
+pairs = compare_outputs(args.physicell, args.cc3d, pixel_to_space, time_per_mcs, is_2D=is_2D,
+                        substrates=not args.nosubstrates)
+columns = []
+for physicell, cc3d in pairs:
+    for key in list(physicell.keys()) + list((cc3d or {}).keys()):
+        if key not in columns:
+            columns.append(key)
+with open(Path(args.output), "w", newline="") as f:
+    writer = csv.writer(f)
+    writer.writerow(["simulator"] + columns)
+    for physicell, cc3d in pairs:
+        writer.writerow(["PhysiCell"] + [physicell.get(key, "") for key in columns])
+        if cc3d is not None:
+            writer.writerow(["CompuCell3D"] + [cc3d.get(key, "") for key in columns])
+print(f"Compared {len(pairs)} snapshots, saved to {args.output}")
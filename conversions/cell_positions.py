@@ -0,0 +1,118 @@
+import warnings
+
+import numpy as np
+
+
+def read_cell_positions(path, type_ids):
+    """
+    Reads a PhysiCell initial cell positions csv file.
+
+    Both the legacy format (x, y, z, type ID per line) and the newer one (header line, x, y, z, type name, ...) are
+    supported.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the csv file
+    type_ids : dict
+        Maps PhysiCell cell type IDs to cell type names (see get_physicell_data.get_cell_type_ids)
+
+    Returns
+    -------
+    positions : numpy.ndarray
+        (number of cells, 3) array of the cell centers in PhysiCell units
+    types : list
+        Cell type name of each cell
+    """
+    positions = []
+    types = []
+    with open(path, "r") as f:
+        for line in f:
+            parts = [p.strip() for p in line.split(",")]
+            if len(parts) < 4 or not parts[0]:
+                continue
+            try:
+                position = [float(p) for p in parts[:3]]
+            except ValueError:
+                # header line
+                continue
+            ctype = parts[3]
+            if ctype.replace(".", "", 1).isdigit():
+                ctype = str(int(float(ctype)))
+                if ctype not in type_ids.keys():
+                    warnings.warn(f"WARNING: unknown cell type ID {ctype} in {path}, skipping cell")
+                    continue
+                ctype = type_ids[ctype]
+            positions.append(position)
+            types.append(ctype.replace(" ", "_"))
+    return np.array(positions, dtype=float).reshape(-1, 3), types
+
+
+def positions_to_lattice(positions, origin, pixel_to_space):
+    """
+    Translates PhysiCell positions into CC3D lattice coordinates.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray
+        (number of cells, 3) array of positions in PhysiCell units
+    origin : tuple
+        Position (in PhysiCell units) of the corner of the CC3D lattice
+    pixel_to_space : float
+        Number of CC3D pixels per PhysiCell space unit
+
+    Returns
+    -------
+    numpy.ndarray
+        (number of cells, 3) integer array of lattice coordinates
+    """
+    return np.floor((positions - np.asarray(origin)) * pixel_to_space).astype(int)
+
+
+def make_piff(lattice_positions, types, constraints, ccdims):
+    """
+    Generates a PIFF (CC3D's cell initialization file) with one cube per cell.
+
+    Each cell is a square (2D) or cube (3D) centered on its position with its converted target volume.
+
+    Parameters
+    ----------
+    lattice_positions : numpy.ndarray
+        (number of cells, 3) integer array of lattice coordinates
+    types : list
+        Cell type name of each cell
+    constraints : dict
+        Converted cell constraints, used for the cell volumes
+    ccdims : tuple
+        The converted CC3D space parameters
+
+    Returns
+    -------
+    str
+        The PIFF contents
+    """
+    is_2D = ccdims[6]
+    dims = np.array([ccdims[0], ccdims[1], ccdims[2]])
+    lines = []
+    for cell_id, (position, ctype) in enumerate(zip(lattice_positions, types)):
+        if ctype in constraints.keys() and constraints[ctype]['volume']["volume (pixels)"] is not None:
+            volume = constraints[ctype]['volume']["volume (pixels)"]
+        else:
+            volume = 1
+        side = max(int(round(volume ** (1 / 2 if is_2D else 1 / 3))), 1)
+        low = np.clip(position - side // 2, 0, dims - 1)
+        high = np.clip(low + side - 1, 0, dims - 1)
+        if is_2D:
+            low[2] = high[2] = 0
+        lines.append(f"{cell_id} {ctype} {low[0]} {high[0]} {low[1]} {high[1]} {low[2]} {high[2]}")
+    return "\n".join(lines) + "\n"
+
+
+def make_pif_initializer(piff_name):
+    """
+    Returns the PIFInitializer steppable XML reading `piff_name`
+    """
+    return f'''<Steppable Type="PIFInitializer">
+\t<!-- Initial layout of cells converted from the PhysiCell cell positions file -->
+\t<PIFName>Simulation/{piff_name}</PIFName>
+</Steppable>'''
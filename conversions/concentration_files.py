@@ -0,0 +1,78 @@
+import numpy as np
+
+
+def _slab_lines(slab, z):
+    """
+    Builds the `x y z value` table CC3D expects for one z-slab of a concentration field.
+
+    Parameters
+    ----------
+    slab : numpy.ndarray
+        2D array with the concentration values of the slab, indexed [x, y]
+    z : int
+        z index of the slab
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (nx*ny, 4) with the columns x, y, z, value
+    """
+    nx, ny = slab.shape
+    xs, ys = np.meshgrid(np.arange(nx), np.arange(ny), indexing="ij")
+    table = np.empty((nx * ny, 4))
+    table[:, 0] = xs.ravel()
+    table[:, 1] = ys.ravel()
+    table[:, 2] = z
+    table[:, 3] = slab.ravel()
+    return table
+
+
+def write_concentration_file(path, field, fmt="%.8g"):
+    """
+    Writes a diffusing field into a CC3D concentration file (used by `<ConcentrationFileName>`).
+
+    CC3D reads concentration files as one pixel per line, `x y z value`. The field is written one z-slab at a time so
+    that the text representation of the whole lattice is never held in memory.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Where to write the file
+    field : numpy.ndarray
+        3D array indexed [x, y, z] with the concentration of each pixel
+    fmt : str, optional
+        Format used for the concentration values. Default "%.8g"
+
+    Returns
+    -------
+    None
+    """
+    field = np.asarray(field)
+    if field.ndim == 2:
+        field = field[:, :, np.newaxis]
+
+    with open(path, "w+") as f:
+        for z in range(field.shape[2]):
+            write_concentration_slab(f, field[:, :, z], z, fmt=fmt)
+
+
+def write_concentration_slab(f, slab, z, fmt="%.8g"):
+    """
+    Appends one z-slab of a field to an open CC3D concentration file.
+
+    Parameters
+    ----------
+    f : file
+        Open text file
+    slab : numpy.ndarray
+        2D array with the concentration values of the slab, indexed [x, y]
+    z : int
+        z index of the slab
+    fmt : str, optional
+        Format used for the concentration values. Default "%.8g"
+
+    Returns
+    -------
+    None
+    """
+    np.savetxt(f, _slab_lines(slab, z), fmt=["%d", "%d", "%d", fmt])
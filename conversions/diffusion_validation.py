@@ -0,0 +1,269 @@
+import warnings
+from math import ceil
+from time import perf_counter
+
+import numpy as np
+
+try:
+    from scipy import fft
+
+    scipy_imp = True
+except ImportError:
+    fft = None
+    scipy_imp = False
+
+
+def analytic_pulse(distance2, sigma0, D, gamma, t, n_dims):
+    """
+    Free space solution of dc/dt = D*lap(c) - gamma*c for a Gaussian initial condition of unit peak.
+
+    Parameters
+    ----------
+    distance2 : numpy.ndarray
+        Squared distance of each point to the center of the pulse
+    sigma0 : float
+        Standard deviation of the initial pulse
+    D : float
+        Diffusion constant
+    gamma : float
+        Decay constant
+    t : float
+        Time
+    n_dims : int
+        Number of dimensions
+
+    Returns
+    -------
+    numpy.ndarray
+        The concentration at each point
+    """
+    variance = sigma0 ** 2 + 2 * D * t
+    return (sigma0 ** 2 / variance) ** (n_dims / 2) * np.exp(-distance2 / (2 * variance) - gamma * t)
+
+
+def _laplacian(c):
+    """
+    Zero flux second order Laplacian with unit spacing
+    """
+    padded = np.pad(c, 1, mode="edge")
+    lap = -2 * c.ndim * c
+    core = [slice(1, -1)] * c.ndim
+    for axis in range(c.ndim):
+        up = list(core)
+        down = list(core)
+        up[axis] = slice(2, None)
+        down[axis] = slice(None, -2)
+        lap += padded[tuple(up)] + padded[tuple(down)]
+    return lap
+
+
+def get_stability_number(D, gamma, n_dims):
+    """
+    Returns 2*dims*D + gamma (unit spacing and time step). The forward Euler scheme CC3D's DiffusionSolverFE uses is
+    stable and positive for values up to 1, above it the field needs that many sub-steps per MCS.
+    """
+    return 2 * n_dims * D + gamma
+
+
+def solve_explicit(c, D, gamma, steps, substeps=None):
+    """
+    Forward Euler (CC3D's DiffusionSolverFE scheme) diffusion-decay, `substeps` steps per MCS with D and gamma divided
+    by `substeps`, like the ExtraTimesPerMCS the converter emits.
+
+    Parameters
+    ----------
+    c : numpy.ndarray
+        Initial field, in pixels
+    D : float
+        Diffusion constant in pixel^2/MCS
+    gamma : float
+        Decay constant in 1/MCS
+    steps : int
+        Number of MCS
+    substeps : int, optional
+        Solver steps per MCS. Default None, as many as needed to be stable
+
+    Returns
+    -------
+    c : numpy.ndarray
+        Field after `steps` MCS
+    substeps : int
+        Number of sub-steps per MCS used
+    """
+    if substeps is None:
+        substeps = max(ceil(get_stability_number(D, gamma, c.ndim)), 1)
+    dt = 1 / substeps
+    c = c.copy()
+    # an unstable scheme is run as is, its error is what CC3D would get
+    with np.errstate(over="ignore", invalid="ignore"):
+        for _ in range(steps * substeps):
+            c += dt * (D * _laplacian(c) - gamma * c)
+    return c, substeps
+
+
+def solve_implicit(c, D, gamma, steps):
+    """
+    Backward Euler diffusion-decay with zero flux boundaries, each step solved exactly with cosine transforms.
+
+    Parameters
+    ----------
+    c : numpy.ndarray
+        Initial field, in pixels
+    D : float
+        Diffusion constant in pixel^2/MCS
+    gamma : float
+        Decay constant in 1/MCS
+    steps : int
+        Number of MCS
+
+    Returns
+    -------
+    numpy.ndarray
+        Field after `steps` MCS
+    """
+    eigen = np.zeros(c.shape)
+    for axis, n in enumerate(c.shape):
+        view = [1] * c.ndim
+        view[axis] = n
+        eigen = eigen + (4 * np.sin(np.pi * np.arange(n) / (2 * n)) ** 2).reshape(view)
+    factor = 1 / (1 + D * eigen + gamma)
+    modes = fft.dctn(c, type=2, norm="ortho")
+    for _ in range(steps):
+        modes *= factor
+    return fft.idctn(modes, type=2, norm="ortho")
+
+
+def validate_field(D, gamma, D_w_units, gamma_w_units, pixel_to_space, time_per_mcs, is_2D, substeps=1,
+                   sigma0_pixels=3, spread_pixels=5, max_side=256, max_steps=1000):
+    """
+    Runs a converted field on a patch of the CC3D lattice and compares it with the analytic solution in PhysiCell
+    units.
+
+    A Gaussian pulse of `sigma0_pixels` is diffused until it spreads by about `spread_pixels`, with the scheme CC3D
+    gets (D/substeps and gamma/substeps, `substeps` times per MCS) on the lattice and with the original (PhysiCell
+    units) parameters analytically. Any mistake in the space or time conversion of D or gamma, or an unstable
+    emitted scheme, shows up as a large error.
+
+    Parameters
+    ----------
+    D : float
+        Converted diffusion constant, pixel^2/MCS
+    gamma : float
+        Converted decay constant, 1/MCS
+    D_w_units : float
+        PhysiCell diffusion constant
+    gamma_w_units : float
+        PhysiCell decay constant
+    pixel_to_space : float
+        Number of pixels per PhysiCell space unit
+    time_per_mcs : float
+        PhysiCell time units per MCS
+    is_2D : bool
+        Whether the simulation is 2D
+    substeps : int, optional
+        Solver steps per MCS emitted for the field (ExtraTimesPerMCS + 1). Default 1
+    sigma0_pixels : float, optional
+        Width of the initial pulse in pixels. Default 3
+    spread_pixels : float, optional
+        How much the pulse should spread during the test, in pixels. Default 5
+    max_side : int, optional
+        Largest number of pixels per side of the test patch. Default 256
+    max_steps : int, optional
+        Largest number of MCS simulated. Default 1000
+
+    Returns
+    -------
+    dict
+        Steps, sub-steps, stability number and margin of the emitted scheme, and the relative L2 error and throughput
+        (voxel updates per second) of each solver
+    """
+    n_dims = 2 if is_2D else 3
+    steps = int(min(max(ceil(spread_pixels ** 2 / (2 * D)) if D > 0 else 1, 1), max_steps))
+    # keep gamma*t small enough for the pulse to stay measurable
+    if gamma > 0:
+        steps = max(min(steps, int(5 / gamma)), 1)
+
+    width = sigma0_pixels ** 2 + 2 * D * steps
+    half = min(int(ceil(4 * width ** (1 / 2))) + 1, max_side // 2)
+    shape = (2 * half,) * n_dims
+    coordinates = np.indices(shape) + 0.5 - half
+    distance2 = np.sum(coordinates ** 2, axis=0)
+
+    initial = analytic_pulse(distance2, sigma0_pixels, 0, 0, 0, n_dims)
+    # the reference uses only PhysiCell units
+    reference = analytic_pulse(distance2 / pixel_to_space ** 2, sigma0_pixels / pixel_to_space, D_w_units,
+                               gamma_w_units, steps * time_per_mcs, n_dims)
+    norm = np.linalg.norm(reference)
+
+    stability = get_stability_number(D / substeps, gamma / substeps, n_dims)
+    report = {"steps": steps, "lattice": shape, "stability_number": stability, "stability_margin": 1 - stability}
+
+    start = perf_counter()
+    explicit, substeps = solve_explicit(initial, D, gamma, steps, substeps=substeps)
+    elapsed = perf_counter() - start
+    report["substeps"] = substeps
+    report["explicit_error"] = float(np.linalg.norm(explicit - reference) / norm) if norm > 0 else 0.0
+    report["explicit_throughput"] = initial.size * steps * substeps / max(elapsed, 1e-12)
+
+    if scipy_imp:
+        start = perf_counter()
+        implicit = solve_implicit(initial, D, gamma, steps)
+        elapsed = perf_counter() - start
+        report["implicit_error"] = float(np.linalg.norm(implicit - reference) / norm) if norm > 0 else 0.0
+        report["implicit_throughput"] = initial.size * steps / max(elapsed, 1e-12)
+    return report
+
+
+def validate_diffusion(d_elements, ccdims, cctime, tolerance=0.05):
+    """
+    Validates the converted diffusion and decay constants of every DiffusionSolverFE field.
+
+    Each field is run with the converted parameters on a patch of the lattice and compared with the analytic solution
+    in PhysiCell units (see validate_field), with the sub-steps emitted in the CC3DML. The report gives the error, the
+    stability margin of the emitted forward Euler scheme and the throughput. Fields whose emitted scheme is unstable,
+    or whose error is above `tolerance`, are flagged with a warning.
+
+    Parameters
+    ----------
+    d_elements : dict
+        Dictionary of diffusing elements (see cc3d_xml_gen.get_physicell_data.get_microenvironment), after any
+        re-conversion
+    ccdims : tuple
+        The converted CC3D space parameters
+    cctime : tuple
+        The converted CC3D time parameters
+    tolerance : float, optional
+        Largest acceptable relative error. Default 0.05
+
+    Returns
+    -------
+    dict
+        {field name: report}
+    """
+    reports = {}
+    for key, item in d_elements.items():
+        if item["use_steady_state"]:
+            print(f"{key} uses the steady state solver, skipping its validation")
+            continue
+        substeps = item["substeps"] if "substeps" in item.keys() else 1
+        report = validate_field(item["D"], item["gamma"], item["D_w_units"], item["gamma_w_units"], ccdims[4],
+                                1 / cctime[2], ccdims[6], substeps=substeps)
+        reports[key] = report
+        message = f"{key}: D={item['D']:.4g} pixel^2/MCS, gamma={item['gamma']:.4g} 1/MCS, " \
+                  f"{report['steps']} MCS on a {report['lattice']} patch\n" \
+                  f"\tstability number per solver step (2*dims*D+gamma)/substeps={report['stability_number']:.4g} " \
+                  f"(margin {report['stability_margin']:.4g}, {report['substeps']} forward Euler steps per MCS)\n" \
+                  f"\texplicit: error={100 * report['explicit_error']:.2f}%, " \
+                  f"{report['explicit_throughput']:.3g} voxel-updates/s"
+        if "implicit_error" in report.keys():
+            message += f"\n\timplicit (one backward Euler step per MCS): " \
+                       f"error={100 * report['implicit_error']:.2f}%, " \
+                       f"{report['implicit_throughput']:.3g} voxel-updates/s"
+        print(message)
+        if report["stability_margin"] < 0:
+            warnings.warn(f"WARNING: the emitted forward Euler scheme of {key} is unstable (margin "
+                          f"{report['stability_margin']:.4g}), it needs more solver steps per MCS")
+        if not report["explicit_error"] <= tolerance:
+            warnings.warn(f"WARNING: the converted diffusion of {key} differs from the PhysiCell solution by "
+                          f"{100 * report['explicit_error']:.1f}%. Check its space and time unit conversion.")
+    return reports
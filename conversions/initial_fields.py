@@ -0,0 +1,224 @@
+import warnings
+from itertools import islice
+from os.path import join
+
+import numpy as np
+
+from conversions.concentration_files import write_concentration_slab
+from conversions.matlab_files import read_mat_v4
+
+try:
+    from scipy.ndimage import map_coordinates
+
+    scipy_imp = True
+except ImportError:
+    map_coordinates = None
+    scipy_imp = False
+
+
+def iter_matlab_voxels(path, chunk_size=100_000):
+    """
+    Reads a BioFVM (MATLAB level 4) microenvironment file chunk by chunk.
+
+    BioFVM stores the microenvironment as a (4 + number of substrates) x (number of voxels) matrix, where each column
+    is x, y, z, voxel volume, and the substrate densities of one voxel. MATLAB level 4 files store the matrix
+    column-major, so each voxel is contiguous on disk and the file can be memory mapped and read voxel block by voxel
+    block.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the .mat file
+    chunk_size : int, optional
+        Number of voxels per chunk. Default 100000
+
+    Yields
+    ------
+    numpy.ndarray
+        (voxels in chunk, 3) array of the voxel centers
+    numpy.ndarray
+        (voxels in chunk, number of substrates) array of the densities
+    """
+    matrices = read_mat_v4(path)
+    if not matrices:
+        raise ValueError(f"{path} has no MATLAB level 4 matrix")
+    # (voxels, 4 + number of substrates), a view of the memory map with each voxel contiguous
+    data = next(iter(matrices.values())).T
+    for start in range(0, data.shape[0], chunk_size):
+        block = np.asarray(data[start:start + chunk_size], dtype=float)
+        yield block[:, :3], block[:, 4:]
+
+
+def iter_csv_voxels(path, chunk_size=100_000):
+    """
+    Reads a PhysiCell csv microenvironment initial condition chunk by chunk.
+
+    Each line of the file is x, y, z and the substrate densities of one voxel. An optional header line is skipped.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the .csv file
+    chunk_size : int, optional
+        Number of voxels per chunk. Default 100000
+
+    Yields
+    ------
+    numpy.ndarray
+        (voxels in chunk, 3) array of the voxel centers
+    numpy.ndarray
+        (voxels in chunk, number of substrates) array of the densities
+    """
+    with open(path, "r") as f:
+        first = f.readline()
+        lines = [] if any(c.isalpha() and c not in "eE" for c in first) else [first]
+        while True:
+            lines.extend(islice(f, chunk_size - len(lines)))
+            if not lines:
+                return
+            block = np.loadtxt(lines, delimiter=",", ndmin=2)
+            lines = []
+            yield block[:, :3], block[:, 3:]
+
+
+def read_physicell_mesh(voxel_chunks, origin, spacing, shape):
+    """
+    Places the voxels of a PhysiCell microenvironment file into (x, y, z, substrate) arrays of the BioFVM mesh.
+
+    Parameters
+    ----------
+    voxel_chunks : iterable
+        Chunks of voxels as yielded by iter_matlab_voxels or iter_csv_voxels
+    origin : tuple
+        (xmin, ymin, zmin) of the PhysiCell domain
+    spacing : tuple
+        (dx, dy, dz) of the PhysiCell mesh
+    shape : tuple
+        Number of voxels of the PhysiCell mesh in each direction
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (nx, ny, nz, number of substrates)
+    """
+    mesh = None
+    origin = np.asarray(origin)
+    spacing = np.asarray(spacing)
+    upper = np.asarray(shape) - 1
+    for centers, densities in voxel_chunks:
+        if mesh is None:
+            mesh = np.zeros(tuple(shape) + (densities.shape[1],))
+        index = np.clip(np.floor((centers - origin) / spacing).astype(int), 0, upper)
+        mesh[index[:, 0], index[:, 1], index[:, 2]] = densities
+    return mesh
+
+
+def resample_slab(mesh, z, pc_origin, pc_spacing, cc_origin, pixel_to_space, slab_shape):
+    """
+    Interpolates (linearly) one z-slab of the CC3D lattice from a PhysiCell mesh.
+
+    Parameters
+    ----------
+    mesh : numpy.ndarray
+        (nx, ny, nz) PhysiCell mesh of one substrate
+    z : int
+        z index of the CC3D slab
+    pc_origin : tuple
+        (xmin, ymin, zmin) of the PhysiCell domain
+    pc_spacing : tuple
+        (dx, dy, dz) of the PhysiCell mesh
+    cc_origin : tuple
+        Position (in PhysiCell units) of the corner of the CC3D lattice
+    pixel_to_space : float
+        Number of CC3D pixels per PhysiCell space unit
+    slab_shape : tuple
+        (x, y) dimensions of the CC3D lattice
+
+    Returns
+    -------
+    numpy.ndarray
+        The (x, y) slab
+    """
+    nx, ny = slab_shape
+    coords = []
+    for axis, pixels in enumerate((np.arange(nx), np.arange(ny), np.array([z]))):
+        position = cc_origin[axis] + (pixels + 0.5) / pixel_to_space
+        coords.append((position - pc_origin[axis]) / pc_spacing[axis] - 0.5)
+    if mesh.shape[2] == 1:
+        coords[2] = np.zeros(1)
+    grid = np.meshgrid(*coords, indexing="ij")
+    return map_coordinates(mesh, grid, order=1, mode="nearest")[:, :, 0]
+
+
+def convert_initial_substrate_file(path, file_type, diffusing_elements, ccdims, sim_dir, mesh_geometry,
+                                   cc_origin=None, chunk_size=100_000):
+    """
+    Converts a PhysiCell microenvironment initial condition file into CC3D concentration files.
+
+    The PhysiCell file is streamed chunk by chunk into the (small) BioFVM mesh, which is then interpolated onto the
+    final CC3D lattice (after any re-scaling or truncation of the domain) one z-slab at a time, each slab being
+    appended to the field's concentration file. The CC3D lattice is never held in memory.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the PhysiCell initial condition file
+    file_type : str
+        "matlab" or "csv"
+    diffusing_elements : dict
+        Dictionary of diffusing elements (see cc3d_xml_gen.get_physicell_data.get_microenvironment), in the same
+        order as the substrates in the file
+    ccdims : tuple
+        The converted CC3D space parameters
+    sim_dir : str or pathlib.Path
+        The converted simulation's Simulation folder
+    mesh_geometry : tuple
+        (origin, spacing, shape) of the PhysiCell mesh (see get_microenvironment_mesh)
+    cc_origin : tuple, optional
+        Position (in PhysiCell units) of the corner of the CC3D lattice. Default is the PhysiCell domain corner
+    chunk_size : int, optional
+        Number of voxels read at a time. Default 100000
+
+    Returns
+    -------
+    dict
+        The diffusing elements dictionary with the "concentration_file" keys set
+    """
+    if not scipy_imp:
+        warnings.warn("WARNING: scipy is needed to convert PhysiCell initial condition files. Skipping.")
+        return diffusing_elements
+
+    pc_origin, pc_spacing, pc_shape = mesh_geometry
+    if cc_origin is None:
+        cc_origin = pc_origin
+
+    if file_type == "matlab":
+        chunks = iter_matlab_voxels(path, chunk_size=chunk_size)
+    elif file_type == "csv":
+        chunks = iter_csv_voxels(path, chunk_size=chunk_size)
+    else:
+        warnings.warn(f"WARNING: PhysiCell initial condition files of type {file_type} are not supported. Skipping.")
+        return diffusing_elements
+
+    mesh = read_physicell_mesh(chunks, pc_origin, pc_spacing, pc_shape)
+    if mesh is None:
+        warnings.warn(f"WARNING: {path} has no voxels. Skipping.")
+        return diffusing_elements
+
+    names = list(diffusing_elements.keys())
+    if mesh.shape[3] != len(names):
+        message = f"WARNING: {path} has {mesh.shape[3]} substrates but the microenvironment defines {len(names)}. " \
+                  f"Only the first {min(mesh.shape[3], len(names))} will be converted."
+        warnings.warn(message)
+
+    for idx, key in enumerate(names[:mesh.shape[3]]):
+        name = key.replace(" ", "_")
+        file_name = f"{name}_initial_condition.txt"
+        print(f"Converting initial condition of {key} to {file_name}")
+        with open(join(sim_dir, file_name), "w+") as f:
+            for z in range(ccdims[2]):
+                slab = resample_slab(mesh[:, :, :, idx], z, pc_origin, pc_spacing, cc_origin, ccdims[4],
+                                     (ccdims[0], ccdims[1]))
+                write_concentration_slab(f, slab, z)
+        diffusing_elements[key]["concentration_file"] = f"Simulation/{file_name}"
+    return diffusing_elements
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import numpy as np
+
+_mat_types = {0: "f8", 10: "f4", 20: "i4", 30: "i2", 40: "u2", 50: "u1"}
+
+
+def read_mat_v4(path, mmap=True):
+    """
+    Reads the matrices of a MATLAB level 4 .mat file (the format of PhysiCell's cell and microenvironment data, and of
+    BioFVM's initial conditions).
+
+    The matrices are memory mapped: nothing is read from disk until the returned arrays are indexed.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The .mat file
+    mmap : bool, optional
+        Memory map the data instead of reading it. Default True
+
+    Returns
+    -------
+    dict
+        {variable name: (rows, columns) array}
+    """
+    matrices = {}
+    size = Path(path).stat().st_size
+    with open(path, "rb") as f:
+        offset = 0
+        while offset < size:
+            f.seek(offset)
+            header = np.frombuffer(f.read(20), dtype="<i4")
+            if len(header) < 5:
+                break
+            mopt, rows, columns, imaginary, name_length = (int(h) for h in header)
+            if mopt > 5000:
+                # big endian file
+                header = header.byteswap()
+                mopt, rows, columns, imaginary, name_length = (int(h) for h in header)
+                endian = ">"
+            else:
+                endian = "<"
+            name = f.read(name_length).rstrip(b"\x00").decode()
+            dtype = np.dtype(endian + _mat_types[(mopt % 1000) // 10 * 10])
+            data_offset = offset + 20 + name_length
+            count = rows * columns
+            # column major: the memory layout of a (columns, rows) C array
+            if mmap:
+                data = np.memmap(path, dtype=dtype, mode="r", offset=data_offset, shape=(columns, rows))
+            else:
+                f.seek(data_offset)
+                data = np.fromfile(f, dtype=dtype, count=count).reshape(columns, rows)
+            matrices[name] = data.T
+            offset = data_offset + count * dtype.itemsize * (2 if imaginary else 1)
+    return matrices
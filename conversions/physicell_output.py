@@ -0,0 +1,320 @@
+import re
+import warnings
+import xml.etree.ElementTree as ET
+from math import pi
+from pathlib import Path
+
+import numpy as np
+
+from conversions.matlab_files import read_mat_v4
+
+# columns of PhysiCell's cells matrix if the snapshot doesn't label them (data version 1)
+_default_labels = {"ID": (0, 1), "position": (1, 3), "total_volume": (4, 1), "cell_type": (5, 1)}
+
+def read_snapshot_metadata(path):
+    """
+    Reads a PhysiCell MultiCellDS snapshot (outputXXXXXXXX.xml): time, cell data columns, cell type names, substrates
+    and mesh.
+
+    Returns
+    -------
+    dict
+        "time", "time_units", "cells_file", "labels" ({label: (first column, number of columns)}), "type_names"
+        ({type ID: name}), "microenvironment_file", "substrates" (names, in data order) and "mesh" ((x, y, z)
+        coordinates of the voxel centers)
+    """
+    path = Path(path)
+    root = ET.parse(path).getroot()
+    metadata = {"time": None, "time_units": None, "cells_file": None, "labels": dict(_default_labels),
+                "type_names": {}, "microenvironment_file": None, "substrates": [], "mesh": None}
+
+    current_time = root.find("metadata/current_time")
+    if current_time is not None:
+        metadata["time"] = float(current_time.text)
+        metadata["time_units"] = current_time.get("units")
+
+    simplified = root.find(".//cellular_information//simplified_data")
+    if simplified is not None:
+        filename = simplified.find("filename")
+        if filename is not None:
+            metadata["cells_file"] = path.parent.joinpath(filename.text.strip())
+        labels = simplified.findall("labels/label")
+        if labels:
+            metadata["labels"] = {label.text.strip(): (int(label.get("index")), int(label.get("size")))
+                                  for label in labels}
+        for cell_type in simplified.findall("cell_types/type"):
+            metadata["type_names"][int(cell_type.get("ID"))] = cell_type.text.strip()
+
+    microenvironment = root.find("microenvironment/domain")
+    if microenvironment is not None:
+        metadata["substrates"] = [variable.get("name") for variable in
+                                  sorted(microenvironment.findall("variables/variable"),
+                                         key=lambda v: int(v.get("ID", 0)))]
+        mesh = microenvironment.find("mesh")
+        if mesh is not None:
+            metadata["mesh"] = tuple(np.array(mesh.find(f"{axis}_coordinates").text.split(), dtype=float)
+                                     for axis in ("x", "y", "z"))
+        filename = microenvironment.find("data/filename")
+        if filename is not None:
+            metadata["microenvironment_file"] = path.parent.joinpath(filename.text.strip())
+    return metadata
+
+
+def _column(cells, labels, name, fallback=None):
+    if name not in labels.keys():
+        return fallback
+    index, size = labels[name]
+    return np.array(cells[index:index + size].T if size > 1 else cells[index])
+
+
+def read_physicell_snapshot(path, substrates=True):
+    """
+    Reads one PhysiCell snapshot, copying only the cell positions, types and volumes and the substrate grids out of
+    the memory mapped .mat files.
+
+    Returns
+    -------
+    dict
+        "time", "positions" ((cells, 3) array), "types" (array of type names), "volumes" and "substrates" ({name:
+        (x, y, z) grid}, empty if `substrates` is False or the snapshot has none), plus "mesh"
+    """
+    metadata = read_snapshot_metadata(path)
+    snapshot = {"time": metadata["time"], "positions": np.zeros((0, 3)), "types": np.zeros(0, dtype=str),
+                "volumes": np.zeros(0), "substrates": {}, "mesh": metadata["mesh"]}
+    if metadata["cells_file"] is not None and metadata["cells_file"].exists():
+        cells = next(iter(read_mat_v4(metadata["cells_file"]).values()))
+        labels = metadata["labels"]
+        snapshot["positions"] = _column(cells, labels, "position", np.zeros((cells.shape[1], 3)))
+        type_ids = _column(cells, labels, "cell_type", np.zeros(cells.shape[1])).astype(int)
+        names = metadata["type_names"]
+        snapshot["types"] = np.array([names.get(t, str(t)).replace(" ", "_") for t in type_ids])
+        snapshot["volumes"] = _column(cells, labels, "total_volume", np.zeros(cells.shape[1]))
+        del cells
+
+    micro_file = metadata["microenvironment_file"]
+    if substrates and micro_file is not None and micro_file.exists() and metadata["mesh"] is not None:
+        voxels = next(iter(read_mat_v4(micro_file).values()))
+        shape = tuple(len(c) for c in metadata["mesh"])
+        # rows: x, y, z, voxel volume, then one row per substrate; voxels are ordered x fastest
+        for index, name in enumerate(metadata["substrates"]):
+            values = np.array(voxels[4 + index])
+            snapshot["substrates"][name] = values.reshape(shape[::-1]).transpose(2, 1, 0)
+        del voxels
+    return snapshot
+
+
+def stream_physicell_output(folder, substrates=True):
+    """
+    Yields the snapshots (see read_physicell_snapshot) of a PhysiCell output folder one at a time, in time order.
+    Only one snapshot is in memory at once.
+    """
+    for path in sorted(Path(folder).glob("output*.xml")):
+        yield read_physicell_snapshot(path, substrates=substrates)
+
+
+def pixels_to_volume(pixels, pixel_to_space, is_2D):
+    """
+    Converts CC3D cell volumes (pixels) to PhysiCell volumes. In 2D the cell is the equatorial slice of a sphere,
+    as in the conversion of the volume constraints (see cc3d_xml_gen.gen.slice_to_2D).
+    """
+    if is_2D:
+        area = np.asarray(pixels, dtype=float) / pixel_to_space ** 2
+        return 4 / 3 * pi * (area / pi) ** (3 / 2)
+    return np.asarray(pixels, dtype=float) / pixel_to_space ** 3
+
+
+def read_cc3d_pif(path, pixel_to_space, origin=(0, 0, 0), is_2D=True):
+    """
+    Reads a CC3D PIF dump (PIFDumper) as cell positions, types and volumes in PhysiCell units
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The .piff file
+    pixel_to_space : float
+        Number of CC3D pixels per PhysiCell space unit
+    origin : tuple, optional
+        Position (in PhysiCell units) of the corner of the CC3D lattice. Default (0, 0, 0)
+    is_2D : bool, optional
+        Whether the CC3D simulation is 2D. Default True
+
+    Returns
+    -------
+    dict
+        "positions", "types" and "volumes", like read_physicell_snapshot
+    """
+    ids = []
+    types = {}
+    boxes = []
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 8 or not parts[0].isdigit():
+                continue
+            cell_id = int(parts[0])
+            if parts[1] == "Medium":
+                continue
+            ids.append(cell_id)
+            types[cell_id] = parts[1]
+            boxes.append([int(p) for p in parts[2:8]])
+    if not ids:
+        return {"positions": np.zeros((0, 3)), "types": np.zeros(0, dtype=str), "volumes": np.zeros(0)}
+    ids = np.array(ids)
+    boxes = np.array(boxes, dtype=float)
+    counts = np.prod(boxes[:, 1::2] - boxes[:, 0::2] + 1, axis=1)
+    centers = (boxes[:, 1::2] + boxes[:, 0::2]) / 2 + 0.5
+    unique, inverse = np.unique(ids, return_inverse=True)
+    volumes = np.bincount(inverse, weights=counts)
+    positions = np.stack([np.bincount(inverse, weights=centers[:, axis] * counts) for axis in range(3)], axis=1)
+    positions = positions / volumes[:, None] / pixel_to_space + np.asarray(origin, dtype=float)
+    if is_2D:
+        positions[:, 2] = origin[2]
+    return {"positions": positions,
+            "types": np.array([types[i] for i in unique]),
+            "volumes": pixels_to_volume(volumes, pixel_to_space, is_2D)}
+
+
+def stream_cc3d_output(folder, pixel_to_space, time_per_mcs, origin=(0, 0, 0), is_2D=True, substrates=True):
+    """
+    Yields the snapshots of a converted CC3D run one at a time, in PhysiCell units: the PIFDumper cell dumps
+    (<name>.<mcs>.piff) and, if the OutputSteppable saved them, the field snapshots of the same MCS
+    (field_snapshots/, read one time slice at a time).
+
+    Parameters
+    ----------
+    folder : str or pathlib.Path
+        CC3D output folder
+    pixel_to_space : float
+        Number of CC3D pixels per PhysiCell space unit
+    time_per_mcs : float
+        PhysiCell time units per MCS
+    origin : tuple, optional
+        Position (in PhysiCell units) of the corner of the CC3D lattice. Default (0, 0, 0)
+    is_2D : bool, optional
+        Whether the CC3D simulation is 2D. Default True
+    substrates : bool, optional
+        Read the fields. Default True
+    """
+    folder = Path(folder)
+    snapshot_dir = folder.joinpath("field_snapshots")
+    snapshot_index = None
+    field_names = []
+    if substrates and snapshot_dir.joinpath("index.csv").exists():
+        from steppable_gen.pc2cc3d_runtime import read_snapshot_index, load_snapshot
+        snapshot_index = read_snapshot_index(snapshot_dir)
+        field_names = _store_field_names(snapshot_dir)
+    dumps = []
+    for path in folder.rglob("*.piff"):
+        numbers = re.findall(r"\d+", path.stem)
+        if numbers:
+            dumps.append((int(numbers[-1]), path))
+    for mcs, path in sorted(dumps):
+        snapshot = read_cc3d_pif(path, pixel_to_space, origin=origin, is_2D=is_2D)
+        snapshot["time"] = mcs * time_per_mcs
+        snapshot["substrates"] = {}
+        if snapshot_index is not None and mcs in snapshot_index.keys():
+            for name in field_names:
+                snapshot["substrates"][name] = load_snapshot(snapshot_dir, name, mcs, index=snapshot_index)
+        elif substrates:
+            # stores disabled, the fields were saved one file per MCS
+            for dump in folder.glob(f"*_{mcs:09d}.npy"):
+                snapshot["substrates"][dump.stem[:-10]] = np.load(dump, mmap_mode="r")
+        yield snapshot
+
+
+def _store_field_names(directory):
+    # a SnapshotStore's index doesn't list its fields, its first chunk does
+    chunks = sorted(directory.glob("chunk_000000*"))
+    if not chunks:
+        return []
+    if chunks[0].suffix == ".npz":
+        with np.load(chunks[0]) as data:
+            return list(data.keys())
+    return [chunk.stem[len("chunk_000000_"):] for chunk in chunks]
+
+
+def summary_statistics(snapshot):
+    """
+    Summary statistics of a snapshot of either simulator (see stream_physicell_output and stream_cc3d_output)
+
+    Returns
+    -------
+    dict
+        Time, number of cells, per type count and mean volume, center and radius of gyration of the cells, and per
+        substrate mean, min and max
+    """
+    positions = snapshot["positions"]
+    stats = {"time": snapshot["time"], "cells": len(positions)}
+    for cell_type in np.unique(snapshot["types"]):
+        of_type = snapshot["types"] == cell_type
+        stats[f"{cell_type} cells"] = int(np.count_nonzero(of_type))
+        stats[f"{cell_type} mean volume"] = float(np.mean(snapshot["volumes"][of_type]))
+    if len(positions):
+        center = positions.mean(axis=0)
+        stats["center x"], stats["center y"], stats["center z"] = (float(c) for c in center)
+        stats["radius of gyration"] = float(np.sqrt(np.mean(np.sum((positions - center) ** 2, axis=1))))
+    for name, grid in snapshot["substrates"].items():
+        stats[f"{name} mean"] = float(np.mean(grid))
+        stats[f"{name} min"] = float(np.min(grid))
+        stats[f"{name} max"] = float(np.max(grid))
+    return stats
+
+
+def read_cc3d_units(cc3dml):
+    """
+    Reads the pixel to space and MCS to time ratios, and whether the lattice is 2D, from a converted CC3DML file
+
+    Returns
+    -------
+    tuple
+        (pixels per PhysiCell space unit, PhysiCell time units per MCS, is 2D)
+    """
+    root = ET.parse(cc3dml).getroot()
+    pixel_to_space = float(root.find(".//*[@id='pixel_to_space']").text)
+    time_per_mcs = 1 / float(root.find(".//*[@id='mcs_to_time']").text)
+    dimensions = root.find("Potts/Dimensions")
+    is_2D = dimensions is not None and int(dimensions.get("z", 1)) == 1
+    return pixel_to_space, time_per_mcs, is_2D
+
+
+def domain_origin(physicell_folder):
+    """
+    Lower corner of the PhysiCell domain, from the mesh of its first snapshot ((0, 0, 0) if there is none). The
+    converted CC3D lattice starts there.
+    """
+    for path in sorted(Path(physicell_folder).glob("output*.xml")):
+        mesh = read_snapshot_metadata(path)["mesh"]
+        if mesh is not None:
+            return tuple(float(c[0] - (c[1] - c[0]) / 2) if len(c) > 1 else 0.0 for c in mesh)
+        break
+    return 0.0, 0.0, 0.0
+
+
+def compare_outputs(physicell_folder, cc3d_folder, pixel_to_space, time_per_mcs, origin=None, is_2D=True,
+                    substrates=True):
+    """
+    Pairs the summary statistics of a PhysiCell run and of its converted CC3D run at matching times, streaming both
+    outputs (one snapshot of each in memory at once).
+
+    Returns
+    -------
+    list
+        [(PhysiCell statistics, CC3D statistics)] for every PhysiCell snapshot, matched with the CC3D snapshot closest
+        in time (None if the CC3D run has no snapshots)
+    """
+    if origin is None:
+        origin = domain_origin(physicell_folder)
+    cc3d_stats = [summary_statistics(s) for s in stream_cc3d_output(cc3d_folder, pixel_to_space, time_per_mcs,
+                                                                    origin=origin, is_2D=is_2D,
+                                                                    substrates=substrates)]
+    if not cc3d_stats:
+        warnings.warn(f"WARNING: no PIF dumps found in {cc3d_folder}, only PhysiCell's statistics are reported")
+    cc3d_times = np.array([s["time"] for s in cc3d_stats])
+    pairs = []
+    for snapshot in stream_physicell_output(physicell_folder, substrates=substrates):
+        stats = summary_statistics(snapshot)
+        match = None
+        if len(cc3d_times):
+            match = cc3d_stats[int(np.argmin(np.abs(cc3d_times - stats["time"])))]
+        pairs.append((stats, match))
+    return pairs
@@ -0,0 +1,355 @@
+import hashlib
+import warnings
+from os.path import join
+
+import numpy as np
+
+from conversions.concentration_files import write_concentration_file
+
+try:
+    from scipy import sparse, fft
+    from scipy.sparse.linalg import factorized, cg, LinearOperator
+
+    scipy_imp = True
+except ImportError:
+    sparse = None
+    fft = None
+    factorized = None
+    cg = None
+    LinearOperator = None
+    scipy_imp = False
+
+# Laplacian and its eigenvalues (the factorization of the constant coefficient problem by fast transforms), keyed by
+# the lattice geometry only, and the solvers (the costly direct factorization of per pixel uptake) keyed by the
+# geometry and the coefficients. Every field and variant converted by the process reuses them
+_geometry_cache = {}
+_solver_cache = {}
+
+
+def _second_difference(n, dirichlet):
+    """
+    1D second difference operator on `n` pixels with unit spacing.
+
+    With `dirichlet` the boundary value sits one pixel outside the lattice (its contribution goes to the right hand
+    side), otherwise the boundary is zero flux.
+    """
+    main = -2 * np.ones(n)
+    if not dirichlet:
+        main[0] = -1
+        main[-1] = -1
+    off = np.ones(n - 1)
+    return sparse.diags([off, main, off], [-1, 0, 1], format="csr")
+
+
+def make_laplacian(shape, dirichlet, is_2D):
+    """
+    Sparse 7-point (5-point in 2D) Laplacian of the lattice, with constant value or zero flux boundaries
+    """
+    nx, ny, nz = shape
+    ix, iy, iz = sparse.identity(nx), sparse.identity(ny), sparse.identity(nz)
+    lap = sparse.kron(sparse.kron(_second_difference(nx, dirichlet), iy), iz) + \
+        sparse.kron(sparse.kron(ix, _second_difference(ny, dirichlet)), iz)
+    if not is_2D:
+        lap = lap + sparse.kron(sparse.kron(ix, iy), _second_difference(nz, dirichlet))
+    return lap.tocsr()
+
+
+def laplacian_eigenvalues(shape, dirichlet, is_2D):
+    """
+    Eigenvalues of -make_laplacian, in the basis of the sine (constant value) or cosine (zero flux) transforms
+    """
+    eigen = np.zeros(shape)
+    for axis in ((0, 1) if is_2D else (0, 1, 2)):
+        n = shape[axis]
+        k = np.arange(n)
+        if dirichlet:
+            lam = 4 * np.sin(np.pi * (k + 1) / (2 * (n + 1))) ** 2
+        else:
+            lam = 4 * np.sin(np.pi * k / (2 * n)) ** 2
+        view = [1, 1, 1]
+        view[axis] = n
+        eigen = eigen + lam.reshape(view)
+    return eigen
+
+
+def get_geometry(shape, dirichlet, is_2D):
+    """
+    Laplacian and Laplacian eigenvalues of the lattice, cached for the process. They only depend on the geometry:
+    shape, boundary conditions and dimension.
+
+    Returns
+    -------
+    laplacian, eigenvalues : scipy.sparse.csr_matrix, numpy.ndarray
+    """
+    key = (tuple(shape), bool(dirichlet), bool(is_2D))
+    if key not in _geometry_cache:
+        _geometry_cache[key] = make_laplacian(shape, dirichlet, is_2D), laplacian_eigenvalues(shape, dirichlet, is_2D)
+    return _geometry_cache[key]
+
+
+def make_steady_state_operator(shape, D, decay, dirichlet, is_2D, laplacian=None):
+    """
+    Builds the sparse matrix of the steady state diffusion-decay problem -D*lap(c) + decay*c on the CC3D lattice.
+
+    Parameters
+    ----------
+    shape : tuple
+        Lattice dimensions (x, y, z)
+    D : float
+        Diffusion constant in pixel^2/MCS
+    decay : float or numpy.ndarray
+        Decay rate in 1/MCS, either global or one value per pixel (decay + uptake by the cells)
+    dirichlet : bool
+        Whether the boundaries have a constant value, otherwise they are zero flux
+    is_2D : bool
+        Whether the simulation is 2D, in which case the z direction is ignored
+    laplacian : scipy.sparse.csr_matrix, optional
+        The lattice's Laplacian (see get_geometry). Default None, built here
+
+    Returns
+    -------
+    scipy.sparse.csc_matrix
+        The (symmetric positive definite, if the problem is well posed) operator
+    """
+    if laplacian is None:
+        laplacian = make_laplacian(shape, dirichlet, is_2D)
+    decay = np.broadcast_to(np.asarray(decay, dtype=float), (shape[0] * shape[1] * shape[2],))
+    return (-D * laplacian + sparse.diags(decay)).tocsc()
+
+
+def _boundary_rhs(shape, D, value, is_2D):
+    """
+    Right hand side contribution of constant value boundaries.
+    """
+    rhs = np.zeros(shape)
+    rhs[0, :, :] += D * value
+    rhs[-1, :, :] += D * value
+    rhs[:, 0, :] += D * value
+    rhs[:, -1, :] += D * value
+    if not is_2D:
+        rhs[:, :, 0] += D * value
+        rhs[:, :, -1] += D * value
+    return rhs
+
+
+def _spectral_solve(rhs, eigen, dirichlet, is_2D):
+    """
+    Solves the constant coefficient problem, whose operator is diagonal (`eigen`) in the sine (constant value) or cosine
+    (zero flux) basis, with fast transforms
+    """
+    axes = (0, 1) if is_2D else (0, 1, 2)
+    rhs = rhs.reshape(eigen.shape)
+    if dirichlet:
+        return fft.idstn(fft.dstn(rhs, type=1, axes=axes, norm="ortho") / eigen, type=1, axes=axes,
+                         norm="ortho").ravel()
+    return fft.idctn(fft.dctn(rhs, type=2, axes=axes, norm="ortho") / eigen, type=2, axes=axes, norm="ortho").ravel()
+
+
+def _get_solver(shape, D, decay, dirichlet, is_2D, max_direct_size):
+    """
+    Returns a function solving the steady state problem for a given right hand side, cached by geometry and
+    coefficients (a hash of the per pixel decay).
+
+    The geometry (see get_geometry) is cached, the coefficients only scale it: a uniform decay is solved exactly with
+    fast transforms, a per pixel decay (uptake by the cells) with a direct factorization on small lattices, or
+    conjugate gradient preconditioned by the exact solver of the averaged problem on large ones.
+    """
+    key = (tuple(shape), bool(dirichlet), bool(is_2D), float(D),
+           hashlib.sha1(np.ascontiguousarray(decay, dtype=float).tobytes()).hexdigest(), max_direct_size)
+    if key not in _solver_cache:
+        _solver_cache[key] = _make_solver(shape, D, decay, dirichlet, is_2D, max_direct_size)
+    else:
+        print("Reusing a steady state solver with the same geometry and coefficients")
+    return _solver_cache[key]
+
+
+def _make_solver(shape, D, decay, dirichlet, is_2D, max_direct_size):
+    laplacian, eigenvalues = get_geometry(shape, dirichlet, is_2D)
+    eigen = D * eigenvalues + np.mean(decay)
+
+    if np.ptp(decay) == 0:
+        return lambda rhs: _spectral_solve(rhs, eigen, dirichlet, is_2D)
+
+    operator = make_steady_state_operator(shape, D, decay, dirichlet, is_2D, laplacian=laplacian)
+    if operator.shape[0] <= max_direct_size:
+        return factorized(operator)
+
+    # a direct factorization of very large lattices is too slow and memory hungry
+    n_total = operator.shape[0]
+    preconditioner = LinearOperator((n_total, n_total), dtype=float,
+                                    matvec=lambda rhs: _spectral_solve(rhs, eigen, dirichlet, is_2D))
+
+    def solver(rhs):
+        solution, info = cg(operator, rhs, M=preconditioner, maxiter=1000)
+        if info != 0:
+            warnings.warn(f"WARNING: steady state iterative solver did not converge (info={info})")
+        return solution
+
+    return solver
+
+
+def solve_steady_state(shape, D, gamma, dirichlet=False, dirichlet_value=0, source=0, uptake=0, is_2D=False,
+                       max_direct_size=250_000):
+    """
+    Solves D*lap(c) - (gamma + uptake)*c + source = 0 on the CC3D lattice.
+
+    All parameters must already be in CC3D units (pixels and MCS). The Laplacian of the lattice and its eigenvalues are
+    reused by any other field of the process sharing the geometry, whatever their coefficients, and the factorization
+    by any field sharing the geometry and the coefficients (see _get_solver).
+
+    Parameters
+    ----------
+    shape : tuple
+        Lattice dimensions (x, y, z)
+    D : float
+        Diffusion constant in pixel^2/MCS
+    gamma : float
+        Decay constant in 1/MCS
+    dirichlet : bool, optional
+        Whether the field has constant value boundaries. Default False (zero flux)
+    dirichlet_value : float, optional
+        Value at the boundary if `dirichlet`. Default 0
+    source : float or numpy.ndarray, optional
+        Amount secreted per pixel per MCS, either global or with the lattice shape. Default 0
+    uptake : float or numpy.ndarray, optional
+        Uptake rate (1/MCS) per pixel, either global or with the lattice shape. Default 0
+    is_2D : bool, optional
+        Whether the simulation is 2D. Default False
+    max_direct_size : int, optional
+        Largest number of pixels for which a direct sparse factorization is used, above it the solver falls back on
+        conjugate gradient. Default 250000
+
+    Returns
+    -------
+    numpy.ndarray or None
+        Steady state field with the lattice shape, None if the problem has no unique steady state (no decay, no uptake
+        and zero flux boundaries)
+    """
+    if not scipy_imp:
+        warnings.warn("WARNING: scipy is needed to pre-compute steady state fields. Skipping.")
+        return None
+
+    shape = tuple(int(s) for s in shape)
+
+    decay = gamma + np.asarray(uptake, dtype=float)
+    decay = decay.ravel() if decay.ndim else float(decay)
+
+    if not dirichlet and not np.any(decay > 0):
+        return None
+
+    rhs = np.broadcast_to(np.asarray(source, dtype=float), shape).astype(float)
+    if dirichlet:
+        rhs += _boundary_rhs(shape, D, dirichlet_value, is_2D)
+
+    solver = _get_solver(shape, D, decay, dirichlet, is_2D, max_direct_size)
+    solution = solver(rhs.ravel())
+    return np.clip(solution, 0, None).reshape(shape)
+
+
+def get_initial_sources(field_name, secretion_dict, cell_types, shape, box):
+    """
+    Builds the secretion and uptake terms a field sees from the initial cell configuration.
+
+    The default initial configuration (UniformInitializer) fills `box` with cells of all non-wall types, so each pixel
+    of the box gets the average over the types of what they secrete and uptake. PhysiCell's target secretion,
+    secretion_rate*(target - c), is linear in c and is split into a source (secretion_rate*target) and an uptake
+    (secretion_rate).
+
+    Parameters
+    ----------
+    field_name : str
+        Name of the diffusing field
+    secretion_dict : dict
+        Converted secretion data (see conversions.secretion.convert_secretion_uptake_data)
+    cell_types : list
+        List of cell types
+    shape : tuple
+        Lattice dimensions (x, y, z)
+    box : tuple
+        ((xmin, ymin, zmin), (xmax, ymax, zmax)) of the region filled with cells
+
+    Returns
+    -------
+    source, uptake : numpy.ndarray or float
+        Amount secreted per pixel per MCS, and uptake rate per pixel (1/MCS)
+    """
+    types = [t for t in cell_types if t.upper() != "WALL"]
+    if not types or not secretion_dict:
+        return 0, 0
+
+    source_rate = 0
+    uptake_rate = 0
+    for ctype in types:
+        if ctype not in secretion_dict.keys() or field_name not in secretion_dict[ctype].keys():
+            continue
+        data = secretion_dict[ctype][field_name]
+        source_rate += data['net_export_MCS'] + data['secretion_rate_MCS'] * data['secretion_target']
+        uptake_rate += data['uptake_rate_MCS'] + data['secretion_rate_MCS']
+
+    if not source_rate and not uptake_rate:
+        return 0, 0
+
+    (x0, y0, z0), (x1, y1, z1) = box
+    region = (slice(max(x0, 0), min(x1, shape[0])), slice(max(y0, 0), min(y1, shape[1])),
+              slice(max(z0, 0), min(z1, shape[2])))
+    source = np.zeros(shape)
+    uptake = np.zeros(shape)
+    source[region] = source_rate / len(types)
+    uptake[region] = uptake_rate / len(types)
+    return source, uptake
+
+
+def make_steady_state_initial_conditions(diffusing_elements, ccdims, sim_dir, secretion_dict, cell_types, box):
+    """
+    Pre-computes the steady state of each DiffusionSolverFE field and writes it as a CC3D concentration file.
+
+    For every field that is not already solved by a steady state solver (and that doesn't have an initial condition
+    file converted from PhysiCell) the steady state is computed from its
+    converted D, gamma, boundary conditions and the secretion/uptake of the initial cell configuration. The file is
+    written to `sim_dir` and its path is stored in the field's "concentration_file" key, which make_diffusion_FE uses
+    to emit `<ConcentrationFileName>` instead of `<InitialConcentrationExpression>`.
+
+    Parameters
+    ----------
+    diffusing_elements : dict
+        Dictionary of diffusing elements (see cc3d_xml_gen.get_physicell_data.get_microenvironment)
+    ccdims : tuple
+        The converted CC3D space parameters
+    sim_dir : str or pathlib.Path
+        The converted simulation's Simulation folder
+    secretion_dict : dict
+        Converted secretion data (see conversions.secretion.convert_secretion_uptake_data)
+    cell_types : list
+        List of cell types
+    box : tuple
+        ((xmin, ymin, zmin), (xmax, ymax, zmax)) of the region initially filled with cells
+
+    Returns
+    -------
+    dict
+        The diffusing elements dictionary with the "concentration_file" keys set
+    """
+    shape = (ccdims[0], ccdims[1], ccdims[2])
+    is_2D = ccdims[6]
+    for key, item in diffusing_elements.items():
+        if item["use_steady_state"]:
+            continue
+        if "concentration_file" in item.keys():
+            print(f"{key} already has an initial condition file, not pre-computing its steady state")
+            continue
+        name = key.replace(" ", "_")
+        source, uptake = get_initial_sources(name, secretion_dict, cell_types, shape, box)
+        dirichlet = item['dirichlet'].upper() != "FALSE"
+        field = solve_steady_state(shape, item["D"], item["gamma"], dirichlet=dirichlet,
+                                   dirichlet_value=item["dirichlet_value"], source=source, uptake=uptake,
+                                   is_2D=is_2D)
+        if field is None:
+            message = f"WARNING: {key} has no decay, uptake or constant boundaries, it doesn't have a unique steady " \
+                      f"state. Keeping its initial condition expression"
+            warnings.warn(message)
+            continue
+        file_name = f"{name}_steady_state.txt"
+        print(f"Writing steady state of {key} to {file_name} (min={field.min():.4g}, max={field.max():.4g})")
+        write_concentration_file(join(sim_dir, file_name), field)
+        item["concentration_file"] = f"Simulation/{file_name}"
+    return diffusing_elements
@@ -8,6 +8,7 @@ Created on Mon Aug 15 09:45:52 2022
 # import string
 # import copy
 import os
+import warnings
 import xmltodict as x2d
 import steppable_gen
 
@@ -17,11 +18,20 @@ import argparse
 
 from cc3d_xml_gen.gen import make_potts, make_metadata, make_cell_type_plugin, make_cc3d_file, \
     make_contact_plugin, make_diffusion_plug, reconvert_spatial_parameters_with_minimum_cell_volume, make_secretion, \
-    reconvert_cell_volume_constraints, decrease_domain, reconvert_time_parameter, make_volume, make_chemotaxis
+    reconvert_cell_volume_constraints, decrease_domain, reconvert_time_parameter, make_volume, make_chemotaxis, \
+    crop_domain, get_diffusion_length, choose_neighbor_orders, coarsen_spatial_parameters, slice_to_2D, estimate_cost, \
+    substep_diffusion, choose_diffusion_solvers, choose_number_of_processors, get_output_frequencies, \
+    make_pif_dumper, get_chemotatic_fields, split_coarse_fields, get_largest_cell_radius
 
 from cc3d_xml_gen.get_physicell_data import get_cell_constraints, get_secretion_uptake, get_microenvironment, \
-    get_dims, get_time, get_chemotaxis
+    get_dims, get_time, get_chemotaxis, get_initial_substrate_file, get_microenvironment_mesh, resolve_physicell_path, \
+    get_cell_positions_file, get_cell_type_ids, get_dynamic_chemotaxis_types, get_parallel, \
+    get_clock_frequencies, get_save_intervals
 from conversions.secretion import convert_secretion_uptake_data
+from conversions.steady_state import make_steady_state_initial_conditions
+from conversions.initial_fields import convert_initial_substrate_file
+from conversions.diffusion_validation import validate_diffusion
+from conversions.cell_positions import read_cell_positions, positions_to_lattice, make_piff, make_pif_initializer
 
 try:
     from autopep8 import fix_code
@@ -78,6 +88,31 @@ _time_convs = {"millisecond": 1e-3 / 60,
                "min": 1}
 
 
+def default_initializer_box(xmax, ymax, zmax):
+    """
+    Returns the region filled with cells by the default UniformInitializer steppable.
+
+    Parameters
+    ----------
+    xmax : int
+        Maximum x dimension of the simulation.
+    ymax : int
+        Maximum y dimension of the simulation.
+    zmax : int
+        Maximum z dimension of the simulation.
+
+    Returns
+    -------
+    tuple
+        ((xmin, ymin, zmin), (xmax, ymax, zmax)) of the region
+    """
+    if (zmax != 1 and zmax != 0) and (xmax > 10 and ymax > 10 and zmax > 10):
+        return (10, 10, 10), (xmax - 10, ymax - 10, zmax - 10)
+    elif zmax != 1 and zmax != 0:
+        return (1, 1, 1), (xmax - 1, ymax - 1, zmax - 1)
+    return (10, 10, 0), (xmax - 10, ymax - 10, 1)
+
+
 def default_initial_cell_config(celltypes, xmax, ymax, zmax):
     """
     Returns the default UniformInitializer steppable.
@@ -114,15 +149,9 @@ def default_initial_cell_config(celltypes, xmax, ymax, zmax):
 \t<!-- you are responsible for analysing the initialization of the original -->
 \t<!-- model and reimplement it accordingly -->
 \t<Region>\n'''
-    if (zmax != 1 and zmax != 0) and (xmax > 10 and ymax > 10 and zmax > 10):
-        box_min = f'\t\t<BoxMin x="{10}" y="{10}" z="{10}"/>\n'
-        box_max = f'\t\t<BoxMax x="{xmax - 10}" y="{ymax - 10}" z="{zmax - 10}"/>\n'
-    elif zmax != 1 and zmax != 0:
-        box_min = f'\t\t<BoxMin x="{1}" y="{1}" z="{1}"/>\n'
-        box_max = f'\t\t<BoxMax x="{xmax - 1}" y="{ymax - 1}" z="{zmax - 1}"/>\n'
-    else:
-        box_min = f'\t\t<BoxMin x="{10}" y="{10}" z="{0}"/>\n'
-        box_max = f'\t\t<BoxMax x="{xmax - 10}" y="{ymax - 10}" z="{1}"/>\n'
+    (x0, y0, z0), (x1, y1, z1) = default_initializer_box(xmax, ymax, zmax)
+    box_min = f'\t\t<BoxMin x="{x0}" y="{y0}" z="{z0}"/>\n'
+    box_max = f'\t\t<BoxMax x="{x1}" y="{y1}" z="{z1}"/>\n'
 
     gap = "\t\t<Gap>0</Gap>\n\t\t<Width>7</Width>\n"
 
@@ -142,7 +171,12 @@ def default_initial_cell_config(celltypes, xmax, ymax, zmax):
     return steppable_string
 
 
-def main(path_to_xml, out_directory=None, minimum_volume=8, max_volume=150 ** 3, name=None):
+def main(path_to_xml, out_directory=None, minimum_volume=8, max_volume=150 ** 3, name=None, steady_initial=False,
+         crop=False, crop_margin=None, anisotropy_tolerance=0.15, check_diffusion=False, coarsen=1, slice_2d=False,
+         dynamic_chemotaxis=None, volume_mode="auto", rescale_time=False, solver_selection="cost",
+         steady_frequency=1, n_processors=None, record_population=False, checkpoint_frequency=None,
+         profile=False, profile_every=None, seed=None, coarse_fields=None, coarse_workers=1,
+         truncate_domain=True):
     """
     Converts a PhysiCell simulation XML into a CompuCell3D simulation folder
 
@@ -158,7 +192,47 @@ def main(path_to_xml, out_directory=None, minimum_volume=8, max_volume=150 ** 3,
     :param path_to_xml: string for the path to the PhysiCell XML simulation file
     :param out_directory: string path to the output folder
     :param name:
-    :return: None
+    :param steady_initial: bool, pre-compute the steady state of the diffusing fields and use it as their initial
+        condition
+    :param crop: bool, crop the domain to the initial cell positions (PhysiCell's cells.csv) plus a margin, and place
+        the cells with a PIFF
+    :param crop_margin: float, margin (PhysiCell space units) kept around the cells when cropping. Defaults to the
+        largest diffusion length of the fields
+    :param anisotropy_tolerance: float, largest acceptable lattice anisotropy of the contact energy, used to choose the
+        Potts and Contact neighbor orders
+    :param check_diffusion: bool, run the converted diffusing fields with a reference solver and compare them with the
+        analytic PhysiCell solution
+    :param coarsen: float, make the pixels this many times larger than the full resolution conversion (coarse variant)
+    :param slice_2d: bool, convert a 3D model into a 2D slice through the middle of its domain
+    :param dynamic_chemotaxis: list of cell types whose chemotaxis changes during the simulation, set per cell in
+        Python instead of with <ChemotaxisByType>. Types whose chemotaxis is disabled in PhysiCell (custom code turns it
+        on) are always included
+    :param volume_mode: str, "type" to set the volume constraints per type in the Volume plugin, "cell" to set them per
+        cell in Python (needed for phenotype-driven volume changes), "auto" uses "type" unless a cell type has
+        phenotypes
+    :param rescale_time: bool, shorten the MCS of the whole simulation when a field diffuses too fast (legacy
+        behavior) instead of sub-stepping the fast fields only
+    :param solver_selection: str, "cost" chooses the diffusion solver of each field from its relaxation time and cost,
+        "threshold" uses the steady state solver for fields with D above 1000 pixel^2/MCS (legacy behavior)
+    :param steady_frequency: int, largest number of MCS between two calls of a steady state solver
+    :param n_processors: int, number of processors CC3D should use, defaults to PhysiCell's omp_num_threads. It is
+        capped by the cores of the machine and the size of the lattice
+    :param record_population: bool, generate a steppable recording the number of cells of each type and phenotype
+        phase every MCS
+    :param checkpoint_frequency: int, generate a steppable saving a restartable checkpoint every checkpoint_frequency
+        MCS (None disables it)
+    :param profile: bool, wrap the start, step and finish of every steppable with timers and cell counters, summarized
+        at the end of the simulation
+    :param profile_every: int, with profile, also run every profile_every-th step under cProfile
+    :param seed: int, seed of the simulation's random streams (the PC2CC3D_SEED environment variable overrides it at
+        run time) and of CC3D's pixel copies (<RandomSeed>). Defaults to PhysiCell's random_seed user parameter, or if
+        there is none a new seed every run
+    :param coarse_fields: list of fields to solve in Python on PhysiCell's microenvironment mesh instead of the CC3D
+        lattice, an empty list selects every field (None disables it). Chemotactic fields stay on the lattice
+    :param coarse_workers: int, number of processes solving the coarse grid fields
+    :param truncate_domain: bool, shrink the sides of a lattice above max_volume pixels (which also shrinks the
+        physical domain). The coarse variants of convert_variants keep the whole domain
+    :return: dict, scale of the conversion (lattice, time step, number of steps and cost estimate)
     """
 
     if minimum_volume is None:
@@ -222,9 +296,6 @@ def main(path_to_xml, out_directory=None, minimum_volume=8, max_volume=150 ** 3,
 
     pcdict = x2d.parse(xml_raw)['PhysiCell_settings']
 
-    print("Generating <Metadata/>")
-    metadata_str, n_threads = make_metadata(pcdict)
-
     print("Extracting space and time data")
     pcdims, ccdims = get_dims(pcdict)
     pctime, cctime = get_time(pcdict)
@@ -243,15 +314,115 @@ def main(path_to_xml, out_directory=None, minimum_volume=8, max_volume=150 ** 3,
     else:
         constraints = reconvert_cell_volume_constraints(constraints, 1, minimum_volume)
 
-    ccdims, was_above = decrease_domain(ccdims, max_volume=max_volume)
+    if coarsen != 1:
+        print(f"Coarsening the pixels {coarsen} times")
+        ccdims, constraints, minimum_volume = coarsen_spatial_parameters(ccdims, constraints, coarsen, minimum_volume)
+
+    sliced = slice_2d and not ccdims[6]
+    if sliced:
+        print("Slicing the 3D domain into a 2D simulation")
+        ccdims, constraints = slice_to_2D(ccdims, constraints)
 
     print("parsing micro environment")
     d_elements = get_microenvironment(pcdict, ccdims[4], pcdims[3], cctime[2], pctime[1])
 
-    d_elements, cctime = reconvert_time_parameter(d_elements, cctime)
+    cc_origin = None
+    cell_positions = None
+    cropped = False
+    if crop:
+        positions_file = get_cell_positions_file(pcdict)
+        positions_path = resolve_physicell_path(positions_file, xml_dir) if positions_file is not None else None
+        if positions_path is None:
+            warnings.warn("WARNING: couldn't find an enabled PhysiCell cell positions file, the domain will not be "
+                          "cropped")
+        else:
+            print(f"Reading initial cell positions from {positions_path}")
+            cell_positions, position_types = read_cell_positions(positions_path, get_cell_type_ids(pcdict))
+            if not len(cell_positions):
+                warnings.warn(f"WARNING: no cells found in {positions_path}, the domain will not be cropped")
+                cell_positions = None
+            else:
+                margin = crop_margin if crop_margin is not None else get_diffusion_length(d_elements)
+                ccdims, cc_origin = crop_domain(ccdims, pcdims, cell_positions, margin,
+                                                cell_radius=get_largest_cell_radius(constraints, ccdims[4], ccdims[6]))
+                cropped = True
+
+    if sliced:
+        # the slice goes through the middle of the PhysiCell domain
+        z_min, z_max = pcdims[2]
+        z_min = 0 if z_min is None else z_min
+        z_mid = z_min if z_max is None else (z_min + z_max) / 2
+        if cc_origin is None:
+            cc_origin = (0 if pcdims[0][0] is None else pcdims[0][0], 0 if pcdims[1][0] is None else pcdims[1][0])
+        cc_origin = (cc_origin[0], cc_origin[1], z_mid - 0.5 / ccdims[4])
+
+    truncated = False
+    if not cropped and truncate_domain:
+        ccdims, truncated = decrease_domain(ccdims, max_volume=max_volume)
+    elif cropped and ccdims[0] * ccdims[1] * ccdims[2] > max_volume:
+        # shrinking the sides again would clip the cells the crop was sized for
+        warnings.warn(f"WARNING: the cropped domain {tuple(ccdims[0:3])} is larger than {max_volume} pixels, it is not "
+                      f"truncated. Reduce --cropmargin or use coarser pixels (--variants) to shrink it")
+    elif ccdims[0] * ccdims[1] * ccdims[2] > max_volume:
+        print(f"The lattice {tuple(ccdims[0:3])} is larger than {max_volume} pixels, it keeps the whole domain")
+
+    if rescale_time:
+        d_elements, cctime = reconvert_time_parameter(d_elements, cctime)
+
+    print("Parsing secretion data")
+    secretion_uptake_dict = get_secretion_uptake(pcdict)
+
+    conv_sec = convert_secretion_uptake_data(secretion_uptake_dict, cctime[2], pctime[1])
+
+    print("Parsing chemotaxis data")
+    taxis_dict = get_chemotaxis(pcdict)
+
+    coarse_elements = {}
+    if coarse_fields is not None:
+        d_elements, coarse_elements = split_coarse_fields(d_elements, coarse_fields, get_chemotatic_fields(taxis_dict))
+        if coarse_elements:
+            coarse_spacing = get_microenvironment_mesh(pcdict)[1][0] * ccdims[4]
+            print(f"{list(coarse_elements.keys())} are solved in Python on a grid of {coarse_spacing:.4g} pixel voxels "
+                  f"({coarse_spacing ** (2 if ccdims[6] else 3):.4g} times fewer values than the lattice), the CC3D "
+                  f"solvers skip them")
+
+    if solver_selection == "cost":
+        print("Choosing the diffusion solvers")
+        d_elements, solver_report = choose_diffusion_solvers(d_elements, ccdims, conv_sec,
+                                                             max_steady_frequency=steady_frequency)
+        print(solver_report)
+
+    print("Analysing the stability of the diffusing fields")
+    d_elements = substep_diffusion(d_elements, ccdims[6])
+
+    if check_diffusion:
+        print("Validating the converted diffusion parameters")
+        validate_diffusion(d_elements, ccdims, cctime)
+
+    substrate_file_type, substrate_file = get_initial_substrate_file(pcdict)
+    if substrate_file is not None:
+        substrate_path = resolve_physicell_path(substrate_file, xml_dir)
+        if substrate_path is None:
+            warnings.warn(f"WARNING: could not find the diffusing fields initial condition file {substrate_file}")
+        else:
+            print(f"Converting diffusing fields initial condition file {substrate_path}")
+            d_elements = convert_initial_substrate_file(substrate_path, substrate_file_type, d_elements, ccdims,
+                                                        sim_dir, get_microenvironment_mesh(pcdict),
+                                                        cc_origin=cc_origin)
+
+    print("Choosing neighbor orders")
+    potts_order, contact_order, order_report = choose_neighbor_orders(constraints, ccdims[6],
+                                                                      anisotropy_tolerance=anisotropy_tolerance)
+    print(order_report)
+
+    if seed is None and isinstance(pcdict["user_parameters"], dict) and \
+            "random_seed" in pcdict["user_parameters"].keys():
+        # PhysiCell's own seed parameter
+        seed = int(pcdict["user_parameters"]["random_seed"].get("#text", 0))
+    print(f"Random streams seeded with {seed}" if seed is not None else "Random streams seeded at run time")
 
     print("Generating <Potts/>")
-    potts_str = make_potts(pcdims, ccdims, pctime, cctime)
+    potts_str = make_potts(pcdims, ccdims, pctime, cctime, neighbor_order=potts_order, seed=seed)
 
     with open(os.path.join(sim_dir, "extra_definitions.py"), 'w+') as f:
 
@@ -259,43 +430,133 @@ def main(path_to_xml, out_directory=None, minimum_volume=8, max_volume=150 ** 3,
                          options={"aggressive": 1}))
 
     print("Generating <Plugin Contact/>")
-    contact_plug = make_contact_plugin(cell_types)
+    contact_plug = make_contact_plugin(cell_types, neighbor_order=contact_order, order_report=order_report)
 
-    intializer_step = default_initial_cell_config(cell_types, ccdims[0], ccdims[1], ccdims[2])
+    if cell_positions is None:
+        intializer_step = default_initial_cell_config(cell_types, ccdims[0], ccdims[1], ccdims[2])
+        cells_box = default_initializer_box(ccdims[0], ccdims[1], ccdims[2])
+    else:
+        print(f"Creating {out_directory}/Simulation/initial_cells.piff")
+        if cc_origin is None:
+            cc_origin = tuple(0 if d[0] is None else d[0] for d in pcdims[:3])
+        lattice_positions = positions_to_lattice(cell_positions, cc_origin, ccdims[4])
+        with open(os.path.join(sim_dir, "initial_cells.piff"), "w+") as f:
+            f.write(make_piff(lattice_positions, position_types, constraints, ccdims))
+        intializer_step = make_pif_initializer("initial_cells.piff")
+        cells_box = (tuple(lattice_positions.min(axis=0)), tuple(lattice_positions.max(axis=0) + 1))
+
+    if steady_initial:
+        print("Pre-computing steady state initial conditions")
+        d_elements = make_steady_state_initial_conditions(d_elements, ccdims, sim_dir, conv_sec, cell_types,
+                                                          cells_box)
 
     print("Generating diffusion plugin")
     diffusion_string = make_diffusion_plug(d_elements, cell_types, ccdims[6])
 
-    print("Parsing secretion data")
-    secretion_uptake_dict = get_secretion_uptake(pcdict)
+    dynamic_taxis_types = get_dynamic_chemotaxis_types(pcdict)
+    if dynamic_chemotaxis is not None:
+        dynamic_taxis_types += [t.replace(" ", "_") for t in dynamic_chemotaxis]
+    dynamic_taxis_dict = {ctype: data for ctype, data in taxis_dict.items() if ctype in dynamic_taxis_types}
+    if dynamic_taxis_dict:
+        print(f"Chemotaxis of {list(dynamic_taxis_dict.keys())} is set per cell in Python")
 
-    conv_sec = convert_secretion_uptake_data(secretion_uptake_dict, cctime[2], pctime[1])
+    chemotaxis_plug = make_chemotaxis(taxis_dict, dynamic_types=dynamic_taxis_types)
 
-    print("Parsing chemotaxis data")
-    taxis_dict = get_chemotaxis(pcdict)
+    dynamic_volume_types = [ctype for ctype, const in constraints.items() if const.get("phenotypes")]
+    if volume_mode == "auto":
+        type_volumes = not dynamic_volume_types
+    else:
+        type_volumes = volume_mode == "type"
+    if type_volumes:
+        print("Volume constraints are set per cell type in the Volume plugin")
+        if dynamic_volume_types:
+            warnings.warn(f"WARNING: {dynamic_volume_types} have phenotypes, their target volume will not follow the "
+                          f"phenotype with per type volume constraints")
+    else:
+        print("Volume constraints are set per cell in Python")
 
-    chemotaxis_plug = make_chemotaxis(taxis_dict)
+    clocks = get_clock_frequencies(pcdict, cctime)
+    print(f"Phenotypes are updated every {clocks['phenotype']} MCS, secretion every {clocks['diffusion']} MCS")
 
     print("Generating constraint steppable")
     constraint_step = steppable_gen.generate_constraint_steppable(cell_types, [constraints,
-                                                                               conv_sec, taxis_dict], wall,
-                                                                  user_data=pcdict["user_parameters"])
+                                                                               conv_sec, dynamic_taxis_dict], wall,
+                                                                  user_data=pcdict["user_parameters"],
+                                                                  type_volumes=type_volumes,
+                                                                  phenotype_frequency=clocks['phenotype'],
+                                                                  seed=seed)
 
     print("Generating secretion steppable")
-    secretion_step = steppable_gen.generate_secretion_uptake_step(cell_types, secretion_uptake_dict)
+    secretion_step = steppable_gen.generate_secretion_uptake_step(cell_types, secretion_uptake_dict,
+                                                                  secretion_dt=clocks['diffusion'],
+                                                                  coarse_fields=[key.replace(" ", "_") for key in
+                                                                                 coarse_elements.keys()])
 
     secretion_plug = make_secretion(secretion_uptake_dict)
 
     print("Generating phenotype steppable")
     pheno_step = steppable_gen.generate_phenotype_steppable(cell_types, [constraints,
-                                                                         conv_sec])
+                                                                         conv_sec], type_volumes=type_volumes,
+                                                        frequency=clocks['phenotype'],
+                                                        record_population=record_population)
+
+    population_step = ""
+    if record_population:
+        print("Generating population recorder steppable")
+        population_step = steppable_gen.generate_population_steppable(cell_types, constraints)
+
+    checkpoint_step = ""
+    if checkpoint_frequency is not None:
+        print(f"Generating checkpoint steppable, checkpoints every {checkpoint_frequency} MCS")
+        checkpoint_step = steppable_gen.generate_checkpoint_steppable(list(d_elements.keys()),
+                                                                      get_chemotatic_fields(dynamic_taxis_dict),
+                                                                      checkpoint_frequency, cctime[0])
+
+    print("Scheduling the output")
+    output_frequencies = get_output_frequencies(get_save_intervals(pcdict, pctime[1]), cctime)
+    full_data_frequency = output_frequencies["full_data"]
+    svg_frequency = output_frequencies["SVG"]
+    print(f"Lattice and field dumps every {full_data_frequency} MCS, screenshots every {svg_frequency} MCS")
+    output_step = steppable_gen.generate_output_steppable(list(d_elements.keys()), full_data_frequency)
+    output_xml = make_pif_dumper(full_data_frequency, name) if full_data_frequency is not None else ""
+    run_note = "Output schedule converted from PhysiCell's <save>. Run headless with:\n" \
+               f"runScript -i {name}.cc3d -o <output folder> -f {full_data_frequency or 0} " \
+               f"--screenshot-output-frequency {svg_frequency or 0}\n" \
+               "(-f sets the VTK lattice output frequency, 0 disables it)"
+    if checkpoint_step:
+        run_note += "\nRun as restartable segments of N MCS with:\n" \
+                    f"python pc2cc3d_runtime.py N -- runScript -i {name}.cc3d -o <output folder>"
+
+    coarse_step = ""
+    if coarse_elements:
+        print("Generating coarse diffusion steppable")
+        coarse_step = steppable_gen.generate_coarse_diffusion_steppable(coarse_elements, coarse_spacing,
+                                                                        frequency=clocks['diffusion'],
+                                                                        workers=coarse_workers,
+                                                                        output_frequency=full_data_frequency)
+
+    print("Generating <Metadata/>")
+    requested_processors = get_parallel(pcdict) if n_processors is None else n_processors
+    n_processors, non_parallel, processor_notes = choose_number_of_processors(requested_processors, ccdims,
+                                                                              potts_order, contact_order)
+    for note in processor_notes:
+        print(note)
+    per_cell_steps = steppable_gen.get_per_cell_steppables(constraint_step + secretion_step + pheno_step)
+    if n_processors > 1 and per_cell_steps:
+        message = f"WARNING: {per_cell_steps} loop over the cells in Python, which runs on one core. The " \
+                  f"{n_processors} processors only speed up Potts and the solvers"
+        warnings.warn(message)
+        processor_notes.append(f"{per_cell_steps} run serially in Python, call them less often to gain from "
+                               f"more processors")
+    metadata_str, _ = make_metadata(pcdict, out=full_data_frequency or cctime[0], n_processors=n_processors,
+                                    non_parallel=non_parallel, notes=processor_notes)
 
     print("Generating CC3DML")
     cc3dml = "<CompuCell3D>\n"
     cc3dml += "<!--\n" + read_before_run + "-->\n"
-    cc3dml += metadata_str + potts_str + ct_str + make_volume() + contact_plug + diffusion_string + secretion_plug + \
-              '\n' + chemotaxis_plug + '\n' + \
-              intializer_step + "\n\n" + "\n</CompuCell3D>\n"
+    cc3dml += metadata_str + potts_str + ct_str + make_volume(constraints if type_volumes else None) + contact_plug + \
+              diffusion_string + secretion_plug + '\n' + chemotaxis_plug + '\n' + \
+              intializer_step + "\n" + output_xml + "\n" + "\n</CompuCell3D>\n"
 
     print(f"Creating {out_directory}/Simulation/{xml_name}")
     with open(os.path.join(out_directory, f"Simulation/{xml_name}"), "w+") as f:
@@ -303,7 +564,11 @@ def main(path_to_xml, out_directory=None, minimum_volume=8, max_volume=150 ** 3,
 
     print("Merging steppables")
 
-    all_step = '"""\n' + read_before_run + '"""\n' + constraint_step + "\n" + secretion_step + "\n" + pheno_step
+    all_step = '"""\n' + read_before_run + '"""\n' + constraint_step + "\n" + secretion_step + "\n" + \
+               coarse_step + "\n" + pheno_step + "\n" + output_step + "\n" + population_step + "\n" + checkpoint_step
+    if profile:
+        print("Adding profiling hooks to the steppables")
+        all_step = steppable_gen.add_profiling_hooks(all_step, profile_every=profile_every)
 
     step_names = steppable_gen.get_steppables_names(all_step)
 
@@ -312,11 +577,82 @@ def main(path_to_xml, out_directory=None, minimum_volume=8, max_volume=150 ** 3,
     steppable_gen.generate_steppable_file(sim_dir, f"{steppables_py_name}", fix_code(all_step,
                                                                                      options={"aggressive": 1}))
 
+    steppable_gen.copy_runtime(sim_dir)
+
     print("Generating steppable registration file")
-    steppable_gen.generate_main_python(sim_dir, f"{main_py_name}", f"{steppables_py_name}", step_names, read_before_run)
+    steppable_gen.generate_main_python(sim_dir, f"{main_py_name}", f"{steppables_py_name}", step_names, read_before_run,
+                                       run_note=run_note)
 
     print("______________\nDONE!!")
-    return
+    potts_cost, diffusion_cost = estimate_cost(ccdims, cctime, d_elements, contact_order)
+    return {"directory": out_directory, "coarsen": coarsen, "sliced": sliced, "dims": tuple(ccdims[0:3]),
+            "truncated": truncated,
+            "pixel_to_space": ccdims[4], "space_unit": pcdims[3], "time_per_mcs": 1 / cctime[2],
+            "time_unit": pctime[1], "steps": cctime[0], "potts_cost": potts_cost, "diffusion_cost": diffusion_cost}
+
+
+def make_scale_report(scales):
+    """
+    Builds a table comparing the lattice, time step and cost estimate of the variants of a conversion
+
+    :param scales: list of dicts returned by main, the first one being the full resolution conversion
+    :return: str, the report
+    """
+    full_cost = scales[0]["potts_cost"] + scales[0]["diffusion_cost"]
+    lines = ["Variant | Lattice | Domain | Pixel size | 1 MCS | Steps | Potts cost | Diffusion cost | Relative cost"]
+    for scale in scales:
+        variant = "full" if scale["coarsen"] == 1 else f"coarse x{scale['coarsen']:g}"
+        if scale["sliced"]:
+            variant += " (2D slice)"
+        cost = scale["potts_cost"] + scale["diffusion_cost"]
+        domain = "x".join(f"{side / scale['pixel_to_space']:.4g}" for side in scale['dims'])
+        lines.append(f"{variant} | {scale['dims'][0]}x{scale['dims'][1]}x{scale['dims'][2]} | "
+                     f"{domain} {scale['space_unit']} | "
+                     f"{1 / scale['pixel_to_space']:.4g} {scale['space_unit']} | "
+                     f"{scale['time_per_mcs']:.4g} {scale['time_unit']} | {scale['steps']} | "
+                     f"{scale['potts_cost']:.3g} | {scale['diffusion_cost']:.3g} | "
+                     f"{cost / full_cost if full_cost else 1:.3g} ({scale['directory']})")
+    return "\n".join(lines)
+
+
+def convert_variants(path_to_xml, factors, out_directory=None, slice_3d=True, **kwargs):
+    """
+    Converts a PhysiCell simulation at full resolution and as coarse preview variants
+
+    The full resolution conversion is placed in `out_directory`, identical to a conversion by main with the same
+    arguments, and each coarse variant next to it, in `<out_directory>_coarse<factor>`. The coarse variants are scaled
+    consistently from the full resolution conversion: pixels `factor` times larger, cell volumes and minimum cell
+    volume scaled accordingly, time step re-derived from each variant's diffusion constants (reconvert_time_parameter)
+    and (with `slice_3d`) a 2D slice of 3D models. They are not truncated to the maximum lattice volume, they cover the
+    whole PhysiCell domain. The scale report, printed and written next to them, lists the domain of every variant.
+
+    :param path_to_xml: string for the path to the PhysiCell XML simulation file
+    :param factors: list of coarsening factors, one variant per factor
+    :param out_directory: string path to the output folder of the full resolution conversion
+    :param slice_3d: bool, make the coarse variants of 3D models 2D slices
+    :param kwargs: passed to main
+    :return: list of the scale of each variant (see main)
+    """
+    path_to_xml = Path(path_to_xml)
+    if out_directory is None:
+        out_directory = path_to_xml.parent.joinpath("CC3D_converted_sim", path_to_xml.name.split(".")[0])
+    out_directory = Path(out_directory)
+
+    scales = [main(path_to_xml, out_directory=out_directory, **kwargs)]
+    coarse_kwargs = dict(kwargs, rescale_time=True, truncate_domain=False)
+    for factor in factors:
+        variant_directory = out_directory.parent.joinpath(f"{out_directory.name}_coarse{factor:g}")
+        scales.append(main(path_to_xml, out_directory=variant_directory, coarsen=factor, slice_2d=slice_3d,
+                           **coarse_kwargs))
+    if scales[0]["truncated"]:
+        warnings.warn("WARNING: the full resolution conversion was truncated to the maximum lattice volume, the coarse "
+                      "variants cover the whole domain. Compare their costs with care")
+
+    report = make_scale_report(scales)
+    print("Scale report:\n" + report)
+    with open(out_directory.parent.joinpath(f"{out_directory.name}_scale_report.txt"), "w+") as f:
+        f.write(report + "\n")
+    return scales
 
 
 parser = argparse.ArgumentParser(description="Converts a Physicell XML file into CompuCell3D .cc3d, .xml, main.py, and"
@@ -328,6 +664,88 @@ parser.add_argument("-v", "--simulationvolume", type=int, help="(optional) maxim
                     default=None)
 parser.add_argument("-o", "--output", help="(optional) output path for the converted files",
                     default=None)
+parser.add_argument("-s", "--steadystate", action="store_true",
+                    help="(optional) pre-compute the steady state of each diffusing field (sparse solve on the final "
+                         "lattice) and use it as the field's initial condition")
+parser.add_argument("--crop", action="store_true",
+                    help="(optional) crop the domain to the bounding box of the initial cells (from PhysiCell's cell "
+                         "positions csv) plus a margin, and place the cells with a PIFF")
+parser.add_argument("--cropmargin", type=float, default=None,
+                    help="(optional) margin, in PhysiCell space units, kept around the cells when cropping. Defaults "
+                         "to the largest diffusion length, sqrt(D/decay), of the diffusing fields")
+parser.add_argument("--anisotropy", type=float, default=0.15,
+                    help="(optional) largest acceptable relative lattice anisotropy of the contact energy, used to "
+                         "choose the Potts and Contact neighbor orders. Default 0.15")
+parser.add_argument("--checkdiffusion", action="store_true",
+                    help="(optional) run the converted diffusion and decay constants with a reference solver and "
+                         "report their error against the analytic PhysiCell solution, stability margin and throughput")
+parser.add_argument("--variants", type=float, nargs="+", default=None,
+                    help="(optional) also emit coarse preview variants next to the full resolution conversion, one per "
+                         "given factor (how many times larger the pixels are), with a scale report. The full "
+                         "resolution conversion is the same as without --variants, the coarse variants keep the "
+                         "whole domain and re-derive their time step")
+parser.add_argument("--keep3d", action="store_true",
+                    help="(optional) keep the coarse variants of 3D models 3D instead of slicing them to 2D")
+parser.add_argument("--dynamicchemotaxis", type=str, nargs="+", default=None,
+                    help="(optional) cell types whose chemotaxis changes during the simulation, their chemotaxis is "
+                         "set per cell in Python instead of with <ChemotaxisByType>")
+parser.add_argument("--volumemode", choices=["auto", "type", "cell"], default="auto",
+                    help="(optional) where the volume constraints are set: per type in the Volume plugin (type), per "
+                         "cell in Python (cell, needed for phenotype-driven volume changes), or type unless a cell "
+                         "type has phenotypes (auto, default)")
+parser.add_argument("--rescaletime", action="store_true",
+                    help="(optional) shorten the MCS of the whole simulation when a field diffuses too fast (legacy "
+                         "behavior), instead of solving only the fast fields several times per MCS")
+parser.add_argument("--solverselection", choices=["cost", "threshold"], default="cost",
+                    help="(optional) how the diffusion solver of each field is chosen: from its relaxation time and "
+                         "cost (cost, default), or steady state above D=1000 pixel^2/MCS (threshold, legacy behavior)")
+parser.add_argument("-p", "--processors", type=int, default=None,
+                    help="(optional) number of processors CC3D should use. Defaults to PhysiCell's omp_num_threads, "
+                         "capped by the available cores and the lattice size")
+parser.add_argument("--population", action="store_true",
+                    help="(optional) record the number of cells of each type and phenotype phase every MCS")
+parser.add_argument("--checkpoint", type=int, default=None,
+                    help="(optional) save a checkpoint the simulation can restart from every N MCS, to "
+                         "<output folder>/checkpoints. Runs only restart when PC2CC3D_RESTART is set (see run_segments "
+                         "in pc2cc3d_runtime.py)")
+parser.add_argument("--profile", action="store_true",
+                    help="(optional) time every steppable call and count the cells visited, the summary is printed "
+                         "and saved to the output folder at the end of the simulation")
+parser.add_argument("--profileevery", type=int, default=None,
+                    help="(optional) with --profile, also run every N-th step of each steppable under cProfile")
+parser.add_argument("--seed", type=int, default=None,
+                    help="(optional) seed of the simulation's random streams (placement, phenotype, motility, "
+                         "division) and of CC3D's pixel copies (<RandomSeed>). The PC2CC3D_SEED environment variable "
+                         "overrides the streams' seed at run time. Defaults to PhysiCell's random_seed user "
+                         "parameter, or a new seed every run")
+parser.add_argument("--coarsediffusion", type=str, nargs="*", default=None,
+                    help="(optional) solve these fields (every field if none is given) in Python on PhysiCell's "
+                         "microenvironment mesh instead of the CC3D lattice. Chemotactic fields stay on the lattice")
+parser.add_argument("--coarseworkers", type=int, default=1,
+                    help="(optional) with --coarsediffusion, number of processes solving the coarse grid. Default 1")
+parser.add_argument("--steadyevery", type=int, default=1,
+                    help="(optional) largest number of MCS between two calls of a steady state diffusion solver, "
+                         "used for fields whose sources change slowly. Default 1")
 args = parser.parse_args()
-main(args.input, out_directory=args.output, minimum_volume=args.cellvolume, max_volume=args.simulationvolume)
+if args.variants:
+    convert_variants(args.input, args.variants, out_directory=args.output, slice_3d=not args.keep3d,
+                     minimum_volume=args.cellvolume, max_volume=args.simulationvolume,
+                     steady_initial=args.steadystate, crop=args.crop, crop_margin=args.cropmargin,
+                     anisotropy_tolerance=args.anisotropy, check_diffusion=args.checkdiffusion,
+                     dynamic_chemotaxis=args.dynamicchemotaxis, volume_mode=args.volumemode,
+                     rescale_time=args.rescaletime, solver_selection=args.solverselection,
+                     steady_frequency=args.steadyevery, n_processors=args.processors,
+                     record_population=args.population, checkpoint_frequency=args.checkpoint,
+                     profile=args.profile, profile_every=args.profileevery, seed=args.seed,
+                     coarse_fields=args.coarsediffusion, coarse_workers=args.coarseworkers)
+else:
+    main(args.input, out_directory=args.output, minimum_volume=args.cellvolume, max_volume=args.simulationvolume,
+         steady_initial=args.steadystate, crop=args.crop, crop_margin=args.cropmargin,
+         anisotropy_tolerance=args.anisotropy, check_diffusion=args.checkdiffusion,
+         dynamic_chemotaxis=args.dynamicchemotaxis, volume_mode=args.volumemode,
+         rescale_time=args.rescaletime, solver_selection=args.solverselection,
+         steady_frequency=args.steadyevery, n_processors=args.processors,
+         record_population=args.population, checkpoint_frequency=args.checkpoint,
+         profile=args.profile, profile_every=args.profileevery, seed=args.seed,
+         coarse_fields=args.coarsediffusion, coarse_workers=args.coarseworkers)
 
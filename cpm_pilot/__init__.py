@@ -0,0 +1,3 @@
+from .cc3dml import read_cc3dml, read_cell_constraints
+from .engine import CPM
+from .calibration import make_pilot_model, measure_statistics, calibrate
@@ -0,0 +1,196 @@
+import warnings
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+
+from cpm_pilot.cc3dml import read_cc3dml, read_cell_constraints
+from cpm_pilot.engine import CPM
+
+
+def make_pilot_model(model, constraints=None, downsample=1, max_side=200, coverage=0.5, lambda_volume=16,
+                     seed=None):
+    """
+    Builds a pilot CPM from a parsed CC3DML (see read_cc3dml) on a downsampled lattice.
+
+    The lattice and the cells are shrunk by `downsample` in every direction, and the lattice is further limited to
+    `max_side` pixels per side (the statistics the pilot measures are local, a patch of tissue is enough). The
+    central `coverage` fraction of the lattice is filled with cells of all non-wall types, like the UniformInitializer
+    of the converted simulation.
+
+    Parameters
+    ----------
+    model : dict
+        Parsed CC3DML, see read_cc3dml
+    constraints : dict, optional
+        Converted cell constraints (extra_definitions.py), used for the target volumes if the CC3DML doesn't define
+        them
+    downsample : int, optional
+        Down-sampling factor of the lattice. Default 1
+    max_side : int, optional
+        Largest number of pixels per side of the pilot lattice. Default 200
+    coverage : float, optional
+        Fraction (per side) of the lattice initially filled with cells. Default 0.5
+    lambda_volume : float, optional
+        Volume lambda used if the CC3DML doesn't define it. Default 16
+    seed : int, optional
+        Random seed
+
+    Returns
+    -------
+    CPM
+        The pilot model
+    """
+    dims = model["dims"]
+    is_2D = dims[2] == 1
+    n_dims = 2 if is_2D else 3
+    pilot_dims = tuple(max(min(d // downsample, max_side), 1) for d in dims)
+    if is_2D:
+        pilot_dims = (pilot_dims[0], pilot_dims[1], 1)
+
+    cpm = CPM(pilot_dims, model["types"], model["contact"], temperature=model["temperature"],
+              potts_order=model["potts_order"], contact_order=model["contact_order"], seed=seed)
+
+    types = [t for t in model["types"][1:] if t.upper() != "WALL"]
+    targets = {}
+    for ctype in types:
+        if ctype in model["volume"].keys():
+            target, lam = model["volume"][ctype]
+        elif constraints is not None and ctype in constraints.keys():
+            target, lam = constraints[ctype]['volume']["volume (pixels)"], lambda_volume
+        else:
+            warnings.warn(f"WARNING: no target volume for {ctype}, using 25 pixels")
+            target, lam = 25, lambda_volume
+        target = target / downsample ** n_dims
+        if target < 4:
+            warnings.warn(f"WARNING: {ctype} cells have {target:.1f} pixels on the pilot lattice, reduce the "
+                          f"down-sampling")
+        targets[ctype] = (max(target, 1), lam)
+
+    side = max(int(round(np.mean([t for t, _ in targets.values()]) ** (1 / n_dims))), 1)
+    region = [(int(s * (1 - coverage) / 2), int(s * (1 + coverage) / 2)) for s in cpm.shape]
+    starts = [range(lo, max(hi - side, lo) + 1, side) for lo, hi in region]
+    for idx, corner in enumerate(product(*starts)):
+        ctype = types[idx % len(types)]
+        cpm.add_cell(ctype, corner, tuple(c + side for c in corner), *targets[ctype])
+    return cpm
+
+
+def measure_statistics(cpm, mcs=200, equilibration=50, sample_every=5):
+    """
+    Runs a pilot simulation and measures the volume fluctuations and motility of the cells.
+
+    Parameters
+    ----------
+    cpm : CPM
+        The pilot model
+    mcs : int, optional
+        Number of MCS measured. Default 200
+    equilibration : int, optional
+        Number of MCS ran before measuring. Default 50
+    sample_every : int, optional
+        Sampling period in MCS. Default 5
+
+    Returns
+    -------
+    dict
+        "volume_fluctuation": standard deviation of (volume - target)/target over cells and samples
+        "volume_ratio": mean volume/target
+        "diffusivity": cells' center of mass diffusion coefficient, pixels^2/MCS (MSD/(2*dimensions*time))
+        "acceptance": fraction of accepted copy attempts per pixel per MCS
+    """
+    cpm.step(equilibration)
+    alive = cpm.target_volume[1:] > 0
+    start = cpm.centers_of_mass()
+    ratios = []
+    times = []
+    msd = []
+    accepted = 0
+    for t in range(sample_every, mcs + 1, sample_every):
+        accepted += cpm.step(sample_every)
+        ratios.append(cpm.volume[1:][alive] / cpm.target_volume[1:][alive])
+        displacement = cpm.centers_of_mass() - start
+        times.append(t)
+        msd.append(np.nanmean(np.sum(displacement ** 2, axis=1)))
+
+    ratios = np.concatenate(ratios) if ratios else np.ones(1)
+    times = np.array(times, dtype=float)
+    msd = np.array(msd)
+    slope = np.sum(times * msd) / np.sum(times ** 2) if len(times) else 0
+    return {"volume_fluctuation": float(np.std(ratios - 1)),
+            "volume_ratio": float(np.mean(ratios)),
+            "diffusivity": float(slope / (2 * len(cpm.shape))),
+            "acceptance": accepted / (cpm.lattice.size * max(mcs, 1))}
+
+
+def calibrate(path_to_xml, temperatures, lambdas, target_fluctuation=None, target_diffusivity=None, mcs=200,
+              equilibration=50, downsample=1, max_side=200, seed=0):
+    """
+    Fits the Potts temperature and the volume lambda of a converted simulation with pilot runs.
+
+    Every (temperature, lambda) pair is simulated on the pilot lattice and scored by the squared relative error of its
+    statistics to the targets. The lambdas and the diffusivity are those of the full lattice: the pilot's cells are
+    downsample^dimensions times smaller, so it runs each lambda times downsample^(2*dimensions), which keeps the volume
+    energy lambda*(volume - target)^2 of the same relative fluctuation, and its diffusivity is scaled by downsample^2.
+
+    Parameters
+    ----------
+    path_to_xml : str or pathlib.Path
+        Converted CC3DML file (the cell constraints are read from the extra_definitions.py next to it)
+    temperatures : list
+        Temperatures to try
+    lambdas : list
+        Volume lambdas (of the full lattice) to try
+    target_fluctuation : float, optional
+        Target standard deviation of the relative volume fluctuations
+    target_diffusivity : float, optional
+        Target cell diffusion coefficient, in pixels^2/MCS of the full lattice
+    mcs : int, optional
+        Number of MCS measured per pilot. Default 200
+    equilibration : int, optional
+        Number of MCS ran before measuring. Default 50
+    downsample : int, optional
+        Down-sampling factor of the pilot lattice. Default 1
+    max_side : int, optional
+        Largest number of pixels per side of the pilot lattice. Default 200
+    seed : int, optional
+        Random seed, the same for every pilot so the scores are comparable. Default 0
+
+    Returns
+    -------
+    best : dict
+        The best scoring pilot
+    results : list
+        One dict per pilot with the temperature, lambda (and the pilot's lambda), statistics and score
+    """
+    if target_fluctuation is None and target_diffusivity is None:
+        raise ValueError("At least one of target_fluctuation and target_diffusivity is needed to calibrate")
+
+    path_to_xml = Path(path_to_xml)
+    model = read_cc3dml(path_to_xml)
+    extra = path_to_xml.parent.joinpath("extra_definitions.py")
+    constraints = read_cell_constraints(extra) if extra.exists() else None
+
+    lambda_scale = downsample ** (2 * (2 if model["dims"][2] == 1 else 3))
+
+    results = []
+    for temperature, lam in product(temperatures, lambdas):
+        cpm = make_pilot_model(model, constraints, downsample=downsample, max_side=max_side, seed=seed)
+        cpm.temperature = temperature
+        cpm.set_lambda_volume(lam * lambda_scale)
+        stats = measure_statistics(cpm, mcs=mcs, equilibration=equilibration)
+        stats["diffusivity"] *= downsample ** 2
+        score = 0
+        if target_fluctuation is not None:
+            score += ((stats["volume_fluctuation"] - target_fluctuation) / target_fluctuation) ** 2
+        if target_diffusivity is not None:
+            score += ((stats["diffusivity"] - target_diffusivity) / target_diffusivity) ** 2
+        result = {"temperature": temperature, "lambda_volume": lam, "pilot_lambda_volume": lam * lambda_scale,
+                  "score": score}
+        result.update(stats)
+        print(f"T={temperature}, lambdaVolume={lam}: volume fluctuation={stats['volume_fluctuation']:.4f}, "
+              f"diffusivity={stats['diffusivity']:.4g} pixel^2/MCS, score={score:.4g}")
+        results.append(result)
+
+    best = min(results, key=lambda r: r["score"])
+    return best, results
@@ -0,0 +1,97 @@
+import ast
+import warnings
+from pathlib import Path
+
+import xmltodict as x2d
+
+
+def _as_list(item):
+    if item is None:
+        return []
+    if isinstance(item, list):
+        return item
+    return [item]
+
+
+def read_cc3dml(path_or_xml):
+    """
+    Reads the subset of a CC3DML file used by the pilot engine: Potts, CellType, Volume and Contact.
+
+    Parameters
+    ----------
+    path_or_xml : str or pathlib.Path
+        Path to the CC3DML file, or its contents
+
+    Returns
+    -------
+    dict
+        Dictionary with the keys:
+        "dims": (x, y, z) lattice dimensions
+        "temperature": Potts temperature
+        "potts_order": Potts neighbor order
+        "contact_order": Contact neighbor order
+        "types": list of cell type names ordered by type ID (Medium first)
+        "contact": {(type 1, type 2): energy}
+        "volume": {type: (target volume, lambda volume)} from the Volume plugin's VolumeEnergyParameters, empty if
+        the volume constraint is set per cell (in Python)
+    """
+    if Path(str(path_or_xml)).suffix.lower() == ".xml" and Path(path_or_xml).exists():
+        with open(path_or_xml, "r") as f:
+            raw = f.read()
+    else:
+        raw = str(path_or_xml)
+
+    cc3d = x2d.parse(raw, force_list=("Plugin", "CellType", "Energy", "VolumeEnergyParameters"))["CompuCell3D"]
+
+    potts = cc3d["Potts"]
+    dims = tuple(int(potts["Dimensions"][f"@{axis}"]) for axis in ("x", "y", "z"))
+    temperature = float(potts["Temperature"]) if "Temperature" in potts.keys() else 10.0
+    potts_order = int(potts["NeighborOrder"]) if "NeighborOrder" in potts.keys() else 1
+
+    plugins = {p["@Name"]: p for p in _as_list(cc3d.get("Plugin")) if p is not None}
+
+    types = ["Medium"]
+    if "CellType" in plugins.keys():
+        cell_types = sorted(_as_list(plugins["CellType"].get("CellType")), key=lambda t: int(t["@TypeId"]))
+        types = [t["@TypeName"] for t in cell_types]
+
+    contact = {}
+    contact_order = 1
+    if "Contact" in plugins.keys() and plugins["Contact"] is not None:
+        for energy in _as_list(plugins["Contact"].get("Energy")):
+            contact[(energy["@Type1"], energy["@Type2"])] = float(energy["#text"])
+        if "NeighborOrder" in plugins["Contact"].keys():
+            contact_order = int(plugins["Contact"]["NeighborOrder"])
+    else:
+        warnings.warn("WARNING: no Contact plugin found, the pilot runs without adhesion energies")
+
+    volume = {}
+    if "Volume" in plugins.keys() and plugins["Volume"] is not None:
+        for parameters in _as_list(plugins["Volume"].get("VolumeEnergyParameters")):
+            volume[parameters["@CellType"]] = (float(parameters["@TargetVolume"]),
+                                               float(parameters["@LambdaVolume"]))
+
+    return {"dims": dims, "temperature": temperature, "potts_order": potts_order, "contact_order": contact_order,
+            "types": types, "contact": contact, "volume": volume}
+
+
+def read_cell_constraints(path):
+    """
+    Reads the `cell_constraints` dictionary the converter writes to extra_definitions.py.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to extra_definitions.py
+
+    Returns
+    -------
+    dict
+        The converted cell constraints, empty if the file doesn't define them
+    """
+    with open(path, "r") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "cell_constraints" for t in node.targets):
+            return ast.literal_eval(node.value)
+    return {}
@@ -0,0 +1,182 @@
+import numpy as np
+
+from cc3d_xml_gen.gen import get_neighbor_offsets
+
+
+class CPM:
+    """
+    Minimal vectorized cellular Potts model with the volume and contact energies.
+
+    It follows CC3D's conventions (pixel copy attempts towards a random neighbor of the Potts neighbor order, contact
+    energy over the Contact neighbor order, Boltzmann acceptance exp(-dE/T), no flux lattice boundaries) closely
+    enough to calibrate the temperature and volume lambdas of a converted model, but it is not a replacement for CC3D.
+
+    Copy attempts are done in parallel on one sub-lattice at a time: the sub-lattice spacing is larger than twice the
+    neighborhood reach, so the contact energy changes of simultaneous attempts are independent. Attempts that would
+    change the volume of a cell already changed in the same sub-step are dropped, which keeps the volume energy exact.
+    One MCS is, on average, one copy attempt per pixel.
+
+    Parameters
+    ----------
+    dims : tuple
+        Lattice dimensions (x, y, z), z=1 for 2D
+    types : list
+        Cell type names ordered by type ID, the first one is the medium
+    contact : dict
+        {(type 1, type 2): energy}, missing pairs have no contact energy
+    temperature : float, optional
+        Potts temperature. Default 10
+    potts_order : int, optional
+        Neighbor order of the copy attempts. Default 1
+    contact_order : int, optional
+        Neighbor order of the contact energy. Default 1
+    seed : int or numpy.random.Generator, optional
+        Seed of the random number generator
+    """
+
+    def __init__(self, dims, types, contact, temperature=10.0, potts_order=1, contact_order=1, seed=None):
+        self.is_2D = dims[2] == 1
+        self.shape = tuple(dims[:2]) if self.is_2D else tuple(dims)
+        self.types = list(types)
+        self.temperature = temperature
+        self.rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+
+        self.contact = np.zeros((len(types), len(types)))
+        for (t1, t2), energy in contact.items():
+            if t1 in self.types and t2 in self.types:
+                self.contact[self.types.index(t1), self.types.index(t2)] = energy
+                self.contact[self.types.index(t2), self.types.index(t1)] = energy
+
+        potts_offsets = np.array(get_neighbor_offsets(potts_order, self.is_2D))
+        contact_offsets = np.array(get_neighbor_offsets(contact_order, self.is_2D))
+        self.reach = int(max(np.abs(potts_offsets).max(), np.abs(contact_offsets).max()))
+        self.spacing = 2 * self.reach + 1
+
+        # the lattice is padded with -1, pixels outside the domain are never copied and have no contact energy
+        padded_shape = tuple(s + 2 * self.reach for s in self.shape)
+        self.sigma = np.full(padded_shape, -1, dtype=np.int64)
+        self.interior = tuple(slice(self.reach, self.reach + s) for s in self.shape)
+        self.sigma[self.interior] = 0
+
+        strides = np.array([int(np.prod(padded_shape[i + 1:])) for i in range(len(padded_shape))])
+        self.potts_flat = potts_offsets @ strides
+        self.contact_flat = contact_offsets @ strides
+        self._flat_interior = np.arange(self.sigma.size).reshape(padded_shape)[self.interior]
+
+        # per cell arrays, index 0 is the medium
+        self.cell_type = np.zeros(1, dtype=np.int64)
+        self.target_volume = np.zeros(1)
+        self.lambda_volume = np.zeros(1)
+        self.volume = np.zeros(1)
+
+    @property
+    def lattice(self):
+        """
+        Cell ID of every pixel (0 is the medium)
+        """
+        return self.sigma[self.interior]
+
+    @property
+    def n_cells(self):
+        return len(self.cell_type) - 1
+
+    def add_cell(self, cell_type, low, high, target_volume, lambda_volume):
+        """
+        Adds a box shaped cell occupying [low, high) of the lattice (only medium pixels are taken).
+
+        Returns
+        -------
+        int
+            The new cell's ID
+        """
+        cell_id = len(self.cell_type)
+        region = tuple(slice(max(lo, 0), min(hi, s)) for lo, hi, s in zip(low, high, self.shape))
+        view = self.lattice[region]
+        view[view == 0] = cell_id
+        self.cell_type = np.append(self.cell_type, self.types.index(cell_type))
+        self.target_volume = np.append(self.target_volume, float(target_volume))
+        self.lambda_volume = np.append(self.lambda_volume, float(lambda_volume))
+        self.volume = np.append(self.volume, float(np.count_nonzero(view == cell_id)))
+        return cell_id
+
+    def set_lambda_volume(self, lambda_volume):
+        """
+        Sets the volume lambda of every cell
+        """
+        self.lambda_volume[1:] = lambda_volume
+
+    def _sub_step(self):
+        offset = tuple(self.rng.integers(self.spacing, size=len(self.shape)))
+        sites = self._flat_interior[tuple(slice(o, None, self.spacing) for o in offset)].ravel()
+        if not sites.size:
+            return 0
+        sites = self.rng.permutation(sites)
+        flat = self.sigma.reshape(-1)
+
+        old = flat[sites]
+        new = flat[sites + self.potts_flat[self.rng.integers(len(self.potts_flat), size=sites.size)]]
+        attempt = (new != old) & (new >= 0)
+        sites, old, new = sites[attempt], old[attempt], new[attempt]
+        if not sites.size:
+            return 0
+
+        neighbors = flat[sites[:, None] + self.contact_flat[None, :]]
+        inside = neighbors >= 0
+        neighbor_types = self.cell_type[np.where(inside, neighbors, 0)]
+        old_type = self.cell_type[old][:, None]
+        new_type = self.cell_type[new][:, None]
+        delta = np.sum(inside * (self.contact[new_type, neighbor_types] * (neighbors != new[:, None]) -
+                                 self.contact[old_type, neighbor_types] * (neighbors != old[:, None])), axis=1)
+
+        delta += self.lambda_volume[old] * (1 - 2 * (self.volume[old] - self.target_volume[old]))
+        delta += self.lambda_volume[new] * (1 + 2 * (self.volume[new] - self.target_volume[new]))
+
+        if self.temperature > 0:
+            accept = (delta <= 0) | (self.rng.random(sites.size) < np.exp(-np.clip(delta, 0, None) /
+                                                                           self.temperature))
+        else:
+            accept = delta <= 0
+        sites, old, new = sites[accept], old[accept], new[accept]
+
+        # one volume change per cell per sub-step (the medium has no volume energy)
+        index = np.arange(sites.size)
+        first = np.full(len(self.cell_type), sites.size)
+        np.minimum.at(first, np.concatenate([old, new]), np.concatenate([index, index]))
+        keep = ((old == 0) | (first[old] == index)) & ((new == 0) | (first[new] == index))
+        sites, old, new = sites[keep], old[keep], new[keep]
+
+        flat[sites] = new
+        np.add.at(self.volume, old, -1)
+        np.add.at(self.volume, new, 1)
+        return sites.size
+
+    def step(self, mcs=1):
+        """
+        Runs `mcs` Monte Carlo steps.
+
+        Returns
+        -------
+        int
+            Number of accepted pixel copies
+        """
+        accepted = 0
+        for _ in range(int(mcs * self.spacing ** len(self.shape))):
+            accepted += self._sub_step()
+        return accepted
+
+    def centers_of_mass(self):
+        """
+        Returns
+        -------
+        numpy.ndarray
+            (number of cells, dimensions) array of the cells' centers of mass, NaN for vanished cells
+        """
+        lattice = self.lattice
+        counts = np.bincount(lattice.ravel(), minlength=len(self.cell_type))[1:]
+        coordinates = np.indices(lattice.shape).reshape(len(self.shape), -1)
+        centers = np.empty((self.n_cells, len(self.shape)))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for axis in range(len(self.shape)):
+                centers[:, axis] = np.bincount(lattice.ravel(), weights=coordinates[axis],
+                                               minlength=len(self.cell_type))[1:] / counts
+        return centers
@@ -0,0 +1,44 @@
+import argparse
+import sys
+
+from cc3d_standin.ensemble import run_ensemble
+
+if __name__ == "__main__":
+    # parsed under the guard, the pool's worker processes may import this script
+    parser = argparse.ArgumentParser(description="Runs replicates of converted simulations (e.g. the variants of a "
+                                                 "sweep) in parallel, each with its own seed, and streams their "
+                                                 "summary metrics to one csv as they finish. Runs use the headless "
+                                                 "CC3D stand-in unless a CompuCell3D command is given.")
+    parser.add_argument("models", type=str, nargs="+", help="Converted simulations (.cc3d files or their folders)")
+    parser.add_argument("-r", "--replicates", type=int, default=10, help="(optional) replicates per model. Default 10")
+    parser.add_argument("-o", "--output", type=str, default="ensemble.csv",
+                        help="(optional) aggregated csv. Default ensemble.csv")
+    parser.add_argument("-d", "--outputdir", type=str, default=None,
+                        help="(optional) root folder of the runs' outputs, <outputdir>/<model>/replicate_<i>. "
+                             "Required with --command")
+    parser.add_argument("-n", "--mcs", type=int, default=None,
+                        help="(optional) MCS of stand-in runs. Default the simulations' number of steps")
+    parser.add_argument("-s", "--sample", type=int, default=None,
+                        help="(optional) sampling interval (MCS) of stand-in runs. Default only the end of the runs")
+    parser.add_argument("--cells", type=int, default=None,
+                        help="(optional) replace the initial cells of stand-in runs with this many cells on a grid")
+    parser.add_argument("--seed", type=int, default=0, help="(optional) seed the replicate seeds are spawned from")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="(optional) number of processes. Default one per available CPU")
+    parser.add_argument("--cpus", type=int, nargs="+", default=None,
+                        help="(optional) CPUs the runs are pinned to, one per worker process. Default all the "
+                             "available CPUs")
+    parser.add_argument("--retries", type=int, default=2, help="(optional) retries of a failed run. Default 2")
+    parser.add_argument("--command", type=str, default=None,
+                        help='(optional) run CompuCell3D instead of the stand-in with this command, e.g. "runScript '
+                             '-i {cc3d} -o {output}". Each replicate runs a copy of the model with its seed as the '
+                             '<RandomSeed> and in the PC2CC3D_SEED environment variable, and the metrics are read '
+                             'from the PIF dumps')
+    args = parser.parse_args()
+
+    failed = run_ensemble(args.models, args.replicates, args.output, seed=args.seed, workers=args.workers,
+                          cpus=args.cpus, max_retries=args.retries, mcs=args.mcs, sample_every=args.sample,
+                          n_cells=args.cells, output_dir=args.outputdir, command=args.command)
+    print(f"______________\nResults in {args.output}" + (f", {len(failed)} runs failed" if failed else ""))
+    if failed:
+        sys.exit(1)
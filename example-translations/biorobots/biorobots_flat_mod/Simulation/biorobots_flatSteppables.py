@@ -21,6 +21,7 @@ from cc3d import CompuCellSetup
 from cc3d.core.PySteppables import *
 import numpy as np
 
+import os
 import sys
 
 # IMPORTANT: PhysiCell has a concept of cell phenotype, PhenoCellPy (https://github.com/JulianoGianlupi/PhenoCellPy)
@@ -55,6 +56,13 @@ focal_lambda = chemotaxis_lambda/10_000
 # 		<number_of_cargo_clusters type="int" units="none">100</number_of_cargo_clusters>
 # 		<number_of_workers type="int" units="none">50</number_of_workers>
 
+def candidate_positions(rng, low, high_x, high_y, block=256):
+    # random lattice positions, drawn `block` at a time
+    while True:
+        for x, y in rng.integers(low, (high_x, high_y), size=(block, 2)):
+            yield int(x), int(y)
+
+
 class ConstraintsSteppable(SteppableBasePy):
 
     def __init__(self, frequency=1):
@@ -464,6 +472,14 @@ class ConstraintsSteppable(SteppableBasePy):
                                                                                       None, None],
                                                                                   fluid_change_rate=[0.05, 0.0])
 
+        # The cells are placed at random positions drawn in blocks from a seeded generator instead of one np.random
+        # call per attempt. Set the PC2CC3D_SEED environment variable (as for the converted steppables' random streams)
+        # to repeat a run
+        seed = os.environ.get("PC2CC3D_SEED")
+        placement = np.random.default_rng(None if seed is None else int(seed))
+        cargo_positions = candidate_positions(placement, 9, self.dim.x - 18, self.dim.y - 18)
+        positions = candidate_positions(placement, 9, self.dim.x - 9, self.dim.y - 9)
+
         neighbors = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, 1), (-1, -1), (1, -1)]
 
         shifts = [(0, 0), (3, 0), (-3, 0), (3, 3), (3, -3), (-3, -3), (-3, 3)]
@@ -475,8 +491,7 @@ class ConstraintsSteppable(SteppableBasePy):
             while not space:
                 print(attempts)
                 attempts += 1
-                x = np.random.randint(9, self.dim.x - 18)
-                y = np.random.randint(9, self.dim.y - 18)
+                x, y = next(cargo_positions)
 
                 space = not bool(self.cell_field[x, y, 0])
 
@@ -500,8 +515,7 @@ class ConstraintsSteppable(SteppableBasePy):
             while not space:
                 print(attempts)
                 attempts += 1
-                x = np.random.randint(9, self.dim.x - 9)
-                y = np.random.randint(9, self.dim.y - 9)
+                x, y = next(positions)
                 space = not bool(self.cell_field[x, y, 0])
 
                 if space:
@@ -519,8 +533,7 @@ class ConstraintsSteppable(SteppableBasePy):
             while not space:
                 print(attempts)
                 attempts += 1
-                x = np.random.randint(9, self.dim.x - 9)
-                y = np.random.randint(9, self.dim.y - 9)
+                x, y = next(positions)
                 space = not bool(self.cell_field[x, y, 0])
 
                 if space:
@@ -0,0 +1,34 @@
+import argparse
+from time import perf_counter
+
+from cc3d_standin import load_simulation
+
+parser = argparse.ArgumentParser(description="Runs the Python steppables of a converted CompuCell3D simulation "
+                                             "headless, without CompuCell3D, and reports their time per MCS. There is "
+                                             "no Potts algorithm nor diffusion, see cc3d_standin.")
+parser.add_argument("input", type=str, help="Path to the converted simulation (the .cc3d file or its folder)")
+parser.add_argument("-n", "--mcs", type=int, default=100, help="(optional) number of MCS to run. Default 100")
+parser.add_argument("-o", "--output", type=str, default=None,
+                    help="(optional) output folder given to the steppables, no output by default")
+parser.add_argument("--cells", type=int, default=None,
+                    help="(optional) replace the initial cells with this many cells on a grid")
+parser.add_argument("--seed", type=int, default=0, help="(optional) random seed")
+args = parser.parse_args()
+
+simulation = load_simulation(args.input, output_dir=args.output, seed=args.seed)
+if args.cells is not None:
+    simulation.seed_cells(args.cells)
+start = perf_counter()
+simulation.start()
+start_time = perf_counter() - start
+start = perf_counter()
+for _ in range(args.mcs):
+    simulation.step()
+    if simulation.stopped:
+        break
+simulation.finish()
+total = perf_counter() - start
+print(f"______________\nstart: {start_time:.4g} s, {simulation.mcs + 1} MCS in {total:.4g} s, "
+      f"{len(simulation.inventory)} cells")
+for name, (calls, seconds) in simulation.timings.items():
+    print(f"{name}.step: {calls} calls, {1e3 * seconds / max(simulation.mcs + 1, 1):.4g} ms/MCS")
@@ -1,7 +1,11 @@
-from .gen_functions import generate_steppable
+from .gen_functions import generate_steppable, add_profiling_hooks
 from .generate_constraint_step import generate_constraint_steppable
 from .generate_secretion_step import generate_secretion_uptake_step
 from .generate_main_py import generate_main_python
-from .generate_steppable_file import generate_steppable_file
-from .get_steppables_names import get_steppables_names
+from .generate_steppable_file import generate_steppable_file, copy_runtime
+from .get_steppables_names import get_steppables_names, get_per_cell_steppables
 from .generate_phenotype_step import generate_phenotype_steppable
+from .generate_output_step import generate_output_steppable
+from .generate_population_step import generate_population_steppable
+from .generate_checkpoint_step import generate_checkpoint_steppable
+from .generate_coarse_diffusion_step import generate_coarse_diffusion_steppable
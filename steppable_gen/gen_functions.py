@@ -32,7 +32,7 @@ def steppable_imports(user_data="", phenocell_dir=False):
     if not phenocell_dir:
         phenocell_dir = "C:\\PhenoCellPy"
     imports = '''from cc3d.cpp.PlayerPython import *\nfrom cc3d import CompuCellSetup
-from cc3d.core.PySteppables import *\nimport numpy as np\n
+from cc3d.core.PySteppables import *\nimport numpy as np\nimport os\nfrom pathlib import Path\n
 '''
     phenocell = f'''import sys\n
 # IMPORTANT: PhysiCell has a concept of cell phenotype, PhenoCellPy (https://github.com/JulianoGianlupi/PhenoCellPy) 
@@ -45,6 +45,18 @@ try:
 \timport PhenoCellPy as pcp
 \tpcp_imp = True
 except:
+\tpass\n
+# Background writers for data collection, see pc2cc3d_runtime.py (copied next to this file by the converter). To save
+# data without stalling the simulation enqueue it in a writer owned by the steppable, e.g. in step()
+# get_writer(f"{{self.output_dir}}/data.csv", owner=self).write((mcs, len(self.cell_list)))
+# finish() closes the writers once no steppable owns them anymore
+global runtime_imp
+runtime_imp = False
+try:
+\tfrom pc2cc3d_runtime import get_writer, close_writers, SnapshotStore, PopulationRecorder, save_checkpoint, \\
+\t\tfind_checkpoint, load_checkpoint, get_random_streams, CoarseDiffusion
+\truntime_imp = True
+except ImportError:
 \tpass\n\n
 user_data={user_data}\n\n
 '''
@@ -93,12 +105,23 @@ def steppable_step():
     return step
 
 
+def mcs_offset_step():
+    """
+    Step code making `mcs` count the MCS of the earlier segments of a run restarted from a checkpoint (see the
+    CheckpointSteppable), for steppables that write data indexed by MCS
+    """
+    return "\t\t# MCS completed before the checkpoint this run restarted from, if any\n" \
+           "\t\tmcs += self.shared_steppable_vars.get('mcs_offset', 0)\n"
+
+
 def steppable_finish():
     finish = '''
 \tdef finish(self):
 \t\t"""
 \t\tCalled after the last MCS to wrap up the simulation. Good place to close files and do post-processing
-\t\t"""\n
+\t\t"""
+\t\tif runtime_imp:
+\t\t\tclose_writers(self)\n
 '''
     return finish
 
@@ -121,9 +144,101 @@ def mitosis_update_attribute():
 '''
     return update
 
+
+def profiling_imports():
+    return '''
+# Profiling hooks added by the converter's --profile option, see pc2cc3d_runtime.StepProfiler
+try:
+\tfrom pc2cc3d_runtime import StepProfiler
+except ImportError:
+\tStepProfiler = None\n
+'''
+
+
+def profiling_wrappers(step_name, methods, profile_every=None):
+    wrappers = ''
+    if "start" in methods:
+        wrappers += f"""
+\tdef start(self):
+\t\tself.profiler = StepProfiler('{step_name}', self.output_dir, {profile_every}) if StepProfiler is not None else \\
+\t\t\tNone
+\t\tif self.profiler is None:
+\t\t\treturn self._profiled_start()
+\t\tself.profiler.set_type_names(self)
+\t\twith self.profiler.measure('start'):
+\t\t\tself._profiled_start()
+"""
+    if "step" in methods:
+        wrappers += """
+\tdef step(self, mcs):
+\t\tif self.profiler is None:
+\t\t\treturn self._profiled_step(mcs)
+\t\twith self.profiler.measure('step', mcs):
+\t\t\tself._profiled_step(mcs)
+"""
+    if "finish" in methods:
+        wrappers += """
+\tdef finish(self):
+\t\tif self.profiler is None:
+\t\t\treturn self._profiled_finish()
+\t\twith self.profiler.measure('finish'):
+\t\t\tself._profiled_finish()
+\t\t# on_stop calls finish, report once
+\t\tprofiler, self.profiler = self.profiler, None
+\t\tprofiler.report()
+"""
+    else:
+        # e.g. the minimal ConstraintsSteppable, only its start is timed but it still has to be reported
+        wrappers += """
+\tdef finish(self):
+\t\tprofiler, self.profiler = getattr(self, 'profiler', None), None
+\t\tif profiler is not None:
+\t\t\tprofiler.report()
+"""
+        if "on_stop" not in methods:
+            wrappers += """
+\tdef on_stop(self):
+\t\tself.finish()
+"""
+    wrappers += """
+\tdef cell_list_by_type(self, *types):
+\t\tcells = super().cell_list_by_type(*types)
+\t\tif getattr(self, 'profiler', None) is not None:
+\t\t\tself.profiler.visit(types, cells)
+\t\treturn cells
+"""
+    return wrappers
+
+
+def add_profiling_hooks(step_string, profile_every=None):
+    """
+    Wraps the start, step and finish of every steppable class of `step_string` with a StepProfiler: per call wall
+    time and cells visited (through cell_list_by_type), summarized at finish/on_stop (added to the classes without a
+    finish), and cProfile sampling every `profile_every` steps if given. Classes already instrumented are left
+    unchanged.
+    """
+    parts = step_string.split("\nclass ")
+    for i, part in enumerate(parts[1:], start=1):
+        if "_profiled_" in part or "Steppable" not in part.split("\n")[0]:
+            continue
+        step_name = part.split("(")[0].strip()
+        methods = []
+        for method, header in (("start", "\tdef start(self):"), ("step", "\tdef step(self, mcs):"),
+                               ("finish", "\tdef finish(self):")):
+            if header in part:
+                part = part.replace(header, header.replace(f"def {method}(", f"def _profiled_{method}("), 1)
+                methods.append(method)
+        if "\tdef on_stop(self):" in part:
+            methods.append("on_stop")
+        parts[i] = part.rstrip("\n") + "\n" + profiling_wrappers(step_name, methods, profile_every) + "\n"
+    if len(parts) > 1 and "import StepProfiler" not in step_string:
+        parts[0] += profiling_imports()
+    return "\nclass ".join(parts)
+
+
 def generate_steppable(step_name, frequency, mitosis, minimal=False, already_imports=False, additional_init=None,
                        additional_start=None, additional_step=None, additional_finish=None, additional_on_stop=None,
-                       phenocell_dir=False, user_data=""):
+                       phenocell_dir=False, user_data="", profile=False, profile_every=None):
     imports = steppable_imports(user_data=user_data, phenocell_dir=phenocell_dir)
     declare = steppable_declaration(step_name, mitosis=mitosis)
     init = steppable_init(frequency, mitosis=mitosis)
@@ -155,12 +270,16 @@ def generate_steppable(step_name, frequency, mitosis, minimal=False, already_imp
     mitosis_update = mitosis_update_attribute() if mitosis else ''
 
     if minimal and already_imports:
-        return declare+init+start+"\n"
+        step_string = declare+init+start+"\n"
     elif minimal:
-        return imports + declare + init + start + "\n"
+        step_string = imports + declare + init + start + "\n"
     elif not already_imports:
-        return imports + declare + init + start + step + mitosis_update + finish + on_stop + "\n"
-    return declare+init+start+step+ mitosis_update + finish+on_stop+"\n"
+        step_string = imports + declare + init + start + step + mitosis_update + finish + on_stop + "\n"
+    else:
+        step_string = declare+init+start+step+ mitosis_update + finish+on_stop+"\n"
+    if profile:
+        step_string = add_profiling_hooks("\n" + step_string, profile_every=profile_every)[1:]
+    return step_string
 
 
 if __name__ == "__main__":
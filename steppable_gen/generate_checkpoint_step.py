@@ -0,0 +1,88 @@
+try:
+    from .gen_functions import generate_steppable
+except:
+    from gen_functions import generate_steppable  # see generate_secretion_step.py for why imports are like this
+
+
+def make_checkpoint_restore(field_names, chemotaxis_fields, total_steps):
+    start = "\t\t# Checkpoints of the cell lattice, fields, cell.dict and PhenoCellPy phases (see\n" \
+            "\t\t# pc2cc3d_runtime.save_checkpoint), saved to PC2CC3D_CHECKPOINT_DIR or else\n" \
+            "\t\t# <output folder>/checkpoints. The simulation only restarts from the latest one if\n" \
+            "\t\t# PC2CC3D_RESTART is set (run_segments in pc2cc3d_runtime.py sets it, running a long\n" \
+            "\t\t# simulation as restartable segments). Set PC2CC3D_SEGMENT_MCS to stop after that many MCS\n"
+    start += "\t\tself.checkpoint_dir = os.environ.get('PC2CC3D_CHECKPOINT_DIR') or (\n" \
+             "\t\t\tNone if self.output_dir is None else str(Path(self.output_dir).joinpath('checkpoints')))\n"
+    start += "\t\tif self.checkpoint_dir is None:\n" \
+             "\t\t\tprint('No output folder or PC2CC3D_CHECKPOINT_DIR, checkpoints are not saved')\n"
+    start += "\t\tself.segment_mcs = int(os.environ.get('PC2CC3D_SEGMENT_MCS', 0))\n"
+    start += f"\t\tself.checkpoint_fields = {field_names}\n"
+    start += f"\t\tself.checkpoint_chemotaxis = {chemotaxis_fields}\n"
+    start += f"\t\tself.total_steps = {total_steps}\n"
+    start += "\t\tself.mcs_offset = 0\n"
+    start += "\t\tself.last_checkpoint = None\n"
+    start += "\t\trestart = os.environ.get('PC2CC3D_RESTART', '0') != '0'\n"
+    start += "\t\tif runtime_imp and restart and self.checkpoint_dir is not None:\n"
+    start += "\t\t\tlatest = find_checkpoint(self.checkpoint_dir)\n"
+    start += "\t\t\tif latest is not None:\n"
+    start += "\t\t\t\tself.mcs_offset = load_checkpoint(self, latest[0])\n"
+    start += "\t\t\t\tprint(f'Restarted from {latest[0]} after {self.mcs_offset} MCS')\n"
+    start += "\t\tself.shared_steppable_vars['mcs_offset'] = self.mcs_offset\n"
+    return start
+
+
+def make_checkpoint_save():
+    save = '''
+\tdef checkpoint(self, mcs):
+\t\tcompleted = mcs + 1 + self.mcs_offset
+\t\tif not runtime_imp or self.checkpoint_dir is None or completed == self.last_checkpoint:
+\t\t\treturn
+\t\tsave_checkpoint(self, self.checkpoint_dir, completed, self.checkpoint_fields, self.checkpoint_chemotaxis,
+\t\t\t\t\t\ttotal_steps=self.total_steps)
+\t\tself.last_checkpoint = completed
+'''
+    return save
+
+
+def make_checkpoint_step(frequency):
+    step = "\t\tcompleted = mcs + 1 + self.mcs_offset\n"
+    step += f"\t\tif completed % {frequency} == 0:\n\t\t\tself.checkpoint(mcs)\n"
+    step += "\t\tif completed >= self.total_steps or (self.segment_mcs and mcs + 1 >= self.segment_mcs):\n"
+    step += "\t\t\tself.checkpoint(mcs)\n"
+    step += "\t\t\tself.stop_simulation()\n"
+    return step
+
+
+def generate_checkpoint_steppable(field_names, chemotaxis_fields, frequency, total_steps, first=False):
+    """
+    Generates the CheckpointSteppable. It must be registered last: its start restores the checkpoint over the initial
+    configuration the other steppables built.
+
+    Parameters
+    ----------
+    field_names : list
+        Diffusing fields to checkpoint
+    chemotaxis_fields : list
+        Fields with per cell chemotaxis
+    frequency : int
+        MCS between checkpoints
+    total_steps : int
+        Number of MCS of the whole simulation, the restarted segments stop there
+
+    Returns
+    -------
+    str
+        The steppable's code
+    """
+    if frequency is None:
+        return ''
+    already_imports = not first
+    field_names = [name.replace(" ", "_") for name in field_names]
+    start = make_checkpoint_restore(field_names, chemotaxis_fields, total_steps)
+    # runs every MCS to stop on time at the end of a segment, saving only every frequency MCS
+    step_string = generate_steppable("Checkpoint", 1, False, already_imports=already_imports, additional_start=start,
+                                     additional_step=make_checkpoint_step(frequency))
+    return step_string.rstrip("\n") + "\n" + make_checkpoint_save() + "\n"
+
+
+if __name__ == "__main__":
+    print(generate_checkpoint_steppable(["oxygen", "director signal"], ["oxygen"], 100, 1000))
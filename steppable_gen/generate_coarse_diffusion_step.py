@@ -0,0 +1,86 @@
+try:
+    from .gen_functions import generate_steppable, mcs_offset_step
+except:
+    from gen_functions import generate_steppable, mcs_offset_step  # see generate_secretion_step.py for why imports
+    # are like this
+
+
+def get_coarse_field_parameters(coarse_elements):
+    """
+    Parameters of pc2cc3d_runtime.CoarseDiffusion for the converted diffusing elements (see
+    get_physicell_data.get_microenvironment), in pixel^2/MCS and 1/MCS
+    """
+    fields = {}
+    for name, item in coarse_elements.items():
+        try:
+            initial = float(item["initial_condition"])
+        except (TypeError, ValueError):
+            initial = 0.0
+        dirichlet = item["dirichlet_value"] if str(item["dirichlet"]).upper() != "FALSE" else None
+        fields[name.replace(" ", "_")] = {"D": item["D"], "decay": item["gamma"], "initial": initial,
+                                          "dirichlet": dirichlet}
+    return fields
+
+
+def make_coarse_diffusion_start(fields, spacing, workers):
+    start = "\t\t# These fields are solved on a grid matching PhysiCell's microenvironment mesh instead of the cell\n" \
+            "\t\t# lattice (see pc2cc3d_runtime.CoarseDiffusion). The secretion steppable secretes into them, read\n" \
+            "\t\t# them at a cell with self.shared_steppable_vars['coarse_diffusion'].sense_cell(field_name, cell)\n"
+    start += "\t\tself.engine = None\n"
+    start += "\t\tif runtime_imp:\n"
+    start += f"\t\t\tself.engine = CoarseDiffusion({fields},\n" \
+             f"\t\t\t\t(self.dim.x, self.dim.y, self.dim.z), {spacing}, workers={workers})\n"
+    start += "\t\t\tself.shared_steppable_vars['coarse_diffusion'] = self.engine\n"
+    start += "\t\telse:\n"
+    start += "\t\t\tprint('WARNING: pc2cc3d_runtime.py not found, the coarse grid fields are not solved')\n"
+    return start
+
+
+def make_coarse_diffusion_step(output_frequency):
+    step = "\t\tif self.engine is None:\n\t\t\treturn\n"
+    step += "\t\tself.engine.step(self.frequency)\n"
+    if output_frequency:
+        step += mcs_offset_step()
+        step += f"\t\tif mcs % {output_frequency} == 0 and self.output_dir is not None:\n" \
+                f"\t\t\tself.engine.save(f'{{self.output_dir}}/coarse_fields', mcs)\n"
+    return step
+
+
+def generate_coarse_diffusion_steppable(coarse_elements, spacing, frequency=1, workers=1, output_frequency=None,
+                                        first=False):
+    """
+    Generates the CoarseDiffusionSteppable, which solves the fields of `coarse_elements` on a coarse grid
+
+    Parameters
+    ----------
+    coarse_elements : dict
+        Converted diffusing elements solved on the coarse grid
+    spacing : float
+        Voxel size of the grid, in pixels
+    frequency : int, optional
+        MCS between two solver calls (PhysiCell's dt_diffusion). Default 1
+    workers : int, optional
+        Worker processes of the solver. Default 1
+    output_frequency : int, optional
+        MCS between saves of the grids to the output folder. Default None, no output
+
+    Returns
+    -------
+    str
+        The steppable's code
+    """
+    if not coarse_elements:
+        return ''
+    already_imports = not first
+    fields = get_coarse_field_parameters(coarse_elements)
+    stop = "\t\tif self.engine is not None:\n\t\t\tself.engine.close()\n"
+    return generate_steppable("CoarseDiffusion", frequency, False, already_imports=already_imports,
+                              additional_start=make_coarse_diffusion_start(fields, spacing, workers),
+                              additional_step=make_coarse_diffusion_step(output_frequency),
+                              additional_finish=stop, additional_on_stop=stop)
+
+
+if __name__ == "__main__":
+    print(generate_coarse_diffusion_steppable({"oxygen": {"D": 1000, "gamma": 0.01, "initial_condition": "38",
+                                                          "dirichlet": "true", "dirichlet_value": 38}}, 26, 1, 2,
+                                              100))
@@ -33,14 +33,15 @@ def apply_CC3D_constraint(cname, cdict):
 # def apply_phenotype()
 
 
-def cell_type_constraint(ctype, this_type_dicts):
+def cell_type_constraint(ctype, this_type_dicts, type_volumes=False):
     if not this_type_dicts:
         return ''
     loop = f"\t\tfor cell in self.cell_list_by_type(self.{ctype.upper()}):\n"
     full = loop
     for cell_dict in this_type_dicts:
         if "chemotaxis_dict" in cell_dict.keys():
-            line = ""
+            line = "\t\t\t# NOTE: the chemotaxis of this type changes during the original simulation (custom code),\n" \
+                   "\t\t\t# so it is set per cell. You are responsible for updating it as the original model does\n"
             for key, value in cell_dict.items():
                 if key == "chemotaxis_dict":
                     continue
@@ -56,7 +57,10 @@ def cell_type_constraint(ctype, this_type_dicts):
                 line += f"\t\t\t\tcell.dict['{key}']=self.phenotypes['{ctype}']\n"
                 line += f"\t\t\t\tcell.dict['current_phenotype'] = cell.dict['{key}']" \
                         f"['{cell_dict['phenotypes_names'][0]}'].copy()\n"
-                line += f"\t\t\t\tcell.dict['volume_conversion'] = cell.targetVolume / \\\n" \
+                # with type level volumes (Volume plugin) cell.targetVolume isn't set, the type's target is used
+                target = round(cell_dict['volume']["volume (pixels)"]) if type_volumes and 'volume' in \
+                    cell_dict.keys() else "cell.targetVolume"
+                line += f"\t\t\t\tcell.dict['volume_conversion'] = {target} / \\\n" \
                         f"\t\t\t\t\tcell.dict['current_phenotype'].current_phase.volume.total\n"
             elif key == "custom_data":
                 line = f"\t\t\t# NOTE: you are responsible for finding how this data" \
@@ -78,7 +82,7 @@ def cell_type_constraint(ctype, this_type_dicts):
                 line = f"\t\t\tcell.dict['{key}']={clean_value}\n"
             # else:
             #     line = f"\t\t\tcell.dict['{key}']={value}\n"
-            if key in ["volume", "surface"]:
+            if key == "surface" or (key == "volume" and not type_volumes):
                 line += apply_CC3D_constraint(key, value)
             full += line
     return full + '\n\n'
@@ -92,22 +96,23 @@ def get_dicts_for_type(ctype, cell_dicts):
     return ds
 
 
-def generate_constraint_loops(cell_types, cell_dicts):
+def generate_constraint_loops(cell_types, cell_dicts, type_volumes=False):
     loops = "\n"
     for ctype in cell_types:
         this_type_dicts = get_dicts_for_type(ctype, cell_dicts)
-        loop = cell_type_constraint(ctype, this_type_dicts)
+        loop = cell_type_constraint(ctype, this_type_dicts, type_volumes=type_volumes)
         loops += loop
     return loops
 
 
-def initialize_phenotypes(constraint_dict):
+def initialize_phenotypes(constraint_dict, phenotype_frequency=1):
     pheno_str = "\n\t\tif pcp_imp:\n"
     pheno_str += "\t\t\tself.phenotypes = {}\n"
     for ctype, cdict in constraint_dict.items():
         if "phenotypes" in cdict.keys():
 
-            pheno_str += f"\t\t\tdt = 1/self.mcs_to_time\n"
+            # the phenotypes are time-stepped every phenotype_frequency MCS by the phenotype steppable
+            pheno_str += f"\t\t\tdt = {phenotype_frequency}/self.mcs_to_time\n"
             pheno_str += f"\t\t\tself.phenotypes['{ctype}']" + "= {}\n"
             for phenotype, _data in cdict["phenotypes"].items():
                 data = _data
@@ -210,16 +215,28 @@ def initialize_phenotypes(constraint_dict):
     return pheno_str
 
 
-def generate_constraint_steppable(cell_types, cell_type_dicts, wall, first=True, user_data=""):
+def random_streams_start(seed=None):
+    # first thing of the first steppable, PhenoCellPy may draw random numbers when the phenotypes are created
+    start = "\t\t# Seeded random streams (placement, phenotype, motility, division), see\n" \
+            "\t\t# pc2cc3d_runtime.get_random_streams. The PC2CC3D_SEED environment variable overrides the seed.\n" \
+            "\t\t# Draw custom initial conditions and motility from them in blocks, e.g.\n" \
+            "\t\t# self.random_streams['placement'].integers(0, self.dim.x, size=(n_cells, 2))\n"
+    start += f"\t\tself.random_streams = get_random_streams(self, seed={seed}) if runtime_imp else None\n"
+    return start
+
+
+def generate_constraint_steppable(cell_types, cell_type_dicts, wall, first=True, user_data="", type_volumes=False,
+                                  phenotype_frequency=1, seed=None):
     already_imports = not first
-    loops = generate_constraint_loops(cell_types, cell_type_dicts)
+    loops = generate_constraint_loops(cell_types, cell_type_dicts, type_volumes=type_volumes)
     if not wall:
         wall_str = "\t\tself.shared_steppable_vars['constraints'] = self"
     else:
         wall_str = "\t\tself.build_wall(self.WALL)\n\t\tself.shared_steppable_vars['constraints'] = self"
-    pheno_init = initialize_phenotypes(cell_type_dicts[0])
+    pheno_init = initialize_phenotypes(cell_type_dicts[0], phenotype_frequency=phenotype_frequency)
     constraint_step = generate_steppable("Constraints", 1, False, minimal=True, already_imports=already_imports,
-                                         additional_start=pheno_init + loops + wall_str, user_data=user_data)
+                                         additional_start=random_streams_start(seed) + pheno_init + loops + wall_str,
+                                         user_data=user_data)
     return constraint_step
 
 
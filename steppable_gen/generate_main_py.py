@@ -19,9 +19,11 @@ def _register_steppable(step_name):
     return f"CompuCellSetup.register_steppable(steppable={step_name}())\n\n"
 
 
-def _generate_main_py_string(step_file, step_names, read_before_run):
+def _generate_main_py_string(step_file, step_names, read_before_run, run_note=None):
     full = _main_py_header()
     full += '"""\n' + read_before_run + '"""\n'
+    if run_note:
+        full += "".join(f"# {line}\n" for line in run_note.split("\n")) + "\n"
 
     for name in step_names:
         imp = _steppable_import(step_file, name)
@@ -44,11 +46,11 @@ def _write_main_py_file(path, filename, main_string):
         f.write(main_string.replace("\t", "    "))
 
 
-def generate_main_python(path, filename, step_file, step_names, read_before_run):
+def generate_main_python(path, filename, step_file, step_names, read_before_run, run_note=None):
     if ".py" in step_file:
         step_file = step_file.replace(".py", "")
 
-    full_string = _generate_main_py_string(step_file, step_names, read_before_run)
+    full_string = _generate_main_py_string(step_file, step_names, read_before_run, run_note=run_note)
 
     _write_main_py_file(path, filename, full_string)
 
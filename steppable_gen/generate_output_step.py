@@ -0,0 +1,51 @@
+try:
+    from .gen_functions import generate_steppable, mcs_offset_step
+except:
+    from gen_functions import generate_steppable, mcs_offset_step  # see generate_secretion_step.py for why imports
+    # are like this
+
+
+def make_snapshot_store(field_names, chunk_bytes):
+    start = "\t\t# Field snapshots are copied into a chunked, compressed store (see pc2cc3d_runtime.SnapshotStore),\n" \
+            "\t\t# pc2cc3d_runtime.load_snapshot reads a single time slice back\n"
+    start += "\t\tself.snapshots = None\n"
+    start += "\t\tif runtime_imp and self.output_dir is not None:\n"
+    start += f"\t\t\tself.snapshots = SnapshotStore(f'{{self.output_dir}}/field_snapshots', {field_names},\n" \
+             f"\t\t\t\t(self.dim.x, self.dim.y, self.dim.z), chunk_bytes={chunk_bytes})\n"
+    return start
+
+
+def make_field_dumps(field_names):
+    step = "\t\t# Field snapshots scheduled from PhysiCell's full_data save interval. CC3D writes them to the " \
+           "simulation's output folder\n"
+    step += "\t\tif self.output_dir is None:\n\t\t\treturn\n"
+    step += mcs_offset_step()
+    step += "\t\tif self.snapshots is not None:\n"
+    step += f"\t\t\tself.snapshots.add(mcs, {{field_name: getattr(self.field, field_name) for field_name in " \
+            f"{field_names}}})\n"
+    step += "\t\t\treturn\n"
+    step += f"\t\tfor field_name in {field_names}:\n"
+    step += "\t\t\tfield = getattr(self.field, field_name)\n"
+    step += "\t\t\tnp.save(f'{self.output_dir}/{field_name}_{mcs:09d}.npy', np.array(field[:, :, :]))\n"
+    return step
+
+
+def close_snapshot_store():
+    return "\t\tif self.snapshots is not None:\n\t\t\tself.snapshots.close()\n\t\t\tself.snapshots = None\n"
+
+
+def generate_output_steppable(field_names, frequency, first=False, chunk_bytes=32 * 2 ** 20):
+    if not field_names or frequency is None:
+        return ''
+    already_imports = not first
+    field_names = [name.replace(" ", "_") for name in field_names]
+    start = make_snapshot_store(field_names, chunk_bytes)
+    step = make_field_dumps(field_names)
+    out_step = generate_steppable("Output", frequency, False, already_imports=already_imports,
+                                  additional_start=start, additional_step=step,
+                                  additional_finish=close_snapshot_store())
+    return out_step
+
+
+if __name__ == "__main__":
+    print(generate_output_steppable(["oxygen", "director signal"], 20))
@@ -7,7 +7,7 @@ except:
     # does not work when running this file by itself. Second doesn't work when importing the file........................................................................................................................
 
 
-def type_phenotype_step(ctype, this_type_dicts):
+def type_phenotype_step(ctype, this_type_dicts, type_volumes=False, record_population=False):
     if not this_type_dicts:
         return ''
     empty = ''
@@ -19,11 +19,24 @@ def type_phenotype_step(ctype, this_type_dicts):
             full += "\t\t\t\t# WARNING: currently you are responsible for implementing what should happen for each " \
                     "of\n" \
                     "\t\t\t\t# the flags\n"
+            if record_population:
+                full += "\t\t\t\told_phase = cell.dict['current_phenotype'].current_phase.index\n"
             full += f"\t\t\t\tchanged_phase, should_be_removed, divides = \\\n" \
                     f"\t\t\t\t\tcell.dict['current_phenotype'].time_step_phenotype()\n"
+            if record_population:
+                full += "\t\t\t\tif changed_phase and population is not None:\n" \
+                        "\t\t\t\t\tpopulation.phase_changed(cell.type, old_phase, " \
+                        "cell.dict['current_phenotype'].current_phase.index)\n"
             full += "\t\t\t\tif divides:\n\t\t\t\t\tcells_to_divide.append(cell)\n"
-            full += f"\t\t\t\tcell.targetVolume = cell.dict['volume_conversion'] * \\\n" \
-                    f"\t\t\t\t\tcell.dict['current_phenotype'].current_phase.volume.total\n"
+            if type_volumes:
+                full += "\t\t\t\t# NOTE: the target volumes are set per type in the Volume plugin, CC3D ignores\n" \
+                        "\t\t\t\t# cell.targetVolume. Convert with per cell volumes for the phenotype to change\n" \
+                        "\t\t\t\t# them\n" \
+                        "\t\t\t\t# cell.targetVolume = cell.dict['volume_conversion'] * \\\n" \
+                        "\t\t\t\t# \tcell.dict['current_phenotype'].current_phase.volume.total\n"
+            else:
+                full += f"\t\t\t\tcell.targetVolume = cell.dict['volume_conversion'] * \\\n" \
+                        f"\t\t\t\t\tcell.dict['current_phenotype'].current_phase.volume.total\n"
 
 
     if any_pheno:
@@ -32,25 +45,45 @@ def type_phenotype_step(ctype, this_type_dicts):
         return empty
 
 
-def generate_phenotypes_loops(cell_types, cell_dicts):
+def generate_phenotypes_loops(cell_types, cell_dicts, type_volumes=False, record_population=False):
     loops = "\n"
+    if record_population:
+        # counts kept up to date by the phase changes and divisions, see generate_population_step
+        loops += "\t\tpopulation = self.shared_steppable_vars.get('population')\n"
     loops += "\t\tcells_to_divide = []\n\t\tif pcp_imp:\n\t\t\tpass\n"
     for ctype in cell_types:
         this_type_dicts = get_dicts_for_type(ctype, cell_dicts)
-        loop = type_phenotype_step(ctype, this_type_dicts)
+        loop = type_phenotype_step(ctype, this_type_dicts, type_volumes=type_volumes,
+                                   record_population=record_population)
         loops += loop
-    loops += f"\t\t\tfor cell in cells_to_divide:\n\t\t\t\t# WARNING: As cells in CC3D have shape, they can be " \
-             f"divided along their minor/major axis, randomly in half, or along a specific vector\n"
-    loops += "\t\t\t\tself.divide_cell_random_orientation(cell)\n"
-    loops += "\t\t\t\t# self.divide_cell_orientation_vector_based(cell, 1, 1, 0)\n"
+    # the division planes come from the seeded division stream (see pc2cc3d_runtime.get_random_streams), drawn in one
+    # block, instead of CC3D's random number generator
+    loops += "\t\t\tstreams = self.shared_steppable_vars.get('random_streams')\n" \
+             "\t\t\tif streams is not None:\n" \
+             "\t\t\t\tnormals = streams['division'].unit_vectors(len(cells_to_divide),\n" \
+             "\t\t\t\t\t2 if self.dim.z == 1 else 3)\n" \
+             "\t\t\telse:\n" \
+             "\t\t\t\tnormals = [None] * len(cells_to_divide)\n"
+    loops += f"\t\t\tfor cell, normal in zip(cells_to_divide, normals):\n\t\t\t\t# WARNING: As cells in CC3D have " \
+             f"shape, they can be divided along their minor/major axis, randomly in half, or along a specific vector\n"
+    loops += "\t\t\t\tif normal is None:\n\t\t\t\t\tself.divide_cell_random_orientation(cell)\n" \
+             "\t\t\t\telse:\n\t\t\t\t\tself.divide_cell_orientation_vector_based(cell, *normal)\n"
     loops += "\t\t\t\t# self.divide_cell_along_major_axis(cell)\n"
     loops += "\t\t\t\t# self.divide_cell_along_minor_axis(cell)\n"
+    if record_population:
+        loops += "\t\t\t\tif population is not None:\n" \
+                 "\t\t\t\t\tpopulation.cell_added(cell.type, cell.dict['current_phenotype'].current_phase.index)\n"
     return loops
 
 
-def generate_phenotype_steppable(cell_types, cell_dicts, first=False):
+def generate_phenotype_steppable(cell_types, cell_dicts, first=False, type_volumes=False, frequency=1,
+                                 record_population=False):
+    # frequency: MCS between phenotype updates (PhysiCell's dt_phenotype), the phenotypes' dt must match it (see
+    # generate_constraint_step.initialize_phenotypes)
     already_imports = not first
-    loops = generate_phenotypes_loops(cell_types, cell_dicts)
+    loops = generate_phenotypes_loops(cell_types, cell_dicts, type_volumes=type_volumes,
+                                      record_population=record_population)
 
-    pheno_step = generate_steppable("Phenotype", 1, True, already_imports=already_imports, additional_step=loops)
+    pheno_step = generate_steppable("Phenotype", frequency, True, already_imports=already_imports,
+                                    additional_step=loops)
     return pheno_step
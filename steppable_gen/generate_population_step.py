@@ -0,0 +1,56 @@
+try:
+    from .gen_functions import generate_steppable, mcs_offset_step
+except:
+    from gen_functions import generate_steppable, mcs_offset_step  # see generate_secretion_step.py for why imports
+    # are like this
+
+
+def get_phase_counts(cell_types, constraints):
+    # number of phases of the phenotype each type starts with (see generate_constraint_step.cell_type_constraint), as
+    # code: PhenoCellPy's phenotype knows it, the converted data only if PhysiCell defined the phases
+    phases = []
+    for ctype in cell_types:
+        if ctype not in constraints.keys() or not constraints[ctype].get("phenotypes"):
+            continue
+        name = constraints[ctype]["phenotypes_names"][0]
+        data = constraints[ctype]["phenotypes"][name]
+        n_phases = len(data["phase durations"]) if data is not None else 1
+        phases.append(f"'{ctype}': len(self.shared_steppable_vars['constraints'].phenotypes['{ctype}']['{name}']."
+                      f"phases) if pcp_imp else {n_phases}")
+    return "{" + ", ".join(phases) + "}"
+
+
+def make_population_recorder(cell_types, phases):
+    type_names = "{" + ", ".join(f"self.{ctype.upper()}: '{ctype}'" for ctype in cell_types) + "}"
+    start = "\t\t# Cell counts by type and phenotype phase, kept up to date from the cell events instead of looping " \
+            "over\n" \
+            "\t\t# the cells (see pc2cc3d_runtime.PopulationRecorder). Divisions and phase changes of the phenotype\n" \
+            "\t\t# steppable are recorded, record the type changes and removals you add with\n" \
+            "\t\t# self.shared_steppable_vars['population'].type_changed/cell_removed\n"
+    start += "\t\tself.population = None\n"
+    start += "\t\tif runtime_imp and self.output_dir is not None:\n"
+    start += f"\t\t\tself.population = PopulationRecorder(f'{{self.output_dir}}/population.csv', {type_names},\n" \
+             f"\t\t\t\t{phases})\n"
+    start += "\t\t\tself.shared_steppable_vars['population'] = self.population\n"
+    start += "\t\t\tfor cell in self.cell_list:\n"
+    start += "\t\t\t\tphase = cell.dict['current_phenotype'].current_phase.index if 'current_phenotype' in " \
+             "cell.dict.keys() else None\n"
+    start += "\t\t\t\tself.population.cell_added(cell.type, phase)\n"
+    return start
+
+
+def generate_population_steppable(cell_types, constraints, first=False):
+    already_imports = not first
+    cell_types = [ctype for ctype in cell_types if ctype.upper() != "WALL"]
+    if not cell_types:
+        return ''
+    start = make_population_recorder(cell_types, get_phase_counts(cell_types, constraints))
+    step = mcs_offset_step() + "\t\tif self.population is not None:\n\t\t\tself.population.sample(mcs)\n"
+    finish = "\t\tif self.population is not None:\n\t\t\tself.population.close()\n\t\t\tself.population = None\n"
+    return generate_steppable("Population", 1, False, already_imports=already_imports, additional_start=start,
+                              additional_step=step, additional_finish=finish)
+
+
+if __name__ == "__main__":
+    print(generate_population_steppable(["cell", "wall"], {"cell": {"phenotypes": {"Ki67": {"phase durations": [
+        [False, 10], [False, 20]]}}, "phenotypes_names": ["Ki67"]}}))
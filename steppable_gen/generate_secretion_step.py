@@ -41,18 +41,37 @@ def make_secretion_uptake_loop(ctype, comment):
     loop = generate_cell_type_loop(ctype, 3)
     check_field = "\t\t\t\tif field_name in cell.dict.keys():\n\t\t\t\t\tdata=cell.dict[field_name]\n"
     seen = "\t\t\t\t\tseen = secretor.amountSeenByCell(cell)\n"
-    secrete_rate = "\t\t\t\t\tnet_secretion = max(0, data['secretion_rate_MCS'] * (data['secretion_target'] - seen)) + data['net_export_MCS']\n"
+    # the steppable runs every self.frequency MCS (PhysiCell's dt_diffusion), the amounts are per MCS
+    secrete_rate = "\t\t\t\t\tnet_secretion = (max(0, data['secretion_rate_MCS'] * " \
+                   "(data['secretion_target'] - seen)) + data['net_export_MCS']) * self.frequency\n"
     where_secrete = "\t\t\t\t\t# In PhysiCell cells are point-like, in CC3D they have an arbitrary shape. With this " \
                     "\n\t\t\t\t\t# CC3D allows several different secretion locations: over the whole cell (what the " \
                     "translator uses),\n\t\t\t\t\t# just inside the cell surface, just outside the surface, " \
                     "at the surface. You should explore the options\n"
     secrete = "\t\t\t\t\tif net_secretion:\n\t\t\t\t\t\tsecretor.secreteInsideCell(cell, net_secretion)\n"
 
-    uptake = "\t\t\t\t\tif data['uptake_rate']:\n\t\t\t\t\t\t" \
-             "secretor.uptakeInsideCell(cell, 1e10, data['uptake_rate'])\n"
+    uptake = "\t\t\t\t\tif data['uptake_rate_MCS']:\n\t\t\t\t\t\t" \
+             "secretor.uptakeInsideCell(cell, 1e10, min(data['uptake_rate_MCS'] * self.frequency, 1))\n"
     return loop + check_field + seen + comment + secrete_rate + where_secrete + secrete + uptake
 
 
+def make_coarse_secretion(cell_types, sec_dict, coarse_fields):
+    # the coarse grid fields have no secretor, all the cells of a type secrete at once at their voxels
+    types = [ctype for ctype in cell_types if ctype in sec_dict.keys() and
+             any(field_name in coarse_fields for field_name in sec_dict[ctype].keys())]
+    if not types:
+        return ""
+    secretion = "\t\tengine = self.shared_steppable_vars.get('coarse_diffusion')\n"
+    secretion += "\t\tif engine is not None:\n"
+    secretion += "\t\t\t# PhysiCell's implicit secretion and uptake on the coarse grid, see " \
+                 "pc2cc3d_runtime.CoarseDiffusion.secrete\n"
+    secretion += "\t\t\tfor field_name in engine.field_names:\n"
+    for ctype in types:
+        secretion += f"\t\t\t\tengine.secrete_cells(field_name, self.cell_list_by_type(self.{ctype.upper()}), " \
+                     f"dt=self.frequency)\n"
+    return secretion
+
+
 def make_secretion_uptake_loops(cell_types, sec_dict):
     secretor_loop = "\t\tfor field_name, secretor in self.secretors.items():\n"
 
@@ -65,7 +84,7 @@ def make_secretion_uptake_loops(cell_types, sec_dict):
     return secretor_loop + loops
 
 
-def generate_secretion_uptake_step(cell_types, sec_dict, secretion_dt=None, first=False):
+def generate_secretion_uptake_step(cell_types, sec_dict, secretion_dt=None, first=False, coarse_fields=()):
     if not sec_dict:
         message = "WARNING: no secretion data found\n"
         warnings.warn(message)
@@ -76,11 +95,15 @@ def generate_secretion_uptake_step(cell_types, sec_dict, secretion_dt=None, firs
 
     already_imports = not first
 
-    field_names = get_field_names(sec_dict)
+    field_names = [name for name in get_field_names(sec_dict) if name not in coarse_fields]
+    lattice_dict = {ctype: {name: data for name, data in fields.items() if name not in coarse_fields}
+                    for ctype, fields in sec_dict.items()}
+    lattice_dict = {ctype: fields for ctype, fields in lattice_dict.items() if fields}
 
-    secretors = make_secretors(field_names)
+    secretors = make_secretors(field_names) if field_names else "\t\tself.secretors = {}\n"
 
-    loops = make_secretion_uptake_loops(cell_types, sec_dict)
+    loops = make_secretion_uptake_loops(cell_types, lattice_dict) if lattice_dict else ""
+    loops += make_coarse_secretion(cell_types, sec_dict, coarse_fields)
 
     sec_step = generate_steppable("SecretionUptake", secretion_dt, False, already_imports=already_imports,
                                   additional_start=secretors, additional_step=loops)
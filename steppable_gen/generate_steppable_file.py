@@ -1,5 +1,6 @@
 from pathlib import Path
 from os.path import join, isdir
+from shutil import copyfile
 
 
 def generate_steppable_file(path, steppable_fname, steppable_string):
@@ -12,6 +13,13 @@ def generate_steppable_file(path, steppable_fname, steppable_string):
         f.write(steppable_string.replace("\t", "    "))
 
 
+def copy_runtime(path):
+    """
+    Copies the runtime support module (pc2cc3d_runtime.py, background writers) next to the generated steppables
+    """
+    copyfile(Path(__file__).parent.joinpath("pc2cc3d_runtime.py"), join(path, "pc2cc3d_runtime.py"))
+
+
 if __name__ == "__main__":
     steppable_string = """
 from cc3d.cpp.PlayerPython import *
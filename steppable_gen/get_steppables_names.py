@@ -1,13 +1,27 @@
+import re
+
+
+_class_statement = re.compile(r"^class\s+(\w*Steppable\w*)\s*\(", flags=re.MULTILINE)
+
 
 def get_steppables_names(step_string):
-    parts = step_string.split("class")
+    # class statements only, the word "import" or "class" anywhere else in a steppable's code must not hide it
+    return _class_statement.findall(step_string)
 
-    step_names = []
 
-    for part in parts:
-        if "Steppable" in part and "import" not in part:
-            name = part.split("\n")[0].split("(")[0].replace(" ", "")
-            step_names.append(name)
+def get_per_cell_steppables(step_string):
+    """
+    Names of the steppables whose step method loops over the cells. They run serially in Python every `frequency`
+    MCS, however many processors CC3D uses.
+    """
+    matches = list(_class_statement.finditer(step_string))
+    step_names = []
+    for match, end in zip(matches, [m.start() for m in matches[1:]] + [len(step_string)]):
+        part = step_string[match.end():end]
+        if "def step(" in part:
+            step_body = part.split("def step(")[1].split("\tdef ")[0]
+            if "for cell in" in step_body:
+                step_names.append(match.group(1))
     return step_names
 
 
@@ -0,0 +1,1103 @@
+"""
+Runtime support for simulations converted from PhysiCell. The converter copies this file next to the generated
+steppables, it only depends on the standard library and numpy.
+
+Writing from a steppable blocks the simulation until the data is on disk. AsyncWriter moves the writes to a background
+thread: steppables enqueue lightweight records, the thread batches them and writes each batch at once. The simulation
+only waits if the queue is full.
+
+    self.writer = get_writer(f"{self.output_dir}/my_data.csv", owner=self, header="mcs,n_cells")
+    ...
+    self.writer.write((mcs, len(self.cell_list)))
+
+Writers are shared by path (several steppables can write to the same file). The generated steppables call
+close_writers(self) from finish(), which closes a writer once every steppable that owns it has finished. Writers
+without an owner are closed at exit.
+
+PopulationRecorder keeps per type and per phase cell counts up to date from cell events and samples them into a ring
+buffer, flushed in batches by an AsyncWriter.
+
+save_checkpoint and load_checkpoint serialize the state CC3D doesn't (cell lattice, fields, cell attributes and
+cell.dict including PhenoCellPy phenotypes, chemotaxis lambdas and FPP links) so a run can be restarted, and
+run_segments runs a long simulation as a series of restartable segments.
+
+get_random_streams gives a simulation seeded, independent random streams per purpose (placement, phenotype, motility,
+division), spawned from one seed and drawn in blocks, so runs are reproducible.
+
+CoarseDiffusion solves selected fields on a grid as coarse as PhysiCell's microenvironment mesh, split into slabs
+solved by worker processes over shared memory, instead of on the cell lattice.
+
+StepProfiler times the start/step/finish calls of a steppable and counts the cells it visits, for the profiling hooks
+the converter adds with --profile.
+
+SnapshotStore saves field snapshots in chunks (compressed .npz, or .npy segments that can be memory-mapped) with an
+index, written in the background by an AsyncWriter. load_snapshot reads a single time slice back.
+"""
+import argparse
+import atexit
+import cProfile
+import csv
+import multiprocessing
+import os
+import pickle
+import queue
+import subprocess
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+_STOP = object()
+
+
+def format_record(record, separator=","):
+    """
+    Formats a record as one line: strings are written as is, other iterables are joined by `separator`
+    """
+    if isinstance(record, str):
+        return record if record.endswith("\n") else record + "\n"
+    return separator.join(str(value) for value in record) + "\n"
+
+
+class AsyncWriter:
+    """
+    Writes records to a file from a background thread.
+
+    Records are put in a bounded queue. The writer thread waits for a record, then takes up to `batch_size` of those
+    already queued and writes them with a single write call, flushing the file at least every `flush_interval`
+    seconds. Besides text records (see format_record) the writer accepts callables, called in the writer thread with
+    the open file, which lets binary data (e.g. numpy arrays) be written in the background too.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Output file
+    header : str, optional
+        First line, only written if the file is new or empty
+    max_queue : int, optional
+        Largest number of queued records, `write` blocks when it is reached. Default 10000
+    batch_size : int, optional
+        Largest number of records per write. Default 1000
+    flush_interval : float, optional
+        Longest time (seconds) between flushes. Default 1
+    separator : str, optional
+        Separator of the values of a record. Default ","
+    binary : bool, optional
+        Open the file in binary mode (only callables can be written). Default False
+    """
+
+    def __init__(self, path, header=None, max_queue=10000, batch_size=1000, flush_interval=1.0, separator=",",
+                 binary=False):
+        self.path = str(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.separator = separator
+        self.binary = binary
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.closed = False
+
+        self.file = open(self.path, "ab" if binary else "a")
+        if header is not None and not binary and self.file.tell() == 0:
+            self.file.write(format_record(header, separator))
+
+        self.thread = threading.Thread(target=self._run, name=f"AsyncWriter({self.path})", daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        """
+        Enqueues a record (str, iterable of values, or callable taking the open file). Blocks only if the queue is
+        full.
+        """
+        if self.closed:
+            raise ValueError(f"{self.path} writer is closed")
+        if self.error is not None:
+            raise RuntimeError(f"{self.path} writer failed") from self.error
+        self.queue.put(record)
+
+    def _write_batch(self, batch):
+        text = []
+        for record in batch:
+            if callable(record):
+                if text:
+                    self.file.write("".join(text))
+                    text = []
+                record(self.file)
+            else:
+                text.append(format_record(record, self.separator))
+        if text:
+            self.file.write("".join(text))
+
+    def _run(self):
+        running = True
+        while running:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self.file.flush()
+                continue
+            batch = []
+            while True:
+                if record is _STOP:
+                    running = False
+                    break
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # reported to the simulation thread on the next write
+                self.error = e
+        self.file.flush()
+
+    def close(self):
+        """
+        Writes the queued records and closes the file
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_writers = {}
+# {path: ids of the steppables using the writer}
+_writer_owners = {}
+
+
+def get_writer(path, owner=None, **kwargs):
+    """
+    Returns the open writer of `path`, opening one (see AsyncWriter for the arguments) if needed, and records `owner`
+    (usually the calling steppable) as one of its users. A closed writer is reopened in append mode.
+    """
+    path = str(path)
+    if path not in _writers.keys() or _writers[path].closed:
+        _writers[path] = AsyncWriter(path, **kwargs)
+    if owner is not None:
+        _writer_owners.setdefault(path, set()).add(id(owner))
+    return _writers[path]
+
+
+def close_writers(owner=None):
+    """
+    Releases the writers of `owner`, closing those no other owner uses. Without `owner` closes every writer opened by
+    get_writer
+    """
+    for path, writer in _writers.items():
+        if owner is None:
+            writer.close()
+            continue
+        owners = _writer_owners.get(path)
+        if owners and id(owner) in owners:
+            owners.discard(id(owner))
+            if not owners:
+                writer.close()
+    if owner is None:
+        _writer_owners.clear()
+
+
+atexit.register(close_writers)
+
+
+class SnapshotStore:
+    """
+    Chunked store of field snapshots.
+
+    Each snapshot is copied into a buffer of time slices per field, as many as fit in `chunk_bytes` (at most
+    `chunk_size`, at least one), allocated when the first snapshot of a chunk arrives. Full buffers are handed to a
+    background writer and saved as one chunk: chunk_<n>.npz (compressed, one array per field) or, without
+    compression, chunk_<n>_<field>.npy, which load_snapshot memory-maps to read a single slice. index.csv maps each
+    MCS to its chunk and slot.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        Folder of the store, created if needed
+    field_names : list
+        Names of the fields
+    shape : tuple
+        Shape of a snapshot, e.g. the lattice dimensions (x, y, z)
+    chunk_size : int, optional
+        Largest number of snapshots per chunk. Default 16
+    chunk_bytes : int, optional
+        Largest size of the buffer of a field, in bytes. Default 32 MiB
+    compress : bool, optional
+        Save compressed .npz chunks, otherwise .npy segments. Default True
+    dtype : numpy.dtype, optional
+        Type the snapshots are stored as. Default float32
+    """
+
+    def __init__(self, directory, field_names, shape, chunk_size=16, chunk_bytes=32 * 2 ** 20, compress=True,
+                 dtype=np.float32):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.field_names = list(field_names)
+        self.shape = tuple(shape)
+        frame_bytes = int(np.prod(self.shape)) * np.dtype(dtype).itemsize
+        self.chunk_size = max(min(chunk_size, chunk_bytes // max(frame_bytes, 1)), 1)
+        self.compress = compress
+        self.dtype = dtype
+        self.chunk = 0
+        self.slot = 0
+        self.mcs = []
+        self.buffers = None
+        self.writer = AsyncWriter(self.directory.joinpath("index.csv"), header="mcs,chunk,slot", max_queue=64)
+
+    def _allocate(self):
+        return {name: np.empty((self.chunk_size,) + self.shape, dtype=self.dtype) for name in self.field_names}
+
+    def add(self, mcs, fields):
+        """
+        Copies a snapshot of the fields ({name: array-like with the snapshot shape}) into the buffer
+        """
+        if self.buffers is None:
+            self.buffers = self._allocate()
+        for name in self.field_names:
+            values = fields[name]
+            if not isinstance(values, np.ndarray):
+                values = values[tuple(slice(None) for _ in self.shape)]
+            self.buffers[name][self.slot] = np.reshape(values, self.shape)
+        self.mcs.append(mcs)
+        self.slot += 1
+        if self.slot == self.chunk_size:
+            self.flush()
+
+    def _save_chunk(self, chunk, buffers, n):
+        def save(_):
+            if self.compress:
+                np.savez_compressed(self.directory.joinpath(f"chunk_{chunk:06d}.npz"),
+                                    **{name: data[:n] for name, data in buffers.items()})
+            else:
+                for name, data in buffers.items():
+                    np.save(self.directory.joinpath(f"chunk_{chunk:06d}_{name}.npy"), data[:n])
+        return save
+
+    def flush(self):
+        """
+        Hands the buffered snapshots to the background writer
+        """
+        if not self.slot:
+            return
+        self.writer.write(self._save_chunk(self.chunk, self.buffers, self.slot))
+        for slot, mcs in enumerate(self.mcs):
+            self.writer.write((mcs, self.chunk, slot))
+        self.chunk += 1
+        self.slot = 0
+        self.mcs = []
+        # the writer thread owns the full buffers now, the next snapshot allocates new ones
+        self.buffers = None
+
+    def close(self):
+        """
+        Saves the remaining snapshots and waits for the writer
+        """
+        self.flush()
+        self.writer.close()
+
+
+def read_snapshot_index(directory):
+    """
+    Returns {mcs: (chunk, slot)} of a SnapshotStore
+    """
+    index = {}
+    with open(Path(directory).joinpath("index.csv"), "r") as f:
+        for row in csv.DictReader(f):
+            index[int(row["mcs"])] = (int(row["chunk"]), int(row["slot"]))
+    return index
+
+
+def load_snapshot(directory, field_name, mcs, index=None):
+    """
+    Reads the snapshot of `field_name` at `mcs` from a SnapshotStore. Only its chunk is read, and only the slice itself
+    for uncompressed (memory-mapped .npy) stores.
+    """
+    directory = Path(directory)
+    if index is None:
+        index = read_snapshot_index(directory)
+    chunk, slot = index[mcs]
+    segment = directory.joinpath(f"chunk_{chunk:06d}_{field_name}.npy")
+    if segment.exists():
+        return np.array(np.load(segment, mmap_mode="r")[slot])
+    with np.load(directory.joinpath(f"chunk_{chunk:06d}.npz")) as data:
+        return data[field_name][slot]
+
+
+class PopulationRecorder:
+    """
+    Per-MCS cell counts by type and phenotype phase.
+
+    The counts are updated incrementally (cell_added, cell_removed, phase_changed, type_changed) when cells change
+    instead of looping over the cells. `sample` copies them into a fixed-size ring buffer, every `capacity` samples the
+    buffer is flushed to a csv file (one column per count) as a single block by a background writer. `recent` returns
+    the last samples for live monitoring.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Output csv file
+    type_names : dict
+        {CC3D type ID: type name}
+    phases : dict, optional
+        {type name: number of phenotype phases}, types with phases get a "<type>_phase_<index>" column per phase
+    capacity : int, optional
+        Number of samples kept in the ring buffer. Default 1024
+    """
+
+    def __init__(self, path, type_names, phases=None, capacity=1024):
+        self.type_names = dict(type_names)
+        self.columns = list(self.type_names.values())
+        for ctype, n_phases in (phases or {}).items():
+            self.columns += [f"{ctype}_phase_{i}" for i in range(n_phases)]
+        self.index = {column: i for i, column in enumerate(self.columns)}
+        self.counts = np.zeros(len(self.columns), dtype=np.int64)
+        self.capacity = capacity
+        self.buffer = np.zeros((capacity, len(self.columns) + 1), dtype=np.int64)
+        self.n_samples = 0
+        self.n_flushed = 0
+        self.writer = AsyncWriter(path, header="mcs," + ",".join(self.columns), max_queue=16)
+
+    def _change(self, column, n):
+        if column in self.index.keys():
+            self.counts[self.index[column]] += n
+
+    def _phase_column(self, type_id, phase):
+        return f"{self.type_names.get(type_id)}_phase_{phase}"
+
+    def cell_added(self, type_id, phase=None):
+        self._change(self.type_names.get(type_id), 1)
+        if phase is not None:
+            self._change(self._phase_column(type_id, phase), 1)
+
+    def cell_removed(self, type_id, phase=None):
+        self._change(self.type_names.get(type_id), -1)
+        if phase is not None:
+            self._change(self._phase_column(type_id, phase), -1)
+
+    def phase_changed(self, type_id, old_phase, new_phase):
+        self._change(self._phase_column(type_id, old_phase), -1)
+        self._change(self._phase_column(type_id, new_phase), 1)
+
+    def type_changed(self, old_type_id, new_type_id, old_phase=None, new_phase=None):
+        self.cell_removed(old_type_id, old_phase)
+        self.cell_added(new_type_id, new_phase)
+
+    def sample(self, mcs):
+        """
+        Records the current counts
+        """
+        row = self.buffer[self.n_samples % self.capacity]
+        row[0] = mcs
+        row[1:] = self.counts
+        self.n_samples += 1
+        if self.n_samples - self.n_flushed == self.capacity:
+            self.flush()
+
+    def recent(self, n=None):
+        """
+        Returns the last `n` (at most `capacity`) samples, oldest first, as a (samples, 1 + columns) array
+        """
+        n = min(self.n_samples, self.capacity) if n is None else min(n, self.n_samples, self.capacity)
+        rows = [(self.n_samples - n + i) % self.capacity for i in range(n)]
+        return self.buffer[rows]
+
+    def flush(self):
+        """
+        Hands the samples not yet written to the background writer
+        """
+        n = self.n_samples - self.n_flushed
+        if not n:
+            return
+        block = self.recent(n)
+
+        def save(f):
+            np.savetxt(f, block, fmt="%d", delimiter=",")
+        self.writer.write(save)
+        self.n_flushed = self.n_samples
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class StepProfiler:
+    """
+    Aggregates the wall time of a steppable's calls and the number of cells it visits, in memory, and reports them at
+    the end of the simulation.
+
+    Parameters
+    ----------
+    name : str
+        Steppable name
+    output_dir : str, optional
+        Folder of the report (profile_<name>.csv and, with cProfile sampling, profile_<name>.prof). Default None,
+        the summary is only printed
+    profile_every : int, optional
+        Run every profile_every-th step under cProfile (the samples are accumulated in one profile). Default None, no
+        cProfile
+    """
+
+    def __init__(self, name, output_dir=None, profile_every=None):
+        self.name = name
+        self.output_dir = output_dir
+        self.profile_every = profile_every
+        self.profile = cProfile.Profile() if profile_every else None
+        # {method: [calls, total seconds, longest call]}
+        self.calls = {}
+        # {cell types: cells visited}
+        self.visited = {}
+        self.type_names = {}
+        self.n_steps = 0
+
+    def set_type_names(self, steppable):
+        """
+        Reads the type IDs (the upper case attributes) of a steppable to name them in the report
+        """
+        for attribute in dir(steppable):
+            if attribute.isupper():
+                value = getattr(steppable, attribute, None)
+                if isinstance(value, int):
+                    self.type_names[value] = attribute
+
+    @contextmanager
+    def measure(self, method, mcs=None):
+        sample = self.profile is not None and mcs is not None and mcs % self.profile_every == 0
+        if sample:
+            self.profile.enable()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            if sample:
+                self.profile.disable()
+            calls = self.calls.setdefault(method, [0, 0.0, 0.0])
+            calls[0] += 1
+            calls[1] += elapsed
+            calls[2] = max(calls[2], elapsed)
+            if mcs is not None:
+                self.n_steps += 1
+
+    def visit(self, types, cells):
+        """
+        Counts the cells of a cell_list_by_type(*types) call
+        """
+        self.visited[types] = self.visited.get(types, 0) + len(cells)
+
+    def summary(self):
+        lines = [f"{self.name}:"]
+        for method, (calls, total, longest) in self.calls.items():
+            lines.append(f"\t{method}: {calls} calls, {total:.4g} s, {1e3 * total / max(calls, 1):.4g} ms/call, "
+                         f"longest {1e3 * longest:.4g} ms")
+        for types, count in self.visited.items():
+            names = ",".join(self.type_names.get(t, str(t)) for t in types)
+            lines.append(f"\t{names}: {count} cells visited, {count / max(self.n_steps, 1):.4g}/step")
+        return "\n".join(lines)
+
+    def report(self):
+        """
+        Prints the summary and writes it to the output folder
+        """
+        print(self.summary())
+        if self.output_dir is None:
+            return
+        with open(Path(self.output_dir).joinpath(f"profile_{self.name}.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("method", "calls", "total_s", "mean_ms", "longest_ms"))
+            for method, (calls, total, longest) in self.calls.items():
+                writer.writerow((method, calls, total, 1e3 * total / max(calls, 1), 1e3 * longest))
+            writer.writerow(())
+            writer.writerow(("types", "cells_visited", "per_step"))
+            for types, count in self.visited.items():
+                writer.writerow((";".join(self.type_names.get(t, str(t)) for t in types), count,
+                                 count / max(self.n_steps, 1)))
+        if self.profile is not None:
+            self.profile.dump_stats(str(Path(self.output_dir).joinpath(f"profile_{self.name}.prof")))
+
+
+# purposes of the random streams of a simulation, each gets its own generator
+RANDOM_STREAMS = ("placement", "phenotype", "motility", "division")
+
+
+class RandomStream:
+    """
+    Random numbers for one purpose, drawn from its own numpy Generator in blocks of `block_size`.
+
+    Scalar draws are served from the current block, so a loop drawing one number per cell costs one Generator call per
+    block instead of one per cell. Arrays (`size`) are served from the block too, larger ones are drawn directly. The
+    sequence only depends on the seed and on the order of the draws.
+
+    Parameters
+    ----------
+    generator : numpy.random.Generator
+        The stream's generator
+    block_size : int, optional
+        Number of values drawn at once. Default 4096
+    """
+
+    def __init__(self, generator, block_size=4096):
+        self.generator = generator
+        self.block_size = block_size
+        self._blocks = {"uniform": (np.empty(0), 0), "normal": (np.empty(0), 0)}
+
+    def _take(self, kind, size):
+        n = 1 if size is None else int(np.prod(size))
+        block, position = self._blocks[kind]
+        if position + n > len(block):
+            draw = self.generator.random if kind == "uniform" else self.generator.standard_normal
+            if n > self.block_size:
+                return draw(n).reshape(size)
+            block, position = np.concatenate((block[position:], draw(self.block_size))), 0
+        self._blocks[kind] = (block, position + n)
+        values = block[position:position + n]
+        return float(values[0]) if size is None else values.reshape(size)
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        return low + (high - low) * self._take("uniform", size)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        return loc + scale * self._take("normal", size)
+
+    def integers(self, low, high, size=None):
+        """
+        Integers in [low, high), like Generator.integers
+        """
+        values = np.floor(low + (high - low) * self._take("uniform", size))
+        return int(values) if size is None else values.astype(int)
+
+    def unit_vectors(self, n, dims=3):
+        """
+        `n` random directions as a (n, 3) array, in the xy plane if `dims` is 2
+        """
+        vectors = self.normal(size=(n, 3))
+        if dims == 2:
+            vectors[:, 2] = 0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+
+def get_random_streams(steppable, seed=None):
+    """
+    Returns the simulation's random streams ({purpose: RandomStream}, see RANDOM_STREAMS), creating them on the first
+    call and sharing them through shared_steppable_vars['random_streams'].
+
+    The streams are spawned from one numpy SeedSequence: the PC2CC3D_SEED environment variable if it is set (e.g. by
+    the ensemble runner), otherwise `seed`, otherwise fresh entropy. The seed used is printed and kept in
+    shared_steppable_vars['random_seed'] so any run can be repeated. numpy's global generator is seeded from the same
+    sequence, so the libraries drawing from it (PhenoCellPy's phase transitions) are reproducible too.
+    """
+    streams = steppable.shared_steppable_vars.get("random_streams")
+    if streams is not None:
+        return streams
+    if os.environ.get("PC2CC3D_SEED"):
+        seed = int(os.environ["PC2CC3D_SEED"])
+    sequence = np.random.SeedSequence(seed)
+    children = sequence.spawn(len(RANDOM_STREAMS) + 1)
+    streams = {name: RandomStream(np.random.default_rng(child)) for name, child in zip(RANDOM_STREAMS, children)}
+    np.random.seed(children[-1].generate_state(1)[0])
+    steppable.shared_steppable_vars["random_streams"] = streams
+    steppable.shared_steppable_vars["random_seed"] = sequence.entropy
+    print(f"Random seed: {sequence.entropy}")
+    return streams
+
+
+def _diffuse_slab(current, target, start, stop, coefficients, decay, dirichlet):
+    """
+    One explicit diffusion and decay step of fields[:, start:stop] (no flux boundaries), from `current` to `target`
+    """
+    nx = current.shape[1]
+    lo, hi = max(start - 1, 0), min(stop + 1, nx)
+    # edge padding mirrors the boundary voxels, so no flux crosses the domain faces (and none along z in 2D)
+    block = np.pad(current[:, lo:hi], [(0, 0), (int(start == 0), int(stop == nx)), (1, 1), (1, 1)], mode="edge")
+    center = block[:, 1:-1, 1:-1, 1:-1]
+    laplacian = block[:, 2:, 1:-1, 1:-1] + block[:, :-2, 1:-1, 1:-1] + block[:, 1:-1, 2:, 1:-1] + \
+        block[:, 1:-1, :-2, 1:-1] + block[:, 1:-1, 1:-1, 2:] + block[:, 1:-1, 1:-1, :-2] - 6 * center
+    target[:, start:stop] = (center + coefficients[:, None, None, None] * laplacian) * decay[:, None, None, None]
+    for index, value in dirichlet:
+        slab = target[index, start:stop]
+        slab[:, [0, -1], :] = value
+        if slab.shape[2] > 1:
+            slab[:, :, [0, -1]] = value
+        if start == 0:
+            slab[0] = value
+        if stop == nx:
+            slab[-1] = value
+
+
+def _coarse_worker(memory_names, shape, start, stop, coefficients, decay, dirichlet, barrier, connection):
+    memories = [shared_memory.SharedMemory(name=name) for name in memory_names]
+    buffers = [np.ndarray(shape, dtype=np.float64, buffer=memory.buf) for memory in memories]
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        current, substeps = message
+        for _ in range(substeps):
+            _diffuse_slab(buffers[current], buffers[1 - current], start, stop, coefficients, decay, dirichlet)
+            # every slab must be done before the next step reads its neighbors' boundaries
+            barrier.wait()
+            current = 1 - current
+        connection.send(current)
+    del buffers
+    for memory in memories:
+        memory.close()
+
+
+class CoarseDiffusion:
+    """
+    Diffusing fields solved on a grid coarser than the cell lattice (e.g. PhysiCell's microenvironment mesh) with an
+    explicit finite difference scheme, no flux or Dirichlet boundaries.
+
+    The fields are sub-stepped to stay stable on the coarse grid. With `workers` > 1 the grid is split into slabs along
+    x, each solved by a worker process over shared memory. The cell lattice only meets the grid through secrete and
+    sense, which map the cells' centers of mass to their voxels.
+
+    Parameters
+    ----------
+    fields : dict
+        {name: {"D": diffusion constant (pixel^2/MCS), "decay": decay constant (1/MCS), "initial": initial value,
+        "dirichlet": boundary value, None for no flux}}
+    lattice_shape : tuple
+        Dimensions of the cell lattice (x, y, z)
+    spacing : float
+        Size of a grid voxel, in pixels
+    workers : int, optional
+        Number of worker processes. Default 1, solved in the simulation's process
+    """
+
+    def __init__(self, fields, lattice_shape, spacing, workers=1):
+        self.field_names = list(fields.keys())
+        self.index = {name: i for i, name in enumerate(self.field_names)}
+        self.lattice_shape = tuple(lattice_shape)
+        self.spacing = max(float(spacing), 1.0)
+        self.grid_shape = tuple(max(int(np.ceil(s / self.spacing)), 1) for s in self.lattice_shape)
+        self.n_dims = 3 if self.grid_shape[2] > 1 else 2
+        self.voxel_volume = self.spacing ** self.n_dims
+        shape = (len(self.field_names),) + self.grid_shape
+
+        D = np.array([float(fields[name]["D"]) for name in self.field_names])
+        decay = np.array([float(fields[name].get("decay", 0)) for name in self.field_names])
+        # explicit stability: D dt / dx^2 <= 1 / (2 dims), with a margin
+        self.substeps = max(int(np.ceil(2 * self.n_dims * D.max(initial=0) / self.spacing ** 2 / 0.9)), 1)
+        coefficients = D / self.substeps / self.spacing ** 2
+        decay = np.exp(-decay / self.substeps)
+        dirichlet = [(self.index[name], float(data["dirichlet"])) for name, data in fields.items()
+                     if data.get("dirichlet") is not None]
+        self._solver = (coefficients, decay, dirichlet)
+
+        self.workers = max(min(int(workers), self.grid_shape[0]), 1)
+        self.memories = []
+        self.processes = []
+        self.connections = []
+        if self.workers > 1:
+            size = int(np.prod(shape)) * 8
+            self.memories = [shared_memory.SharedMemory(create=True, size=size) for _ in range(2)]
+            self.buffers = [np.ndarray(shape, dtype=np.float64, buffer=memory.buf) for memory in self.memories]
+            context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods()
+                                                  else "spawn")
+            barrier = context.Barrier(self.workers)
+            for slab in np.array_split(np.arange(self.grid_shape[0]), self.workers):
+                parent, child = context.Pipe()
+                process = context.Process(target=_coarse_worker, daemon=True,
+                                          args=([memory.name for memory in self.memories], shape, int(slab[0]),
+                                                int(slab[-1]) + 1, coefficients, decay, dirichlet, barrier, child))
+                process.start()
+                self.processes.append(process)
+                self.connections.append(parent)
+            atexit.register(self.close)
+        else:
+            self.buffers = [np.zeros(shape), np.zeros(shape)]
+        self.current = 0
+        for name, data in fields.items():
+            self.field(name)[...] = float(data.get("initial", 0))
+            self._apply_dirichlet(name, data.get("dirichlet"))
+
+    def _apply_dirichlet(self, name, value):
+        if value is None:
+            return
+        field = self.field(name)
+        field[[0, -1]] = value
+        field[:, [0, -1]] = value
+        if self.n_dims == 3:
+            field[:, :, [0, -1]] = value
+
+    def field(self, name):
+        """
+        The grid of a field, (x, y, z) voxels. Writing to it changes the field
+        """
+        return self.buffers[self.current][self.index[name]]
+
+    def step(self, mcs=1):
+        """
+        Advances the fields by `mcs` MCS
+        """
+        substeps = self.substeps * int(mcs)
+        if not substeps:
+            return
+        if self.processes:
+            for connection in self.connections:
+                connection.send((self.current, substeps))
+            self.current = [connection.recv() for connection in self.connections][0]
+            return
+        coefficients, decay, dirichlet = self._solver
+        for _ in range(substeps):
+            _diffuse_slab(self.buffers[self.current], self.buffers[1 - self.current], 0, self.grid_shape[0],
+                          coefficients, decay, dirichlet)
+            self.current = 1 - self.current
+
+    def voxels(self, positions):
+        """
+        Flat indices of the voxels of lattice `positions` ((n, 3) array-like, in pixels)
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        indices = np.clip((positions / self.spacing).astype(int), 0, np.array(self.grid_shape) - 1)
+        return np.ravel_multi_index(indices.T, self.grid_shape)
+
+    def sense(self, name, positions):
+        """
+        Values of a field at lattice `positions`
+        """
+        return self.field(name).reshape(-1)[self.voxels(positions)]
+
+    def sense_cell(self, name, cell):
+        return float(self.sense(name, (cell.xCOM, cell.yCOM, cell.zCOM))[0])
+
+    def secrete(self, name, positions, volumes, secretion_rates=0, targets=0, uptake_rates=0, net_exports=0, dt=1):
+        """
+        Secretion and uptake of cells at lattice `positions`, with PhysiCell's implicit bulk update of each voxel:
+
+            c <- (c + dt * sum(V/V_voxel * (S * T + E))) / (1 + dt * sum(V/V_voxel * (S + U)))
+
+        Parameters
+        ----------
+        name : str
+            The field
+        positions : array-like
+            (n, 3) centers of mass of the cells, in pixels
+        volumes : array-like
+            Volumes of the cells, in pixels
+        secretion_rates, targets, uptake_rates, net_exports : array-like or float
+            Per cell S (1/MCS), T, U (1/MCS) and E (concentration/MCS)
+        dt : float, optional
+            MCS since the last call. Default 1
+        """
+        voxels = self.voxels(positions)
+        ratio = np.asarray(volumes, dtype=float) / self.voxel_volume
+        secretion_rates = np.broadcast_to(np.asarray(secretion_rates, dtype=float), ratio.shape)
+        source = np.bincount(voxels, weights=dt * ratio * (secretion_rates * targets + net_exports),
+                             minlength=int(np.prod(self.grid_shape)))
+        sink = np.bincount(voxels, weights=dt * ratio * (secretion_rates + uptake_rates),
+                           minlength=int(np.prod(self.grid_shape)))
+        field = self.field(name).reshape(-1)
+        np.maximum((field + source) / (1 + sink), 0, out=field)
+
+    def secrete_cells(self, name, cells, dt=1):
+        """
+        secrete for CC3D cells, with the converted secretion parameters of their cell.dict[name]
+        """
+        cells = [cell for cell in cells if name in cell.dict.keys()]
+        if not cells:
+            return
+        data = [cell.dict[name] for cell in cells]
+        self.secrete(name, [(cell.xCOM, cell.yCOM, cell.zCOM) for cell in cells], [cell.volume for cell in cells],
+                     [d['secretion_rate_MCS'] for d in data], [d['secretion_target'] for d in data],
+                     [d['uptake_rate_MCS'] for d in data], [d['net_export_MCS'] for d in data], dt=dt)
+
+    def to_lattice(self, name):
+        """
+        A field at the lattice resolution (each voxel repeated over its pixels), e.g. for visualization
+        """
+        field = self.field(name)
+        repeats = int(np.ceil(self.spacing))
+        upsampled = field.repeat(repeats, axis=0).repeat(repeats, axis=1)
+        if self.n_dims == 3:
+            upsampled = upsampled.repeat(repeats, axis=2)
+        return upsampled[:self.lattice_shape[0], :self.lattice_shape[1], :self.lattice_shape[2]]
+
+    def save(self, directory, mcs):
+        """
+        Saves the grids to `directory`/<field>_<mcs>.npy
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in self.field_names:
+            np.save(directory.joinpath(f"{name.replace(' ', '_')}_{mcs:09d}.npy"), self.field(name))
+
+    def get_state(self):
+        return np.array(self.buffers[self.current])
+
+    def set_state(self, values):
+        self.buffers[self.current][...] = values
+
+    def close(self):
+        """
+        Stops the worker processes and frees the shared memory
+        """
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+        if self.memories:
+            self.buffers = [np.array(buffer) for buffer in self.buffers]
+        for memory in self.memories:
+            memory.close()
+            memory.unlink()
+        self.memories = []
+
+
+def rle_encode(array):
+    """
+    Run-length encodes an array (flattened in Fortran order, x fastest)
+
+    Returns
+    -------
+    values, lengths : numpy.ndarray
+        Value and length of each run
+    """
+    flat = np.ravel(array, order="F")
+    if not flat.size:
+        return flat, np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.concatenate((starts, [flat.size])))
+    return flat[starts], lengths
+
+
+def rle_decode(values, lengths, shape):
+    """
+    Inverse of rle_encode
+    """
+    return np.reshape(np.repeat(values, lengths), shape, order="F")
+
+
+def get_lattice_ids(steppable):
+    """
+    Returns the cell ID of every pixel (0 for the medium)
+    """
+    ids = np.zeros((steppable.dim.x, steppable.dim.y, steppable.dim.z), dtype=np.int64)
+    for cell in steppable.cell_list:
+        for tracker in steppable.get_cell_pixel_list(cell):
+            ids[tracker.pixel.x, tracker.pixel.y, tracker.pixel.z] = cell.id
+    return ids
+
+
+def _get_fpp_links(steppable):
+    try:
+        links = steppable.get_fpp_links()
+    except (AttributeError, RuntimeError):
+        return []
+    return [(link.getObj0().id, link.getObj1().id, link.getLambdaDistance(), link.getTargetDistance(),
+             link.getMaxDistance()) for link in links]
+
+
+def save_checkpoint(steppable, directory, mcs, field_names=(), chemotaxis_fields=(), total_steps=None, keep=2):
+    """
+    Saves the simulation state to `directory`/checkpoint_<mcs>.pkl (written atomically) and records it as the latest.
+
+    The state is the run-length encoded cell lattice, the fields, each cell's type, volume and surface constraints,
+    cell.dict (pickled together, so shared objects such as PhenoCellPy phenotype templates stay shared), the chemotaxis
+    lambdas of `chemotaxis_fields`, the FPP links, the random streams (see get_random_streams) and the coarse grid
+    fields (see CoarseDiffusion). Only the `keep` most recent checkpoints are kept.
+
+    Parameters
+    ----------
+    steppable : SteppableBasePy
+        Any steppable of the simulation
+    directory : str or pathlib.Path
+        Checkpoint folder
+    mcs : int
+        Number of MCS completed (including previous segments)
+    field_names : list, optional
+        Diffusing fields to save
+    chemotaxis_fields : list, optional
+        Fields whose per cell chemotaxis lambdas are saved
+    total_steps : int, optional
+        Total number of MCS of the run, used by run_segments
+    keep : int, optional
+        Number of checkpoints kept. Default 2
+
+    Returns
+    -------
+    pathlib.Path
+        The checkpoint file
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    values, lengths = rle_encode(get_lattice_ids(steppable))
+    cells = []
+    for cell in steppable.cell_list:
+        lambdas = {}
+        for field_name in chemotaxis_fields:
+            try:
+                data = steppable.chemotaxisPlugin.getChemotaxisData(cell, field_name)
+            except AttributeError:
+                break
+            if data:
+                lambdas[field_name] = data.getLambda()
+        cells.append({"id": cell.id, "type": cell.type, "targetVolume": cell.targetVolume,
+                      "lambdaVolume": cell.lambdaVolume, "targetSurface": cell.targetSurface,
+                      "lambdaSurface": cell.lambdaSurface, "dict": dict(cell.dict), "chemotaxis": lambdas})
+    fields = {name: np.array(getattr(steppable.field, name)[:, :, :]) for name in field_names}
+    state = {"mcs": mcs, "total_steps": total_steps, "lattice": (values, lengths),
+             "shape": (steppable.dim.x, steppable.dim.y, steppable.dim.z), "cells": cells, "fields": fields,
+             "fpp_links": _get_fpp_links(steppable),
+             "random": (steppable.shared_steppable_vars.get("random_streams"), np.random.get_state())}
+    engine = steppable.shared_steppable_vars.get("coarse_diffusion")
+    if engine is not None:
+        state["coarse_fields"] = engine.get_state()
+
+    path = directory.joinpath(f"checkpoint_{mcs:012d}.pkl")
+    temporary = path.with_suffix(".tmp")
+    with open(temporary, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+    with open(directory.joinpath("latest.txt"), "w") as f:
+        f.write(f"{path.name}\n{mcs}\n{total_steps}\n")
+
+    for old in sorted(directory.glob("checkpoint_*.pkl"))[:-keep]:
+        old.unlink()
+    return path
+
+
+def find_checkpoint(directory):
+    """
+    Returns (path, mcs, total steps) of the latest checkpoint in `directory`, None if there is none
+    """
+    latest = Path(directory).joinpath("latest.txt")
+    if not latest.exists():
+        return None
+    name, mcs, total = latest.read_text().split("\n")[:3]
+    path = Path(directory).joinpath(name)
+    if not path.exists():
+        return None
+    return path, int(mcs), None if total == "None" else int(total)
+
+
+def load_checkpoint(steppable, path):
+    """
+    Replaces the simulation state with a checkpoint saved by save_checkpoint. Cells get new IDs, everything else is
+    restored. Call it from the start of the last registered steppable so the other steppables' initialization is
+    overwritten.
+
+    Returns
+    -------
+    int
+        Number of MCS completed when the checkpoint was saved
+    """
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+
+    for cell in list(steppable.cell_list):
+        steppable.delete_cell(cell)
+
+    new_cells = {}
+    for data in state["cells"]:
+        cell = steppable.new_cell(data["type"])
+        for attribute in ("targetVolume", "lambdaVolume", "targetSurface", "lambdaSurface"):
+            setattr(cell, attribute, data[attribute])
+        cell.dict.update(data["dict"])
+        new_cells[data["id"]] = (cell, data)
+
+    # one slice assignment per run of a cell along x, not one call per pixel
+    nx, ny = state["shape"][0], state["shape"][1]
+    values, lengths = state["lattice"]
+    ends = np.cumsum(lengths)
+    for value, start, end in zip(values, ends - lengths, ends):
+        if not value:
+            continue
+        cell = new_cells[int(value)][0]
+        while start < end:
+            row, x0 = divmod(int(start), nx)
+            x1 = min(nx, x0 + int(end - start))
+            steppable.cell_field[x0:x1, row % ny, row // ny] = cell
+            start += x1 - x0
+
+    for cell, data in new_cells.values():
+        for field_name, lam in data["chemotaxis"].items():
+            steppable.chemotaxisPlugin.addChemotaxisData(cell, field_name).setLambda(lam)
+
+    for id0, id1, lambda_distance, target_distance, max_distance in state["fpp_links"]:
+        if id0 in new_cells.keys() and id1 in new_cells.keys():
+            steppable.new_fpp_link(new_cells[id0][0], new_cells[id1][0], lambda_distance, target_distance,
+                                   max_distance)
+
+    for name, values in state["fields"].items():
+        getattr(steppable.field, name)[:, :, :] = values
+
+    streams, global_state = state.get("random", (None, None))
+    if streams is not None:
+        # updated in place, the steppables keep references to the dictionary
+        steppable.shared_steppable_vars.setdefault("random_streams", {}).update(streams)
+    if global_state is not None:
+        np.random.set_state(global_state)
+
+    engine = steppable.shared_steppable_vars.get("coarse_diffusion")
+    if engine is not None and state.get("coarse_fields") is not None:
+        engine.set_state(state["coarse_fields"])
+
+    population = steppable.shared_steppable_vars.get("population")
+    if population is not None:
+        # the recorder counted the cells of the initial configuration
+        population.counts[:] = 0
+        for cell in steppable.cell_list:
+            phase = cell.dict['current_phenotype'].current_phase.index if 'current_phenotype' in cell.dict.keys() \
+                else None
+            population.cell_added(cell.type, phase)
+    return state["mcs"]
+
+
+def run_segments(command, checkpoint_directory, segment_mcs, max_failures=3):
+    """
+    Runs a simulation as restartable segments of `segment_mcs` MCS.
+
+    `command` (e.g. ["runScript", "-i", "model.cc3d"]) is run until the latest checkpoint reaches the total number of
+    steps. Each run restores the latest checkpoint of `checkpoint_directory` (the PC2CC3D_RESTART and
+    PC2CC3D_CHECKPOINT_DIR environment variables of the generated CheckpointSteppable), saves one and stops after
+    `segment_mcs` MCS, so a crash only loses the current segment.
+    """
+    env = dict(os.environ, PC2CC3D_SEGMENT_MCS=str(segment_mcs), PC2CC3D_RESTART="1",
+               PC2CC3D_CHECKPOINT_DIR=str(Path(checkpoint_directory).resolve()))
+    failures = 0
+    while True:
+        before = find_checkpoint(checkpoint_directory)
+        if before is not None and before[2] is not None and before[1] >= before[2]:
+            print(f"Simulation complete, {before[1]} MCS")
+            return
+        result = subprocess.run(command, env=env)
+        after = find_checkpoint(checkpoint_directory)
+        progress = after is not None and (before is None or after[1] > before[1])
+        if result.returncode != 0 or not progress:
+            failures += 1
+            print(f"Segment failed (return code {result.returncode}), {failures}/{max_failures}")
+            if failures >= max_failures:
+                raise RuntimeError("too many failed segments")
+        else:
+            failures = 0
+            print(f"Segment done, {after[1]} MCS completed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a converted simulation as restartable segments")
+    parser.add_argument("segment", type=int, help="Number of MCS per segment")
+    parser.add_argument("command", nargs="+", help="Command running the simulation, e.g. runScript -i model.cc3d")
+    parser.add_argument("-d", "--checkpoints", default=str(Path(__file__).parent.joinpath("checkpoints")),
+                        help="Checkpoint folder. Defaults to checkpoints next to this file")
+    args = parser.parse_args()
+    run_segments(args.command, args.checkpoints, args.segment)